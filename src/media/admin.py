@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import MediaFile
+
+
+@admin.register(MediaFile)
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'mediatype', 'timestamp', 'size')
+    list_filter = ('mediatype', 'prefix')
+    search_fields = ('path', 'hash')
+    date_hierarchy = 'timestamp'
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def setSqlitePragmas(sender, connection, **kwargs):
+    """ Puts SQLite databases in WAL mode, so that catalog writes do not block readers """
+    if connection.vendor=='sqlite':
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL;')
+        cursor.execute('PRAGMA synchronous=NORMAL;')
+
+
+class MediaConfig(AppConfig):
+    name = 'media'
+    verbose_name = 'Media catalog'
+
+    def ready(self):
+        connection_created.connect(setSqlitePragmas, dispatch_uid='media.setSqlitePragmas')
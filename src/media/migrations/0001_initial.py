@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('prefix', models.CharField(blank=True, max_length=16)),
+                ('mediatype', models.CharField(blank=True, max_length=32)),
+                ('timestamp', models.DateTimeField(blank=True, null=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.DateTimeField()),
+                ('hash', models.CharField(blank=True, db_index=True, max_length=128)),
+            ],
+            options={
+                'ordering': ['timestamp', 'path'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='mediafile',
+            index_together=set([('prefix', 'timestamp')]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import models
+
+
+class MediaFile(models.Model):
+    """
+    Catalog entry for a file stored on the media archive
+    Entries are written by the importing routines (see mediautils.catalog module), so that
+    questions about archive contents are answered without walking the archive tree
+    """
+    path = models.CharField(max_length=1024, unique=True)
+    prefix = models.CharField(max_length=16, blank=True)
+    mediatype = models.CharField(max_length=32, blank=True)
+    timestamp = models.DateTimeField(null=True, blank=True) # datetime encoded on file index
+    size = models.BigIntegerField()
+    mtime = models.DateTimeField()
+    hash = models.CharField(max_length=128, blank=True, db_index=True)
+
+    class Meta:
+        index_together = [('prefix', 'timestamp')]
+        ordering = ['timestamp', 'path']
+
+    def __str__(self):
+        return self.path
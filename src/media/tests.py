@@ -0,0 +1,62 @@
+import os, sys, shutil, tempfile
+
+from django.test import TestCase
+
+from .models import MediaFile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mediautils'))
+import catalog
+import indexing as indx
+import preferences as prefs
+from fdmgm import File
+
+
+class CatalogWriterTests(TestCase):
+    validType = next(iter(prefs.INDEX_PREFIX.keys()))
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(5):
+            fpath = os.path.join(self.dir, indx.genIndex(prefs.INDEX_PREFIX[self.validType], 252353423.0+i, i)+'.dat')
+            with open(fpath, 'wb') as f:
+                f.write(os.urandom(128))
+            self.files.append(File(fpath))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_writer_records_files_in_batches(self):
+        """ Entries are written when batch fills up and on close """
+        writer = catalog.CatalogWriter(batchSize=2)
+        for f in self.files:
+            writer.add(f)
+        self.assertEqual(4, MediaFile.objects.count())
+        writer.close()
+        self.assertEqual(5, MediaFile.objects.count())
+        entry = MediaFile.objects.get(path=self.files[0].getPath())
+        self.assertEqual(prefs.INDEX_PREFIX[self.validType], entry.prefix)
+        self.assertEqual(self.validType, entry.mediatype)
+        self.assertEqual(128, entry.size)
+
+    def test_writer_replaces_entries_of_same_path(self):
+        """ Recording a path again replaces its entry """
+        with catalog.CatalogWriter() as writer:
+            writer.add(self.files[0])
+        with open(self.files[0].getPath(), 'ab') as f:
+            f.write(b'more')
+        self.files[0].invalidateCache()
+        with catalog.CatalogWriter() as writer:
+            writer.add(self.files[0])
+        self.assertEqual(1, MediaFile.objects.count())
+        self.assertEqual(132, MediaFile.objects.get().size)
+
+    def test_queries_by_prefix_and_period(self):
+        """ Catalog answers questions about archive contents """
+        with catalog.CatalogWriter() as writer:
+            for f in self.files:
+                writer.add(f)
+        ts = MediaFile.objects.order_by('timestamp').first().timestamp
+        count = MediaFile.objects.filter(prefix=prefs.INDEX_PREFIX[self.validType],
+                                         timestamp__year=ts.year, timestamp__month=ts.month).count()
+        self.assertEqual(5, count)
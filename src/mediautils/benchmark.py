@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+This module measures the performance of the package routines on synthetic
+media archives, so that regressions can be spotted by comparing runs
+
+A synthetic archive follows the media database layout (PREFIX/YYYY/MM), with
+indexed files of every media type: many small files and a few large ones,
+which are created sparse so that big archives are generated quickly. Results
+are written as JSON
+
+Usage:
+    python benchmark.py --small 100000 --large 10 -o run.json
+
+Name:        CARIAMA Benchmark Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, sys, json, time, random, shutil, tempfile, platform, argparse
+import indexing as indx
+import hashing
+from fdmgm import File, Directory, importFile
+from preferences import INDEX_PREFIX, IMPORTING_ORGANIZE_BY, MEDIA_DB_DIR_STRUCTURE
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+""" Benchmarks available, in running order """
+BENCHMARKS = ('getFiles', 'getSize', 'checkIntegrity', 'parseIndex', 'genIndex', 'copyTo', 'importFile')
+
+# first timestamp of generated archives (2013-01-01, UTC)
+ARCHIVE_START_TS = 1356998400
+
+
+def generateArchive(rootPath, smallFiles=1000, largeFiles=2, smallSize=4096, largeSize=64*2**20, years=3, seed=0):
+    """
+    Generates a synthetic media archive, with the media database layout (PREFIX/YYYY/MM)
+    Files are validly indexed and their dates match their indexes. Small files have distinct contents; large ones are sparse
+    @param rootPath: Root of archive. It is created if it does not exist
+    @param smallFiles: Number of small files
+    @param largeFiles: Number of large (sparse) files
+    @param smallSize: Size of small files, in bytes. Actual sizes vary up to twice this value
+    @param largeSize: Size of large files, in bytes
+    @param years: Number of years spanned by file dates
+    @param seed: Random seed, so that the same parameters generate the same archive
+    @return: Dictionary with the number of files and directories generated, and total size
+    """
+    rng = random.Random(seed)
+    mediaTypes = sorted(INDEX_PREFIX)
+    total = smallFiles+largeFiles
+    span = years*365*86400
+    step = max(1, span//max(total, 1))
+    organize = IMPORTING_ORGANIZE_BY[MEDIA_DB_DIR_STRUCTURE]
+    pool = bytes(rng.getrandbits(8) for _ in range(2*smallSize+64))
+
+    largePositions = set(rng.sample(range(total), largeFiles))
+    dirs, totalSize = set(), 0
+    for i in range(total):
+        mediaType = mediaTypes[i%len(mediaTypes)]
+        timestamp = ARCHIVE_START_TS+i*step+rng.randrange(step) # distinct seconds, so indexes never clash
+        large = i in largePositions
+        size = largeSize if large else smallSize+rng.randrange(smallSize+1)
+        dstDir = organize(rootPath, _GeneratedFile(mediaType, timestamp))
+        if dstDir not in dirs:
+            os.makedirs(dstDir, exist_ok=True)
+            dirs.add(dstDir)
+        fpath = os.path.join(dstDir, indx.genIndex(INDEX_PREFIX[mediaType], timestamp, size)+'.dat')
+        with open(fpath, 'wb') as f:
+            if large:
+                f.truncate(size)
+            else:
+                offset = rng.randrange(len(pool)-size)
+                f.write(i.to_bytes(8, 'little')+pool[offset:offset+size-8])
+        os.utime(fpath, (timestamp, timestamp))
+        totalSize += size
+    return {'files':total, 'smallFiles':smallFiles, 'largeFiles':largeFiles, 'dirs':len(dirs), 'bytes':totalSize}
+
+class _GeneratedFile:
+    """ Stand-in for a File inside organizational methods, while the file is being generated """
+    def __init__(self, mediaType, timestamp):
+        self.__mediaType = mediaType
+        self.__timestamp = timestamp
+
+    def getMediaType(self):
+        return self.__mediaType
+
+    def getDatetime(self):
+        return self.__timestamp
+
+
+def measure(func, repeat=3, setup=None, items=1, nbytes=None):
+    """
+    Times a routine
+    @param func: Routine to be timed, called with no arguments
+    @param repeat: Number of timed runs
+    @param setup: Routine called (untimed) before each run. Defaults to None
+    @param items: Number of items handled by each run, for throughput
+    @param nbytes: Number of bytes handled by each run, for throughput. Defaults to None
+    @return: Dictionary with run times (seconds), best and mean times, and throughputs based on best time
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+    best = min(times)
+    res = {'repeat':repeat, 'times':times, 'best':best, 'mean':sum(times)/len(times), 'items':items,
+           'itemsPerSec':items/best if best>0 else None}
+    if nbytes is not None:
+        res['bytes'] = nbytes
+        res['mbPerSec'] = nbytes/best/2**20 if best>0 else None
+    return res
+
+def runBenchmarks(archivePath, workPath, names=BENCHMARKS, repeat=3, sample=200):
+    """
+    Runs benchmarks against a generated archive
+    @param archivePath: Root of archive (see generateArchive())
+    @param workPath: Scratch directory for copying and importing benchmarks. Its contents are removed
+    @param names: Names of benchmarks to run, from BENCHMARKS
+    @param repeat: Number of timed runs of each benchmark
+    @param sample: Number of small files copied and imported by copyTo and importFile benchmarks
+    @return: Dictionary of benchmark name -> results (see measure())
+    @raise ValueError: If some benchmark name is unknown
+    """
+    unknown = set(names)-set(BENCHMARKS)
+    if unknown:
+        raise ValueError("Unknown benchmarks: %s"%", ".join(sorted(unknown)))
+
+    archive = Directory(archivePath)
+    files = archive.getFiles()
+    fileNames = [f.getName() for f in files]
+    totalSize = sum(f.getSize() for f in files)
+    largeSize = max(f.getSize() for f in files) if files else 0
+    smallFiles = sorted((f for f in files if f.getSize()<largeSize), key=lambda f: f.getPath())[:sample]
+    largeFiles = [f for f in files if f.getSize()==largeSize][:1]
+    toCopy = smallFiles+largeFiles
+    copySize = sum(f.getSize() for f in toCopy)
+    genArgs = [(INDEX_PREFIX[f.getMediaType()], f.getDatetime(), f.getSize()) for f in files]
+
+    def removeWork():
+        for dirPath, _, _ in os.walk(workPath): # so that hash indexes of scratch directories are not left behind
+            hashing.removeHashIndex(dirPath)
+        shutil.rmtree(workPath, ignore_errors=True)
+
+    def cleanWork():
+        removeWork()
+        os.makedirs(workPath)
+
+    def copyAll():
+        for n, f in enumerate(toCopy):
+            f.copyTo(os.path.join(workPath, "%d%s"%(n, f.getExt())))
+
+    def importAll():
+        for f in toCopy:
+            importFile(File(f.getPath()), workPath, organizeBy=MEDIA_DB_DIR_STRUCTURE)
+
+    benchmarks = {
+        'getFiles': lambda: measure(lambda: Directory(archivePath).getFiles(), repeat, items=len(files)),
+        'getSize': lambda: measure(lambda: Directory(archivePath).getSize(), repeat, items=len(files), nbytes=totalSize),
+        'checkIntegrity': lambda: measure(lambda: Directory(archivePath).checkIntegrity(), repeat, items=len(files)),
+        'parseIndex': lambda: measure(lambda: [indx.parseIndex(name) for name in fileNames], repeat, items=len(fileNames)),
+        'genIndex': lambda: measure(lambda: [indx.genIndex(*args) for args in genArgs], repeat, items=len(genArgs)),
+        'copyTo': lambda: measure(copyAll, repeat, setup=cleanWork, items=len(toCopy), nbytes=copySize),
+        'importFile': lambda: measure(importAll, repeat, setup=cleanWork, items=len(toCopy), nbytes=copySize),
+        }
+
+    results = {}
+    try:
+        for name in BENCHMARKS:
+            if name in names:
+                results[name] = benchmarks[name]()
+    finally:
+        removeWork()
+    return results
+
+def environment():
+    """ Describes the machine and interpreter a run was made on (dict) """
+    return {'python':platform.python_version(), 'implementation':platform.python_implementation(),
+            'platform':platform.platform(), 'machine':platform.machine(), 'cpus':os.cpu_count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks CARIAMA media archive utilities on a synthetic archive")
+    parser.add_argument('--root', help="directory where archive is generated (or reused, with --reuse). Defaults to a temporary directory")
+    parser.add_argument('--reuse', help="benchmark an archive previously generated on --root", action="store_true")
+    parser.add_argument('--keep', help="do not remove generated archive", action="store_true")
+    parser.add_argument('--small', help="number of small files. Defaults to 1000", type=int, default=1000)
+    parser.add_argument('--large', help="number of large (sparse) files. Defaults to 2", type=int, default=2)
+    parser.add_argument('--small-size', help="size of small files, in KB. Defaults to 4", type=int, default=4)
+    parser.add_argument('--large-size', help="size of large files, in MB. Defaults to 64", type=int, default=64)
+    parser.add_argument('--seed', help="random seed. Defaults to 0", type=int, default=0)
+    parser.add_argument('-r','--repeat', help="timed runs of each benchmark. Defaults to 3", type=int, default=3)
+    parser.add_argument('--sample', help="small files copied and imported by copyTo and importFile. Defaults to 200", type=int, default=200)
+    parser.add_argument('-b','--bench', help="benchmarks to run. Defaults to all", nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('-o','--output', help="JSON output file. Defaults to standard output")
+    args = parser.parse_args(argv)
+
+    rootPath = args.root if args.root is not None else tempfile.mkdtemp(prefix='cariama-bench-')
+    archivePath = os.path.join(rootPath, 'archive')
+    workPath = os.path.join(rootPath, 'work')
+    params = {'small':args.small, 'large':args.large, 'smallSize':args.small_size*2**10, 'largeSize':args.large_size*2**20,
+              'seed':args.seed, 'repeat':args.repeat, 'sample':args.sample}
+    try:
+        if args.reuse:
+            archive = {'reused':True}
+        else:
+            if os.path.exists(archivePath):
+                parser.error("archive already exists on %s (use --reuse)"%archivePath)
+            start = time.perf_counter()
+            archive = generateArchive(archivePath, args.small, args.large, params['smallSize'], params['largeSize'], seed=args.seed)
+            archive['generationTime'] = time.perf_counter()-start
+        results = runBenchmarks(archivePath, workPath, args.bench, args.repeat, args.sample)
+    finally:
+        if not args.keep and not args.reuse:
+            shutil.rmtree(archivePath if args.root is not None else rootPath, ignore_errors=True)
+
+    report = {'timestamp':time.time(), 'environment':environment(), 'params':params, 'archive':archive, 'results':results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+if __name__=="__main__":
+    main()
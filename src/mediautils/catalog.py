@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+This module feeds the media catalog of the cariama Django project (media app)
+with the files written to the archive
+
+Rows are buffered and written in bulk, in a single transaction per batch.
+Django is only loaded when the first batch is written, so that importing
+routines which do not use the catalog do not depend on it
+
+Content digests come from the checksum computed while copying, if any, or
+otherwise from the hash index of the file directory (see hashing module),
+which only reads files whose digests are not known yet
+
+Name:        CARIAMA Media Catalog Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, sys, datetime, threading
+import indexing as indx
+import hashing
+from preferences import HASH_ALGORITHM
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_MODULE = 'cariama.settings'
+
+_setupLock = threading.Lock()
+_ready = False
+
+def setupDjango():
+    """
+    Configures Django for standalone use of the cariama project models, once per process
+    @raise ImportError: If Django is not installed
+    """
+    global _ready
+    with _setupLock:
+        if _ready:
+            return
+        if PROJECT_ROOT not in sys.path:
+            sys.path.append(PROJECT_ROOT)
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', SETTINGS_MODULE)
+        import django
+        django.setup()
+        _ready = True
+
+def _toDatetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+def fileRecord(f):
+    """
+    Gathers catalog fields of a file
+    @param f: File object
+    @return: Dictionary with MediaFile field values
+    """
+    st = f.getStat()
+    record = {
+              'path': os.path.abspath(f.getPath()),
+              'prefix': '',
+              'mediatype': f.getMediaType() or '',
+              'timestamp': None,
+              'size': st.st_size,
+              'mtime': _toDatetime(st.st_mtime),
+              'hash': '',
+              }
+    try:
+        parsed = indx.parseIndex(f.getName(), ignoreErrors=True)
+    except indx.ParserError: # file is not indexed
+        parsed = {}
+    record['prefix'] = parsed.get('pref', '')
+    if not record['mediatype']:
+        record['mediatype'] = parsed.get('mediatype', '')
+    if 'datets' in parsed:
+        record['timestamp'] = _toDatetime(parsed['datets'])
+
+    checksum = f.getChecksum()
+    if checksum is not None and checksum[0]==HASH_ALGORITHM:
+        record['hash'] = checksum[1]
+    else:
+        try:
+            record['hash'] = hashing.getHashIndex(f.getDir()).getDigest(os.path.basename(f.getPath()))
+        except OSError: # vanished or unreadable; recorded without digest
+            pass
+    return record
+
+
+class CatalogWriter:
+    """
+    Buffered writer of media catalog entries. Thread safe
+
+    Entries are written when the buffer reaches batchSize, on flush() and on close(). Entries for paths
+    already on the catalog replace the old ones
+
+    Args:
+        batchSize(int, optional): Number of entries written per transaction. Defaults to 500
+        using(str, optional): Django database alias. Defaults to 'default'
+
+    Attributes:
+        private buffer: List of pending records
+        private written: Number of entries written so far
+    """
+    def __init__(self, batchSize=500, using='default'):
+        self.__batchSize = batchSize
+        self.__using = using
+        self.__buffer = []
+        self.__written = 0
+        self.__lock = threading.Lock()
+
+    def add(self, f):
+        """
+        Queues a catalog entry for a file
+        @param f: File object, already on its final path
+        """
+        record = fileRecord(f)
+        with self.__lock:
+            self.__buffer.append(record)
+            if len(self.__buffer)>=self.__batchSize:
+                self.__flush()
+
+    def flush(self):
+        """ Writes pending entries to catalog """
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        if not self.__buffer:
+            return
+        setupDjango()
+        from django.db import transaction
+        from media.models import MediaFile
+
+        records = {r['path']:r for r in self.__buffer} # last record of a path wins
+        with transaction.atomic(using=self.__using):
+            MediaFile.objects.using(self.__using).filter(path__in=list(records)).delete()
+            MediaFile.objects.using(self.__using).bulk_create([MediaFile(**r) for r in records.values()], batch_size=self.__batchSize)
+        self.__written += len(records)
+        self.__buffer = []
+
+    def remove(self, paths):
+        """
+        Removes catalog entries, after writing pending ones
+        @param paths: Iterable of file paths
+        @return: Number of entries removed (int)
+        """
+        paths = [os.path.abspath(p) for p in paths]
+        with self.__lock:
+            self.__flush()
+            if not paths:
+                return 0
+            setupDjango()
+            from django.db import transaction
+            from media.models import MediaFile
+
+            count = 0
+            with transaction.atomic(using=self.__using):
+                for i in range(0, len(paths), self.__batchSize):
+                    count += MediaFile.objects.using(self.__using).filter(path__in=paths[i:i+self.__batchSize]).delete()[0]
+            return count
+
+    def getWrittenCount(self):
+        """ Retrieves the number of entries written so far (int) """
+        return self.__written
+
+    def close(self):
+        """ Writes pending entries. Writer may still be used afterwards """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+This module gathers the backends used to copy file contents
+
+Backends are tried in order of preference, and the first one supported
+by the platform and the filesystems involved does the copy:
+    reflink         - FICLONE ioctl: destination shares source blocks (btrfs, xfs, ...)
+    copy_file_range - in-kernel copy, offloaded to the filesystem when possible
+    sendfile        - in-kernel copy between file descriptors
+    buffered        - plain read/write loop through Python buffers
+
+If a backend fails after copying part of the file, the next one resumes
+from where it stopped. When contents must be hashed while copying, data
+has to go through Python, and only the buffered backend is used
+
+Name:        CARIAMA File Copying Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, errno, shutil
+from preferences import COPY_BACKENDS
+
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+FICLONE = 0x40049409 # linux/fs.h: _IOW(0x94, 9, int)
+
+# errors meaning that a backend cannot be used for this pair of files
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                      errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+
+class BackendUnsupportedError(OSError):
+    pass
+
+
+def _reflink(fsrc, fdst, offset, size, bufferSize):
+    if fcntl is None or offset!=0:
+        raise BackendUnsupportedError(errno.ENOSYS, "reflink not available")
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRNOS:
+            raise BackendUnsupportedError(e.errno, "reflink not supported")
+        raise
+    return size
+
+def _copyFileRange(fsrc, fdst, offset, size, bufferSize):
+    if not hasattr(os, 'copy_file_range'):
+        raise BackendUnsupportedError(errno.ENOSYS, "copy_file_range not available")
+    return _kernelLoop(lambda count, off: os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, off, off), offset, size)
+
+def _sendfile(fsrc, fdst, offset, size, bufferSize):
+    if not hasattr(os, 'sendfile') or os.name!='posix':
+        raise BackendUnsupportedError(errno.ENOSYS, "sendfile not available")
+    def send(count, off):
+        os.lseek(fdst.fileno(), off, os.SEEK_SET)
+        return os.sendfile(fdst.fileno(), fsrc.fileno(), off, count)
+    return _kernelLoop(send, offset, size)
+
+def _kernelLoop(call, offset, size, chunkSize=1<<30):
+    """ Calls an in-kernel copy primitive until size bytes are copied; returns reached offset """
+    while offset<size:
+        try:
+            copied = call(min(chunkSize, size-offset), offset)
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                e = BackendUnsupportedError(e.errno, e.strerror)
+                e.offset = offset
+                raise e
+            raise
+        if copied==0: # no data at offset: some filesystems (FUSE, procfs, ...) report 0 at once, or source shrank
+            e = BackendUnsupportedError(errno.ENODATA, "no data copied at offset %d of %d"%(offset, size))
+            e.offset = offset
+            raise e
+        offset += copied
+    return offset
+
+def _buffered(fsrc, fdst, offset, size, bufferSize):
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    shutil.copyfileobj(fsrc, fdst, bufferSize)
+    return fdst.tell()
+
+BACKENDS = {
+            'reflink': _reflink,
+            'copy_file_range': _copyFileRange,
+            'sendfile': _sendfile,
+            'buffered': _buffered,
+            }
+
+
+def _bufferedHashing(fsrc, fdst, hasher, bufferSize):
+    buf = bytearray(bufferSize)
+    view = memoryview(buf)
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            break
+        hasher.update(view[:n])
+        fdst.write(view[:n])
+    return fdst.tell()
+
+def _checkCopied(offset, size):
+    """ Makes sure that exactly size bytes were copied """
+    if offset!=size:
+        raise OSError(errno.EIO, "Copied %d bytes of %d (source changed while copying)"%(offset, size))
+
+def copyFileData(fsrc, fdst, size, bufferSize=10485760, backends=COPY_BACKENDS, hasher=None):
+    """
+    Copies contents from one open file to another, using the first backend that works
+    @param fsrc: Source file object, opened for binary reading
+    @param fdst: Destination file object, opened for binary writing and empty
+    @param size: Size of source file, in bytes
+    @param bufferSize: Buffer size for the buffered backend. Defaults to 10MB
+    @param backends: Names of the backends to try, in order. Default defined on preferences module
+    @param hasher: hashlib object to be fed with the data stream while copying. If set, the buffered backend is used
+    @return: Name of the backend that completed the copy (str)
+    @raise ValueError: If an unknown backend is requested
+    @raise OSError: If copying fails for other reasons than backend support, or if the amount of data copied
+    does not match size (errno EIO), as when source changed while copying
+    """
+    if hasher is not None:
+        offset = _bufferedHashing(fsrc, fdst, hasher, bufferSize)
+        _checkCopied(offset, size)
+        return 'buffered'
+    
+    offset = 0
+    for name in backends:
+        try:
+            backend = BACKENDS[name]
+        except KeyError:
+            raise ValueError("Unknown copy backend: %s"%name)
+        try:
+            offset = backend(fsrc, fdst, offset, size, bufferSize)
+            _checkCopied(offset, size)
+            return name
+        except BackendUnsupportedError as e:
+            offset = getattr(e, 'offset', offset)
+
+    # the buffered loop is always the last resort
+    offset = _buffered(fsrc, fdst, offset, size, bufferSize)
+    _checkCopied(offset, size)
+    return 'buffered'
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+"""
+This module finds duplicates of a file anywhere on an archive, so that a
+file already archived under another directory (e.g. another month, because
+of a wrong camera clock) is not imported again
+
+Contents of archived files are kept on a hash catalog (an SQLite database of
+digest, size and path of each file) in the package state directory, fronted
+by two Bloom filters: one of file sizes and one of digests. A file whose size
+is not on the sizes filter is not even hashed, and the catalog is only looked
+up when the digests filter reports a possible match, so that the cost of a
+lookup does not depend on archive size. Filters are persisted as raw bit
+arrays when the catalog is closed, and loaded with a single read; filters
+left behind by catalog changes (e.g. after a crash) are rebuilt from it
+
+Bloom filters do not support removal: entries of removed files are dropped
+from the catalog only, and their stale bits just cause a few more catalog
+lookups until filters are rebuilt (which happens when they fill up)
+
+Name:        CARIAMA Archive Deduplication Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, math, struct, sqlite3, hashlib, threading
+import hashing, metrics
+from scanning import ArchiveScanner, archiveExcludes
+from preferences import DEDUP_STATE_ROOT, DEDUP_BLOOM_CAPACITY, DEDUP_BLOOM_ERROR_RATE, HASH_ALGORITHM, HASH_WORKERS
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,   -- relative to archive root
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_by_digest ON hashes (digest);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class BloomFilter:
+    """
+    Set membership filter with no false negatives, and a bounded rate of false positives
+
+    Args:
+        capacity(int): Number of keys the filter is sized for
+        errorRate(float, optional): False positive rate once filter holds capacity keys. Defaults to 0.001
+
+    Attributes:
+        private bits: Bit array
+        private count: Number of keys added
+    """
+    MAGIC = b'CBLM'
+    HEADER = struct.Struct('<4sQIQQ') # magic, number of bits, number of hashes, number of keys, generation
+
+    def __init__(self, capacity, errorRate=0.001):
+        capacity = max(1, capacity)
+        self.__capacity = capacity
+        self.__size = max(8, int(math.ceil(-capacity*math.log(errorRate)/math.log(2)**2)))
+        self.__hashes = max(1, int(round(self.__size/capacity*math.log(2))))
+        self.__bits = bytearray((self.__size+7)//8)
+        self.__count = 0
+        self.generation = 0
+
+    def getCapacity(self):
+        """ Retrieves number of keys the filter is sized for (int) """
+        return self.__capacity
+
+    def __len__(self):
+        return self.__count
+
+    def __positions(self, key):
+        """ Bit positions of a key, by double hashing """
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')|1
+        return ((h1+i*h2)%self.__size for i in range(self.__hashes))
+
+    def add(self, key):
+        """
+        Adds a key to the filter
+        @param key: Key (bytes)
+        """
+        for pos in self.__positions(key):
+            self.__bits[pos>>3] |= 1<<(pos&7)
+        self.__count += 1
+
+    def __contains__(self, key):
+        return all(self.__bits[pos>>3]&(1<<(pos&7)) for pos in self.__positions(key))
+
+    def save(self, filePath):
+        """ Writes filter to a file. File is replaced atomically """
+        tmpPath = '%s.%d.tmp'%(filePath, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.__size, self.__hashes, self.__count, self.generation))
+            f.write(self.__bits)
+        os.replace(tmpPath, filePath)
+
+    @classmethod
+    def load(cls, filePath):
+        """
+        Reads a filter written by save()
+        @param filePath: Path to filter file
+        @return: BloomFilter object
+        @raise ValueError: If file is not a valid filter
+        @raise OSError: If file cannot be read
+        """
+        with open(filePath, 'rb') as f:
+            header = f.read(cls.HEADER.size)
+            if len(header)!=cls.HEADER.size:
+                raise ValueError("Invalid Bloom filter file: %s"%filePath)
+            magic, size, hashes, count, generation = cls.HEADER.unpack(header)
+            if magic!=cls.MAGIC or size==0 or hashes==0:
+                raise ValueError("Invalid Bloom filter file: %s"%filePath)
+            self = cls.__new__(cls)
+            self.__bits = bytearray((size+7)//8)
+            if f.readinto(self.__bits)!=len(self.__bits):
+                raise ValueError("Truncated Bloom filter file: %s"%filePath)
+        self.__size, self.__hashes, self.__count, self.generation = size, hashes, count, generation
+        self.__capacity = max(1, int(size*math.log(2)/hashes))
+        return self
+
+
+class ArchiveDedup:
+    """
+    Archive-wide duplicate lookups, through a hash catalog fronted by Bloom filters. Thread safe
+
+    Args:
+        rootPath(str): Path to the root of the archive
+        storeRoot(str, optional): Directory where catalog, filters and scan snapshots are kept. Default defined on preferences module
+        algo(str, optional): Name of the hashing algorithm. Default defined on preferences module
+        capacity(int, optional): Initial number of files filters are sized for. They are doubled when full. Default defined on preferences module
+        errorRate(float, optional): False positive rate of filters. Default defined on preferences module
+        exclude(iterable, optional): Paths under archive root which are not archived, and not indexed. Defaults to None
+            (quarantine and import journal, see scanning.archiveExcludes())
+
+    Attributes:
+        private sizes: Bloom filter of archived file sizes
+        private digests: Bloom filter of archived file digests
+        private generation: Number of catalog changes committed; filters of another generation are stale and rebuilt
+        private reserved: Dict of source path -> (size, digest or None) of files on their way to the archive
+        private sources: Set of paths of all files looked up for importing. They are never taken as duplicates of each other
+    """
+    def __init__(self, rootPath, storeRoot=DEDUP_STATE_ROOT, algo=HASH_ALGORITHM, capacity=DEDUP_BLOOM_CAPACITY, errorRate=DEDUP_BLOOM_ERROR_RATE, exclude=None):
+        self.__rootPath = os.path.abspath(rootPath)
+        self.__exclude = archiveExcludes(self.__rootPath) if exclude is None else list(exclude)
+        self.__storeRoot = storeRoot
+        self.__algo = algo
+        self.__errorRate = errorRate
+        self.__lock = threading.RLock()
+        self.__uncommitted = 0
+        self.__reserved = {}
+        self.__reservedSizes = {}
+        self.__sources = set()
+        os.makedirs(storeRoot, exist_ok=True)
+        self.__db = sqlite3.connect(self.getStorePath()+'.sqlite3', check_same_thread=False)
+        self.__db.executescript(_SCHEMA)
+        meta = dict(self.__db.execute("SELECT key, value FROM meta"))
+        if meta.get('algo', algo)!=algo:
+            raise ValueError("Contents of %s were hashed with %s, not %s"%(self.__rootPath, meta['algo'], algo))
+        with self.__db:
+            self.__db.execute("INSERT OR IGNORE INTO meta VALUES ('algo', ?)", (algo,))
+        self.__generation = int(meta.get('generation', 0))
+        try:
+            self.__sizes = BloomFilter.load(self.getStorePath()+'.sizes.bloom')
+            self.__digests = BloomFilter.load(self.getStorePath()+'.digests.bloom')
+            if self.__sizes.generation!=self.__generation or self.__digests.generation!=self.__generation:
+                raise ValueError("Stale Bloom filters")
+            self.__saved = self.__generation
+        except (OSError, ValueError): # missing, corrupt or written before last changes (e.g. after a crash)
+            self.__rebuildFilters(capacity)
+
+    def getPath(self):
+        """ Retrieves archive root path (str) """
+        return self.__rootPath
+
+    def getAlgorithm(self):
+        """ Retrieves name of the hashing algorithm (str) """
+        return self.__algo
+
+    def getStorePath(self):
+        """ Retrieves path prefix of the catalog and filter files of the archive (str) """
+        key = hashlib.sha1(os.path.normcase(self.__rootPath).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.__storeRoot, key)
+
+    def __len__(self):
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def __rebuildFilters(self, capacity):
+        """ Fills new filters from the catalog """
+        with self.__lock:
+            count = self.__db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            while capacity<count:
+                capacity *= 2
+            self.__sizes = BloomFilter(capacity, self.__errorRate)
+            self.__digests = BloomFilter(capacity, self.__errorRate)
+            for size, digest in self.__db.execute("SELECT size, digest FROM hashes"):
+                self.__sizes.add(self.__sizeKey(size))
+                self.__digests.add(digest.encode('ascii'))
+            self.__saveFilters()
+
+    def __saveFilters(self):
+        for bloom, suffix in ((self.__sizes, '.sizes.bloom'), (self.__digests, '.digests.bloom')):
+            bloom.generation = self.__generation
+            bloom.save(self.getStorePath()+suffix)
+        self.__saved = self.__generation
+
+    @staticmethod
+    def __sizeKey(size):
+        return size.to_bytes(8, 'little')
+
+    def __relPath(self, filePath):
+        relPath = os.path.relpath(os.path.abspath(filePath), self.__rootPath)
+        if relPath==os.curdir or relPath.startswith(os.pardir+os.sep) or relPath==os.pardir:
+            raise ValueError("File %s is not on archive %s"%(filePath, self.__rootPath))
+        return relPath
+
+    def __commit(self):
+        """ Commits catalog changes, moving filters to a new generation """
+        self.__generation += 1
+        self.__db.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(self.__generation),))
+        self.__db.commit()
+        self.__uncommitted = 0
+
+    def update(self, workers=HASH_WORKERS):
+        """
+        Brings catalog up to date with the archive, through an incremental scan. Files added or modified since
+        last update are hashed on a pool of processes (see hashing.hashFiles())
+
+        Args:
+            workers(int, optional): Number of worker processes. Default defined on preferences module
+
+        Returns:
+            ScanDiff namedtuple of added, removed and modified file paths (see scanning module)
+
+        Raises:
+            NotADirectoryError: If archive root is not a directory
+        """
+        scanner = ArchiveScanner(self.__rootPath, storeRoot=os.path.join(self.__storeRoot, 'scans'), exclude=self.__exclude)
+        diff = scanner.scan(save=False)
+        with self.__lock:
+            self.__db.executemany("DELETE FROM hashes WHERE path=?", ((self.__relPath(p),) for p in diff.removed))
+            self.__uncommitted += len(diff.removed)
+        for path, res in hashing.hashFiles(diff.added+diff.modified, self.__algo, workers):
+            if isinstance(res, OSError): # vanished or unreadable; picked up again when its directory changes
+                continue
+            self.add(path, digest=res)
+        self.flush()
+        scanner.save() # only once changes are on the catalog
+        return diff
+
+    def lookup(self, filePath, size=None):
+        """
+        Looks for a file with the same contents as input file anywhere on the archive
+
+        Args:
+            filePath(str): Path of the file to be looked up
+            size(int, optional): Size of input file, if already known
+
+        Returns:
+            Tuple of (path to the duplicate or None, digest of input file or None if it was not hashed)
+        """
+        return self.__lookup(filePath, size, reserve=False)
+
+    def reserve(self, filePath, size=None):
+        """
+        Looks for a file with the same contents as input file on the archive, or on its way to it. If there is none,
+        input file is reserved until it is released (once added, or failed), so that concurrent lookups of the same contents find it.
+        Archived files reserved for importing are not taken as duplicates by later lookups
+
+        Args:
+            filePath(str): Path of the file about to be written to the archive
+            size(int, optional): Size of input file, if already known
+
+        Returns:
+            Tuple of (path to the duplicate or None, digest of input file or None if it was not hashed). A duplicate
+            on its way to the archive is reported by its source path
+        """
+        return self.__lookup(filePath, size, reserve=True)
+
+    def __lookup(self, filePath, size, reserve):
+        if size is None:
+            size = os.path.getsize(filePath)
+        metrics.count('dedup_lookups')
+        digest = None
+        with self.__lock:
+            if reserve:
+                self.__sources.add(os.path.abspath(filePath))
+            sizeMatch = self.__sizeKey(size) in self.__sizes or size in self.__reservedSizes
+            if not sizeMatch:
+                if reserve:
+                    self.__reserve(filePath, size, None)
+                return None, None
+        digest = hashing.hashFile(filePath, self.__algo)
+        with self.__lock:
+            # candidates are picked, and input reserved, at once: of two files with the same contents, the last one finds the first
+            candidates = []
+            if digest.encode('ascii') in self.__digests:
+                metrics.count('dedup_catalog_lookups')
+                # archived files being imported themselves (e.g. from a folder inside the archive) are not duplicates
+                candidates = [path for path in (os.path.join(self.__rootPath, row[0]) for row in self.__db.execute(
+                                "SELECT path FROM hashes WHERE digest=? AND size=? ORDER BY path", (digest, size)))
+                              if path not in self.__sources]
+            candidates += [src for src, (srcSize, srcDigest) in sorted(self.__reserved.items())
+                           if srcSize==size and srcDigest in (None, digest) and src!=filePath]
+            if reserve:
+                self.__reserve(filePath, size, digest)
+        for candPath in candidates:
+            try:
+                if os.path.abspath(filePath)!=os.path.abspath(candPath) and hashing.compareFiles(filePath, candPath):
+                    if reserve:
+                        self.release(filePath)
+                    return candPath, digest
+            except FileNotFoundError: # removed by other means than this package, or reserved file moved meanwhile
+                if candPath.startswith(self.__rootPath+os.sep):
+                    with self.__lock:
+                        self.__db.execute("DELETE FROM hashes WHERE path=?", (os.path.relpath(candPath, self.__rootPath),))
+                        self.__uncommitted += 1
+        return None, digest
+
+    def __reserve(self, filePath, size, digest):
+        self.__reserved[filePath] = (size, digest)
+        self.__reservedSizes[size] = self.__reservedSizes.get(size, 0)+1
+
+    def release(self, filePath):
+        """ Drops the reservation of a file which was not written to the archive """
+        with self.__lock:
+            entry = self.__reserved.pop(filePath, None)
+            if entry is None:
+                return
+            size = entry[0]
+            self.__reservedSizes[size] -= 1
+            if not self.__reservedSizes[size]:
+                del self.__reservedSizes[size]
+
+    def findDuplicate(self, filePath, size=None):
+        """
+        Looks for a file with the same contents as input file anywhere on the archive
+
+        Returns:
+            Path to the duplicate (str), or None if there is no duplicate
+        """
+        return self.lookup(filePath, size)[0]
+
+    def add(self, filePath, size=None, digest=None, commitEvery=64):
+        """
+        Records a file written to the archive. Catalog changes are committed in batches; filters are only
+        persisted by close(), since stale filters are rebuilt from the catalog when loaded
+
+        Args:
+            filePath(str): Path of the archived file
+            size(int, optional): Size of the file, if already known
+            digest(str, optional): Digest of the file, if already known. File is hashed otherwise
+            commitEvery(int, optional): Number of changes between catalog commits. Defaults to 64
+
+        Raises:
+            ValueError: If file is not on the archive
+        """
+        relPath = self.__relPath(filePath)
+        if size is None:
+            size = os.path.getsize(filePath)
+        if digest is None:
+            digest = hashing.hashFile(filePath, self.__algo)
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)", (relPath, size, digest))
+            self.__uncommitted += 1
+            if len(self.__digests)>=self.__digests.getCapacity(): # filters are full; false positive rate would grow
+                self.__commit()
+                self.__rebuildFilters(2*self.__digests.getCapacity())
+            else:
+                self.__sizes.add(self.__sizeKey(size))
+                self.__digests.add(digest.encode('ascii'))
+                if self.__uncommitted>=commitEvery:
+                    self.flush()
+
+    def flush(self):
+        """ Commits catalog changes """
+        with self.__lock:
+            if self.__uncommitted:
+                self.__commit()
+
+    def close(self):
+        """ Commits catalog changes, persists filters and closes catalog """
+        with self.__lock:
+            self.flush()
+            if self.__saved!=self.__generation:
+                self.__saveFilters()
+            self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -14,14 +14,12 @@ Name:        Files and Directories Management Module (FDMGM)
 Package:     CARIAMA Media Archive Utilities
 """
 
-import os, time, stat, shutil, errno
+import os, time, stat, shutil, errno, hashlib, logging
+import collections, concurrent.futures
 import datetime
 import indexing as indx
-import filecmp
-import re
-from preferences import INDEX_PREFIX, IMPORTING_ORGANIZE_BY, INDEX_DATETIME_FORMAT, INDEX_DATETIME_LENGTH
-
-import traceback
+import hashing, copying, metrics
+from preferences import INDEX_PREFIX, IMPORTING_ORGANIZE_BY, INDEX_DATETIME_FORMAT, INDEX_SUFFIX_LENGTH, COPY_BACKENDS, HASH_ALGORITHM
 
 __author__ = "Pedro Correia de Siracusa"
 __copyright__ = "Copyright 2015, CARIAMA project"
@@ -33,6 +31,12 @@ __maintainer__ = "Pedro de Siracusa"
 __email__ = "pedrosiracusa@gmail.com"
 __status__ = "Development"
 
+
+_logger = logging.getLogger(__name__)
+
+# temporary names taken by files of renaming cycles, followed by pid of the renaming process and original file name
+REINDEX_TMP_PREFIX = '.cariama-reindex-'
+
 class File:
     """ 
     Wrapper class for media files 
@@ -44,33 +48,122 @@ class File:
     Attributes:
         private filePath: The path to file on filesystem
         private mediatype: The media type for this file
+        private stat: Cached os.stat_result for the file, or None if not fetched yet
+        private dirEntry: os.scandir entry the object was built from, if any. Used to fetch stat lazily
+        private parsed: Cache of index parsing results for the file name
+        private copyBackend: Name of the backend that copied the file, if it was created by copyTo
+        private checksum: (algorithm, digest) computed while the file was copied, if it was created by copyTo with hashing
+        
+    Note:
+        Metadata is fetched from the filesystem once and then cached. Methods of this class which
+        change the file invalidate the cache; changes made by other means require a call to invalidateCache()
     """
     def __init__(self, filePath, mediaType=None):
         self.__filePath = filePath
         try:
-            if not os.path.isfile(self.__filePath):
+            metrics.count('stat_calls')
+            self.__stat = os.stat(self.__filePath)
+            if not stat.S_ISREG(self.__stat.st_mode):
                 raise FileNotFoundError("File instance could not be linked to input file: file does not exist")
+        except OSError:
+            raise FileNotFoundError("File instance could not be linked to input file: file does not exist")
         except TypeError:
                 raise FileNotFoundError("File instance could not be linked to None input file")  
         
         self.__mediaType = mediaType
+        self.__dirEntry = None
+        self.__parsed = {}
+        self.__copyBackend = None
+        self.__checksum = None
+    
+    @classmethod
+    def fromDirEntry(cls, dirEntry, mediaType=None):
+        """
+        Builds a File instance from an os.scandir entry, without checking the filesystem again
+        
+        Args:
+            dirEntry(os.DirEntry): Entry for a regular file, as yielded by os.scandir
+            mediatype(str, optional): Media file type. Defaults to None
+        
+        Returns:
+            File object
+        """
+        f = cls.__new__(cls)
+        f.__filePath = dirEntry.path
+        f.__mediaType = mediaType
+        f.__stat = None
+        f.__dirEntry = dirEntry
+        f.__parsed = {}
+        f.__copyBackend = None
+        f.__checksum = None
+        return f
+    
+    def invalidateCache(self):
+        """ Discards cached file metadata and index parsing results, so that they are fetched again on next use """
+        self.__stat = None
+        self.__dirEntry = None
+        self.__parsed = {}
+    
+    def getStat(self):
+        """ 
+        Retrieves file status, fetching it from the filesystem only if it is not cached
+        
+        Returns:
+            File status (os.stat_result)
+            
+        Raises:
+            FileNotFoundError: If file does not exist
+        """
+        if self.__stat is None:
+            if self.__filePath is None:
+                raise FileNotFoundError(errno.ENOENT, "File instance is not linked to any file", None)
+            metrics.count('stat_calls')
+            if self.__dirEntry is not None:
+                self.__stat = self.__dirEntry.stat()
+                self.__dirEntry = None
+            else:
+                self.__stat = os.stat(self.__filePath)
+        return self.__stat
+    
+    def __parseName(self, parseExp=None, parseDtFormat=INDEX_DATETIME_FORMAT, ignoreErrors=False):
+        """ 
+        Parses file name as an index, memoizing the results (and failures) for each set of parsing options
+        
+        Returns:
+            Dictionary with parsed contents (dict)
+            
+        Raises:
+            ParserError: If index parsing failed
+        """
+        key = (parseExp, parseDtFormat, ignoreErrors)
+        if key not in self.__parsed:
+            try:
+                if parseExp is None:
+                    self.__parsed[key] = indx.parseIndex(self.getName(), parseDtFormat=parseDtFormat, ignoreErrors=ignoreErrors)
+                else:
+                    self.__parsed[key] = indx.parseIndex(self.getName(), parseExp, parseDtFormat=parseDtFormat, ignoreErrors=ignoreErrors)
+            except indx.ParserError as e:
+                self.__parsed[key] = e
+        res = self.__parsed[key]
+        if isinstance(res, indx.ParserError):
+            raise res
+        return dict(res)
  
     def exists(self):
         """ 
         Checks whether input file path exists. Defaults to instance's filePath attribute 
         
+        Note:
+            This method always checks the filesystem, and refreshes cached file metadata
+        
         Returns:
             True if file exists in filesystem, and False otherwise
         """
-        filePath = self.__filePath
-            
+        self.invalidateCache()
         try:
-            if os.path.isfile(filePath):
-                return True
-            else:
-                return False
-         
-        except TypeError:
+            return stat.S_ISREG(self.getStat().st_mode)
+        except (OSError, TypeError):
+            self.invalidateCache()
             return False       
     
     def getPath(self):
@@ -127,20 +220,19 @@ class File:
         """
         if not fromIndex:
             if mode=="mtime":
-                dt = os.path.getmtime(self.__filePath)
+                dt = self.getStat().st_mtime
             elif mode=="atime":
-                dt = os.path.getatime(self.__filePath)
+                dt = self.getStat().st_atime
             elif mode=="ctime":
-                dt = os.path.getctime(self.__filePath)
+                dt = self.getStat().st_ctime
             else:
                 raise ValueError("Invalid mode: %s"%mode)
             
         else:
-            indxToParse = self.getName()
             # try to parse and raise parser error in case it fails
             if indexRePattern is None:
-                indexRePattern = '(?P<pref>[A-Za-z]+)(?P<date>\d{'+str(INDEX_DATETIME_LENGTH(indexDtFormat))+'}).*' # default index pattern                             
-            dt = indx.parseIndex(indxToParse, parseExp=indexRePattern, parseDtFormat=indexDtFormat, ignoreErrors=True)['datets']
+                indexRePattern = indx.datetimeExpression(indexDtFormat) # default index pattern
+            dt = self.__parseName(indexRePattern, parseDtFormat=indexDtFormat, ignoreErrors=True)['datets']
             # index parsed successfully
             
         
@@ -155,11 +247,27 @@ class File:
         Returns:
             File size in bytes (int)
         """
-        if self.exists():
-            return (os.path.getsize(self.__filePath))
-        else:
+        try:
+            return self.getStat().st_size
+        except FileNotFoundError:
             raise FileNotFoundError("[mediautils.getSize] File not found: %r" %(self.__filePath))
     
+    def getCopyBackend(self):
+        """ Retrieves the name of the backend used to copy this file (see copying module)
+        
+        Returns:
+            Backend name (str), or None if file was not created by copyTo()
+        """
+        return self.__copyBackend
+    
+    def getChecksum(self):
+        """ Retrieves the checksum computed while this file was copied
+        
+        Returns:
+            Tuple (algorithm, hexadecimal digest), or None if file was not created by copyTo() with hashing
+        """
+        return self.__checksum
+    
     def getMediaType(self):
         """ Retrieves file media type
         
@@ -174,9 +282,7 @@ class File:
         mtype = self.__mediaType
         if mtype is None:
             try: 
-                mtype = indx.parseIndex(self.getName(), 
-                                "(?P<pref>[A-Za-z]+).*", 
-                                ignoreErrors=True)['mediatype']
+                mtype = self.__parseName("(?P<pref>[A-Za-z]+).*", ignoreErrors=True)['mediatype']
             except KeyError:
                 pass
             
@@ -211,10 +317,15 @@ class File:
         fileDir = os.path.dirname(self.__filePath)
         fileExt = os.path.splitext(self.__filePath)[1]
         newFilePath = os.path.join(fileDir, name+fileExt)
-        if os.path.isfile(newFilePath):
-            raise FileExistsError("File %r already exists" %(newFilePath))
-        
-        os.rename(self.__filePath, newFilePath)
+        dirIndex = hashing.getHashIndex(fileDir)
+        with dirIndex.getLock(): # no other file may take the new name in between
+            if os.path.isfile(newFilePath) or dirIndex.isReserved(name+fileExt):
+                raise FileExistsError("File %r already exists" %(newFilePath))
+            
+            os.rename(self.__filePath, newFilePath)
+            metrics.count('renames')
+            dirIndex.rename(os.path.basename(self.__filePath), os.path.basename(newFilePath))
+        self.invalidateCache()
         self.__filePath = newFilePath
         
     def setIndex(self, force=False):
@@ -229,7 +340,7 @@ class File:
         """
         # only set index if file is not already indexed
         try: # check if name is a valid index
-            indx.parseIndex(self.getName())
+            self.__parseName()
             if not force:
                 raise indx.FileIndexingError("Could not set index to file (file is already indexed)",self.__filePath, self.getName())
             else:
@@ -266,10 +377,10 @@ class File:
         """
         if fromIndex:
             if indexPattern is None:
-                regex = '(?P<pref>[A-Za-z]+)(?P<date>\d{'+str(INDEX_DATETIME_LENGTH(datetimeFormat))+'}).*' # default index pattern                
+                indexPattern = indx.datetimeExpression(datetimeFormat) # default index pattern
             # Date parsing
             try: 
-                timestamp = indx.parseIndex(self.getName(), regex, parseDtFormat=datetimeFormat, ignoreErrors=True)['datets']              
+                timestamp = self.__parseName(indexPattern, parseDtFormat=datetimeFormat, ignoreErrors=True)['datets']              
                                               
             except (KeyError, indx.ParserError): # parsing failed
                 raise ValueError("No valid datestring was found on input index")
@@ -280,61 +391,177 @@ class File:
             
         # Setting datetime routine
         if mode=='a':
-            os.utime(self.__filePath, (timestamp, os.path.getmtime(self.__filePath)))
+            os.utime(self.__filePath, (timestamp, self.getStat().st_mtime))
         elif mode=='m':
-            os.utime(self.__filePath, (os.path.getatime(self.__filePath), timestamp))
+            os.utime(self.__filePath, (self.getStat().st_atime, timestamp))
         elif mode=='am':
             os.utime(self.__filePath, (timestamp, timestamp))
         else:
             raise ValueError("Invalid mode")
+        self.invalidateCache()
         
     def unlink(self):
         """ Unlinks this File instance to file in directory, setting path attribute to None """
         self.__filePath=None
+        self.invalidateCache()
          
-    def copyTo(self, destPath, bufferSize=10485760, preserveDate=True, strict=True):
+    def __checkDestination(self, destPath, strict):
+        """
+        Checks whether file may be placed on destination, looking it up on destination directory hash index,
+        and reserves destination name on that index. Caller must either add() or release() the reservation. The index 
+        lock is only held to check and reserve the name: contents are looked up once reserved, among files already 
+        there or reserved before
+        
+        Args:
+            destPath(str): Full path to destination, including file name and extension
+            strict(bool): If True, a file with the same contents on destination directory is also considered a conflict
+            
+        Returns:
+            Hash index of destination directory (HashIndex)
+        
+        Raises:
+            FileExistsError: If destination path or, in strict mode, a file with the same contents already exists
+        """
+        destDir, destFName = os.path.split(destPath)
+        destIndex = hashing.getHashIndex(destDir)
+        with metrics.timer('destination_check_seconds'):
+            with destIndex.getLock():
+                if os.path.isfile(destPath) or destIndex.isReserved(destFName):
+                    raise FileExistsError(errno.EEXIST,"File already exists", destPath)
+                destIndex.reserve(destFName, self.__filePath, size=self.getSize())
+            
+            if strict:
+                try:
+                    duplicate = destIndex.findDuplicate(self.__filePath, size=self.getSize(), reservedAs=destFName)
+                except BaseException:
+                    destIndex.release(destFName)
+                    raise
+                if duplicate is not None:
+                    destIndex.release(destFName)
+                    raise FileExistsError(errno.EEXIST,"File already exists", duplicate)
+        
+        return destIndex
+         
+    def copyTo(self, destPath, bufferSize=10485760, preserveDate=True, strict=True, backends=COPY_BACKENDS,
+               hashAlgo=None, verify=False):
         """Copies file from current path to destination. Checks if the same file or 
         another file with the same name already exists on destination before entering the routine
         
         Args:
             destPath(str): Full path to destination, including file name and extension
-            bufferSize(int, optional): Buffer size to use during copying. Defaults to 10MB
+            bufferSize(int, optional): Buffer size to use during copying, if data goes through Python. Defaults to 10MB
             preserveDate(bool, optional): If true preserves the original file date. Defaults to True
             strict(bool, optional): If False, the same file may be copied with a different name. Defaults to True
+            backends(tuple, optional): Copy backends to try, in order (see copying module). Default defined on preferences module
+            hashAlgo(str, optional): Hashing algorithm (e.g. 'sha256', 'blake2b') used to checksum data while it is copied. 
+                Hashing makes data go through Python, so kernel copy backends are skipped. Defaults to None (no hashing)
+            verify(bool, optional): If True, destination is flushed to disk and read back, and its checksum must match
+                the one computed while copying. Implies hashing, with algorithm defined on preferences module if hashAlgo is None. Defaults to False
         
         Returns:
-            A reference to an instance of a new File object
+            A reference to an instance of a new File object. Its getCopyBackend() method reports which backend copied it,
+            and its getChecksum() method the checksum computed while copying
             
         Raises:
             FileExistsError: If a file with the same name already exists on destination
+            OSError: If verification fails (errno EIO). Destination file is removed
         """
+        if verify and hashAlgo is None:
+            hashAlgo = HASH_ALGORITHM
+        hasher = None if hashAlgo is None else hashlib.new(hashAlgo)
+        
+
         # Make sure target directory exists; create it if necessary
         destDir, destFName = os.path.split(destPath) 
-        if not os.path.isdir(destDir):
-            os.makedirs(destDir)
+        os.makedirs(destDir, exist_ok=True)
         
         # Check if destination file already exists in directory; Abort copying if positive
-        fList = [f for f in os.listdir(destDir) if os.path.isfile(os.path.join(destDir, f))]
-        for f in fList:
-            # first line check if files contents are the same (regardless of path) and second checks if file path already exists
-            if  (filecmp.cmp(self.__filePath, os.path.join(destDir, f)) and strict) or \
-                (destPath==os.path.join(destDir, f)):
-                    raise FileExistsError(errno.EEXIST,"File already exists", os.path.join(destDir, f))
+        destIndex = self.__checkDestination(destPath, strict)
                 
         # Optimize buffer for small files
-        bufferSize = min(bufferSize, os.path.getsize(self.__filePath))
+        bufferSize = min(bufferSize, self.getSize())
         if bufferSize==0:
             bufferSize=1024  
              
         # Copying routine
-        with open(self.__filePath, 'rb') as fsrc:
-            with open(destPath, 'wb') as fdst:
-                shutil.copyfileobj(fsrc, fdst, bufferSize)
-        if(preserveDate):
-            shutil.copystat(self.__filePath, destPath)
+        try:
+            with open(self.__filePath, 'rb') as fsrc:
+                with open(destPath, 'xb') as fdst:
+                    try:
+                        size = os.fstat(fsrc.fileno()).st_size
+                        with metrics.timer('copy_seconds'):
+                            backend = copying.copyFileData(fsrc, fdst, size, bufferSize, backends, hasher)
+                        if verify:
+                            with metrics.timer('verify_seconds'):
+                                self.__flushForVerification(fdst)
+                    except BaseException: # do not leave partial copies behind
+                        fdst.close()
+                        os.remove(destPath)
+                        raise
             
-        return File(destPath, mediaType=self.__mediaType)
+            metrics.count('copied_bytes', size)
+            metrics.count('files_copied')
+            digest = None if hasher is None else hasher.hexdigest()
+            if verify and hashing.hashFile(destPath, hashAlgo, bufferSize, useMmap=True)!=digest:
+                os.remove(destPath)
+                raise OSError(errno.EIO, "Copy verification failed: checksum mismatch", destPath)
+            
+            if(preserveDate):
+                shutil.copystat(self.__filePath, destPath)
+        except BaseException:
+            destIndex.release(destFName)
+            raise
+        destIndex.add(destFName, digest if hashAlgo==destIndex.getAlgorithm() else None)
+        
+        newFile = File(destPath, mediaType=self.__mediaType)
+        newFile.__copyBackend = backend
+        if digest is not None:
+            newFile.__checksum = (hashAlgo, digest)
+        return newFile
+    
+    @staticmethod
+    def __flushForVerification(fdst):
+        """ Writes a just copied file to disk and drops it from page cache, so that reading it back hits the device """
+        fdst.flush()
+        os.fsync(fdst.fileno())
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
            
+    def linkTo(self, destPath, strict=True):
+        """
+        Creates a hard link to file on destination, which must be on the same device. No data is copied, 
+        and the new link shares contents and dates with the original file. Checks if file already exists 
+        on destination before linking, as copyTo does
+        
+        Args:
+            destPath(str): Full path to destination, including file name and extension
+            strict(bool, optional): If False, the same file may be linked with a different name. Defaults to True
+        
+        Returns:
+            A reference to an instance of a new File object
+            
+        Raises:
+            FileExistsError: If a file with the same name already exists on destination
+            OSError: If destination is on another device (errno EXDEV) or filesystem does not support hard links
+        """
+        # Make sure target directory exists; create it if necessary
+        destDir, destFName = os.path.split(destPath) 
+        os.makedirs(destDir, exist_ok=True)
+        
+        # Check if destination file already exists in directory; Abort linking if positive
+        destIndex = self.__checkDestination(destPath, strict)
+        
+        # Linking routine
+        try:
+            os.link(self.__filePath, destPath)
+            metrics.count('links')
+        except BaseException:
+            destIndex.release(destFName)
+            raise
+        destIndex.add(destFName)
+        
+        return File(destPath, mediaType=self.__mediaType)
+    
     def moveTo(self, destPath, strict=True):
         """
         Moves file from current path to destination. Checks if file already exists 
@@ -350,21 +577,26 @@ class File:
         """
         # Make sure target directory exists; create it if necessary
         destDir, destFName = os.path.split(destPath) 
-        if not os.path.isdir(destDir):
-            os.makedirs(destDir)
+        os.makedirs(destDir, exist_ok=True)
         
         # Check if destination file already exists in directory; Abort moving if positive
-        fList = [f for f in os.listdir(destDir) if os.path.isfile(os.path.join(destDir, f))]
-        for f in fList:
-            # first line check if files contents are the same (regardless of path) and second checks if file path already exists
-            if  (filecmp.cmp(self.__filePath, os.path.join(destDir, f)) and strict) or \
-                (destPath==os.path.join(destDir, f)):                
-                    raise FileExistsError(errno.EEXIST,"File already exists", os.path.join(destDir, f))
+        destIndex = self.__checkDestination(destPath, strict)
   
         # Moving routine
-        shutil.move(self.__filePath, destPath)
+        srcIndex = hashing.getHashIndex(self.getDir(), create=False)
+        try:
+            with metrics.timer('move_seconds'):
+                shutil.move(self.__filePath, destPath)
+            metrics.count('moves')
+        except BaseException:
+            destIndex.release(destFName)
+            raise
+        if srcIndex is not None:
+            srcIndex.remove(os.path.basename(self.__filePath))
+        destIndex.add(destFName)
         
         self.__filePath=destPath
+        self.invalidateCache()
                   
     def delete(self):
         """ Deletes object and file at filesystem
@@ -379,6 +611,10 @@ class File:
         except PermissionError:
             os.chmod(self.__filePath, stat.S_IWUSR)
             os.remove(self.__filePath)
+        
+        dirIndex = hashing.getHashIndex(self.getDir(), create=False)
+        if dirIndex is not None:
+            dirIndex.remove(os.path.basename(self.__filePath))
             
         self.unlink()
           
@@ -409,6 +645,23 @@ class Directory:
             raise NotADirectoryError("Directory instance could not be linked to None input path")
         
         self.__mediaType = mediaType
+    
+    @classmethod
+    def fromDirEntry(cls, dirEntry, mediaType=None):
+        """
+        Builds a Directory instance from an os.scandir entry, without checking the filesystem again
+        
+        Args:
+            dirEntry(os.DirEntry): Entry for a directory, as yielded by os.scandir
+            mediatype(str, optional): Directory media type. Defaults to None
+        
+        Returns:
+            Directory object
+        """
+        d = cls.__new__(cls)
+        d.__dirPath = dirEntry.path
+        d.__mediaType = mediaType
+        return d
        
     def exists(self):
         """ Checks whether object directory path exists
@@ -458,15 +711,8 @@ class Directory:
         """
         totalSize=0
         if self.exists():
-            if recursive:
-                for root, dirs, files in os.walk(self.__dirPath):
-                    for f in files:
-                        fp = os.path.join(root, f)
-                        totalSize+=os.path.getsize(fp)
-            
-            else: # not recursive
-                for file in [f for f in os.listdir(self.__dirPath) if os.path.isfile(os.path.join(self.__dirPath, f))]:
-                    totalSize+=os.path.getsize(os.path.join(self.__dirPath,file))
+            for f in self.iterFiles(recursive=recursive):
+                totalSize+=f.getSize()
                
         else:
             raise NotADirectoryError(errno.ENOTDIR, "Cannot get size of a non-existing directory", self.__dirPath)
@@ -481,6 +727,101 @@ class Directory:
         """
         return self.__mediaType
         
+    def iterDirs(self, recursive=True):
+        """ 
+        Iterates over children directories from object, as they are found
+        
+        Args:
+            recursive(bool, optional): If True, method works recursively, looking for directory on
+            all sublevels. If not, only base level is considered. Defaults to True
+        
+        Yields:
+            Directory objects, parents before their children
+            
+        Raises:
+            NotADirectoryError: If object path is invalid
+        """
+        if not self.exists():
+            raise NotADirectoryError(errno.ENOTDIR, "Cannot get children from non-existing directory", self.__dirPath)
+        
+        for dirEntry, subdirEntries, fileEntries in self.__walk(recursive, wantFiles=False):
+            if not recursive:
+                for entry in subdirEntries:
+                    yield Directory.fromDirEntry(entry, mediaType=self.__mediaType)
+            elif dirEntry is not None: # root directory is not included
+                yield Directory.fromDirEntry(dirEntry, mediaType=self.__mediaType)
+    
+    def iterFiles(self, recursive=True, exts=None, mediaTypes=None):
+        """ 
+        Iterates over file objects from within directory, as they are found
+        
+        Args:
+            recursive(bool, optional): If True, method works recursively, looking for files on
+            all sublevels. If not, only base level is considered. Defaults to True
+            exts(iterable, optional): Only files with these extensions (as in '.jpg') are yielded. Case insensitive. Defaults to None (any extension)
+            mediaTypes(iterable, optional): Only files of these media types are yielded. Media type of a file is the directory
+            media type, if set, or otherwise the one parsed from its index prefix. Defaults to None (any media type)
+        
+        Yields:
+            File objects
+            
+        Raises:
+            NotADirectoryError: If object path is invalid
+        """
+        if not self.exists():
+            raise NotADirectoryError(errno.ENOTDIR, "Cannot get files from non-existing directory", self.__dirPath)
+        
+        if exts is not None:
+            exts = {e.lower() for e in exts}
+        if mediaTypes is not None:
+            mediaTypes = set(mediaTypes)
+            if self.__mediaType is not None and self.__mediaType not in mediaTypes:
+                return
+            prefixes = tuple(INDEX_PREFIX[t] for t in mediaTypes if t in INDEX_PREFIX)
+        
+        for dirEntry, subdirEntries, fileEntries in self.__walk(recursive, wantFiles=True):
+            for entry in fileEntries:
+                if exts is not None and os.path.splitext(entry.name)[1].lower() not in exts:
+                    continue
+                if mediaTypes is not None and self.__mediaType is None:
+                    if not entry.name.startswith(prefixes):
+                        continue
+                    f = File.fromDirEntry(entry)
+                    if f.getMediaType() not in mediaTypes:
+                        continue
+                    yield f
+                else:
+                    yield File.fromDirEntry(entry, mediaType=self.__mediaType)
+    
+    def __walk(self, recursive, wantFiles):
+        """
+        Top-down directory walk built on os.scandir. Entries type information is reused, so 
+        files and directories are told apart without an extra stat call for each of them
+        
+        Yields:
+            Tuples (dirEntry, subdirEntries, fileEntries) for each visited directory, in the same order as os.walk.
+            dirEntry is None for the root directory, and fileEntries is empty if wantFiles is False
+        """
+        stack = [(None, self.__dirPath)]
+        while stack:
+            dirEntry, dirPath = stack.pop()
+            subdirEntries, fileEntries = [], []
+            try:
+                with os.scandir(dirPath) as it:
+                    for entry in it:
+                        if entry.is_dir():
+                            subdirEntries.append(entry)
+                        elif wantFiles and entry.is_file():
+                            fileEntries.append(entry)
+            except OSError:
+                if dirEntry is None:
+                    raise
+                # unreadable subdirectories are skipped, as in os.walk
+            
+            yield dirEntry, subdirEntries, fileEntries
+            if recursive: # symbolic links to directories are listed, but not followed
+                stack.extend(reversed([(e, e.path) for e in subdirEntries if not e.is_symlink()]))
+    
     def getDirs(self, recursive=True):
         """ 
         Gets children directories from object
@@ -495,29 +836,17 @@ class Directory:
         Raises:
             NotADirectoryError: If object path is invalid
         """
-        if self.exists():
-            if not recursive:
-                dirList = [Directory(os.path.join(self.__dirPath, name), mediaType=self.__mediaType) for name in os.listdir(self.__dirPath) if os.path.isdir(os.path.join(self.__dirPath, name))]
-            
-            else:
-                dirList=[]
-                for path, dirs, files in os.walk(self.__dirPath):
-                    dirList.append(Directory(path, mediaType=self.__mediaType))
-                  
-                dirList.pop(0) # removes root dir from list generated by walk
-                
-        else:
-            raise NotADirectoryError(errno.ENOTDIR, "Cannot get children from non-existing directory", self.__dirPath)
-        
-        return dirList
+        return list(self.iterDirs(recursive=recursive))
     
-    def getFiles(self, recursive=True):
+    def getFiles(self, recursive=True, exts=None, mediaTypes=None):
         """ 
         Gets file objects from within directory 
         
         Args:
             recursive(bool, optional): If True, method works recursively, looking for files on
             all sublevels. If not, only base level is considered. Defaults to True
+            exts(iterable, optional): Only files with these extensions are retrieved. Defaults to None (any extension)
+            mediaTypes(iterable, optional): Only files of these media types are retrieved. Defaults to None (any media type)
         
         Returns:
             File objects list (list)
@@ -525,19 +854,7 @@ class Directory:
         Raises:
             NotADirectoryError: If object path is invalid
         """
-        if self.exists():
-            if not recursive:
-                fList = [File(os.path.join(self.__dirPath, name), mediaType=self.__mediaType) for name in os.listdir(self.__dirPath) if os.path.isfile(os.path.join(self.__dirPath, name))]
-            
-            else:
-                fList=[]
-                for root, dirs, files in os.walk(self.__dirPath):
-                    fList.extend([File(os.path.join(root, name), mediaType=self.__mediaType) for name in files])
-        
-        else:
-            raise NotADirectoryError(errno.ENOTDIR, "Cannot get files from non-existing directory", self.__dirPath)  
-            
-        return fList
+        return list(self.iterFiles(recursive=recursive, exts=exts, mediaTypes=mediaTypes))
     
     def unlink(self):
         """ Unlinks this Directory instance to directory, setting path attribute to None """
@@ -547,70 +864,352 @@ class Directory:
         """ Sets object's media type """
         self.__mediaType = mediaType
    
-    def checkIntegrity(self, fix=False):
+    def reindex(self, files=None, force=False):
+        """
+        Indexes many files of this directory (not recursively) at once
+
+        Directory is listed once, and all target names are computed in memory: names are validated and generated
+        in batch, and files whose index would clash with another file (same prefix, second and size) get the next
+        free suffix instead. Files are renamed in an order such that no rename is attempted towards a name still in
+        use; only a file of a cycle (as when files swap names) goes through a temporary name, which keeps its original
+        name. Files left under temporary names by an interrupted run are given their names back first
+
+        Args:
+            files(iterable, optional): File objects of this directory to be indexed. Defaults to None (all files)
+            force(bool, optional): If True, already indexed files are indexed again, from their current date and
+            size. Otherwise, they are reported as already indexed. Defaults to False
+
+        Returns:
+            Tuple (renamed, errors): list of (old path, new path) tuples and list of FileIndexingError objects.
+            Errors name the path where each file was left. File objects given as input keep their old paths
+
+        Raises:
+            NotADirectoryError: If object path is invalid
+            ValueError: If some input file is not in this directory
+        """
+        if not self.exists():
+            raise NotADirectoryError(errno.ENOTDIR, "Cannot index files of non-existing directory", self.__dirPath)
+
+        errors = self.__recoverReindex()
+        with os.scandir(self.__dirPath) as it:
+            listing = {e.name for e in it}
+        if files is None:
+            files = list(self.iterFiles(recursive=False))
+        else:
+            files = list(files)
+            for f in files:
+                if os.path.dirname(os.path.abspath(f.getPath()))!=os.path.abspath(self.__dirPath):
+                    raise ValueError("File %s is not in directory %s"%(f.getPath(), self.__dirPath))
+        files.sort(key=lambda f: f.getName()+f.getExt())
+
+        # files to be renamed, and their indexes with size suffixes
+        parsed = indx.parseIndexes([f.getName() for f in files])
+        todo, prefixes, timestamps, sizes = [], [], [], []
+        for f, valid in zip(files, parsed['valid']):
+            if valid and not force:
+                errors.append(indx.FileIndexingError("Could not set index to file (file is already indexed)", f.getPath(), f.getName()))
+                continue
+            try:
+                prefix = indx.getPrefix(f.getMediaType())
+                st = f.getStat()
+            except ValueError:
+                errors.append(indx.FileIndexingError("Could not format index", f.getPath(), None))
+                continue
+            except FileNotFoundError:
+                errors.append(indx.FileIndexingError("Could not set index to file (file vanished)", f.getPath(), None))
+                continue
+            todo.append(f)
+            prefixes.append(prefix)
+            timestamps.append(st.st_mtime)
+            sizes.append(st.st_size)
+        indexes, valid = indx.genIndexes(prefixes, timestamps, sizes)
+
+        dirIndex = hashing.getHashIndex(self.__dirPath)
+        renamed = []
+        with dirIndex.getLock(): # no other file may take the new names in between
+            # target names. Names of the files being renamed are freed
+            taken = listing - {f.getName()+f.getExt() for f in todo}
+            moves = []
+            suffixRange = 10**INDEX_SUFFIX_LENGTH
+            for f, index, ok, size in zip(todo, indexes, valid, sizes):
+                if not ok:
+                    errors.append(indx.FileIndexingError("Could not format index", f.getPath(), None))
+                    taken.add(f.getName()+f.getExt())
+                    continue
+                base = index[:-INDEX_SUFFIX_LENGTH]
+                for k in range(suffixRange):
+                    name = base+indx.numberFormatToString((size+k)%suffixRange, length=INDEX_SUFFIX_LENGTH)+f.getExt()
+                    if name not in taken and not dirIndex.isReserved(name):
+                        break
+                else:
+                    errors.append(indx.FileIndexingError("Same index already exists", f.getPath(), index))
+                    taken.add(f.getName()+f.getExt())
+                    continue
+                taken.add(name)
+                moves.append((f.getName()+f.getExt(), name))
+
+            # files move straight to free names, following chains of moves; only a file of a cycle (as in a swap)
+            # goes through a temporary name, which keeps its original name so that it can be recovered
+            pending = dict(moves)
+            sourceOf = {new: old for old, new in moves}
+            origin = {}
+            ready = sorted((old for old, new in moves if new not in pending), reverse=True)
+            while pending:
+                if not ready: # only cycles are left: one file leaves its name
+                    cur = min(pending)
+                    new = pending.pop(cur)
+                    tmpName = REINDEX_TMP_PREFIX+"%d-%s"%(os.getpid(), cur)
+                    try:
+                        os.rename(os.path.join(self.__dirPath, cur), os.path.join(self.__dirPath, tmpName))
+                        metrics.count('renames')
+                        pending[tmpName] = new
+                        sourceOf[new] = tmpName
+                        origin[tmpName] = cur
+                    except OSError as e:
+                        errors.append(indx.FileIndexingError("Could not set index to file (%s)"%e.strerror, os.path.join(self.__dirPath, cur), os.path.splitext(new)[0]))
+                    freed = cur
+                else:
+                    cur = ready.pop()
+                    new = pending.pop(cur)
+                    oldName = origin.pop(cur, cur)
+                    oldPath, newPath = os.path.join(self.__dirPath, oldName), os.path.join(self.__dirPath, new)
+                    try:
+                        if os.path.lexists(newPath): # file which could not leave its name, or created meanwhile
+                            raise FileExistsError(errno.EEXIST, "File exists", newPath)
+                        os.rename(os.path.join(self.__dirPath, cur), newPath)
+                        metrics.count('renames')
+                        dirIndex.rename(oldName, new)
+                        renamed.append((oldPath, newPath))
+                    except OSError as e:
+                        reason = "Same index already exists" if isinstance(e, FileExistsError) else "Could not set index to file (%s)"%e.strerror
+                        leftPath = self.__restoreName(cur, oldName)
+                        if leftPath!=oldPath:
+                            reason += "; file left as %s"%os.path.basename(leftPath)
+                        errors.append(indx.FileIndexingError(reason, leftPath, os.path.splitext(new)[0]))
+                    freed = cur if cur==oldName else None # name of a file of a cycle was freed when it left it
+                # the file moving to the freed name may go on
+                src = sourceOf.get(freed)
+                if src in pending:
+                    ready.append(src)
+
+        return renamed, errors
+
+    def __restoreName(self, curName, oldName):
+        """ Gives a file under a temporary name its original name back, if free. Returns path where file is left """
+        curPath, oldPath = os.path.join(self.__dirPath, curName), os.path.join(self.__dirPath, oldName)
+        if curName==oldName:
+            return oldPath
+        try:
+            if not os.path.lexists(oldPath):
+                os.rename(curPath, oldPath)
+                return oldPath
+        except OSError:
+            pass
+        return curPath
+
+    def __recoverReindex(self):
+        """ Gives files left under temporary names by interrupted reindex() runs their names back. Returns list of FileIndexingError for files left there """
+        errors = []
+        with os.scandir(self.__dirPath) as it:
+            leftovers = [e.name for e in it if e.name.startswith(REINDEX_TMP_PREFIX)]
+        for name in leftovers:
+            pid, _, oldName = name[len(REINDEX_TMP_PREFIX):].partition('-')
+            if not pid.isdigit() or not oldName or _isRunning(int(pid)): # may belong to a reindex in progress
+                continue
+            leftPath = self.__restoreName(name, oldName)
+            if os.path.basename(leftPath)==name:
+                errors.append(indx.FileIndexingError("Could not restore name of file left by an interrupted indexing (%s exists)"%oldName, leftPath, None))
+        return errors
+
+    def checkIntegrity(self, fix=False, files=None):
         """ Checks for dir integrity, with the requisites:
             1 - Files dates are equivalent to their indexes
             2 - All files indexes are valid
-            @param fix: If set to True, this methods tries to recursively fix the issues
+            Directory is scanned once. In fix mode, fixes for all the issues found are then applied 
+            in one batch, and only the files that were touched are validated again
+            @param fix: If set to True, this methods tries to fix the issues
+            @param files: File objects of this directory to be checked, if already listed. Fixed files are renamed 
+            in place. Defaults to None (directory is scanned)
+            @return: True if directory passes the integrity check
             @raise DirectoryIntegrityError: If any issues is detected, exception is raised, with a list of detected issues
         """
-        import sys
         issues=[]
-        for f in self.getFiles():
+        broken=[]
+        for f in (self.iterFiles() if files is None else files):
+            problem = self.__integrityProblem(f)
+            if problem is None:
+                continue
+            if fix:
+                broken.append((f, problem))
+            else:
+                issues.append( ValueError(f.getPath(), problem) )
+        
+        # fixing routine
+        touched=[]
+        for f, problem in broken:
             try:
-                indx.parseIndex(f.getName());
-                if f.getDatetime()!= f.getDatetime(fromIndex=f.getName()):
-                    raise ValueError(f.getPath(), "Wrong datetime") 
-                
-            except indx.ParserError as e:
-                if fix:
-                    try:
-                        f.setDatetime(fromIndex=True)
-                        f.setIndex()
-                        if self.checkIntegrity(fix=True):
-                            return True
-                    except ValueError as e:
-                        issues.append( ValueError(f.getPath(), "Index not set" ).with_traceback(e.__traceback__) )
-                else:
-                    issues.append( ValueError(f.getPath(), "Invalid index").with_traceback(e.__traceback__) )
-                    
-            except ValueError as e:
-                if fix:
-                    try:
-                        f.setDatetime(fromIndex=True)
-                        if self.checkIntegrity(fix=True):
-                            return True
-                    except ValueError as e:
-                        issues.append( ValueError(f.getPath(),"Index not set").with_traceback(e.__traceback__))
-                else:
-                    issues.append( e.with_traceback(e.__traceback__))
+                f.setDatetime(fromIndex=True)
+                if problem=="Invalid index":
+                    f.setIndex()
+                touched.append(f)
+            except (ValueError, indx.FileIndexingError) as e:
+                issues.append( ValueError(f.getPath(), "Index not set").with_traceback(e.__traceback__) )
         
-        # base case
-        if len(issues)==0:
-            return True
+        for f in touched:
+            problem = self.__integrityProblem(f)
+            if problem is not None:
+                issues.append( ValueError(f.getPath(), problem) )
         
         # raise exception
         if len(issues)>0:
             raise DirectoryIntegrityError(issues)
             
-        return
+        return True
+    
+    def iterIntegrityIssues(self, files=None):
+        """ 
+        Checks for dir integrity, as checkIntegrity does, yielding issues as soon as they are found
+        This method does not try to fix any issues
+        
+        Args:
+            files(iterable, optional): File objects of this directory to be checked, if already listed. Defaults to None (directory is scanned)
+        
+        Yields:
+            ValueError instances, with args (file path, issue description)
+            
+        Raises:
+            NotADirectoryError: If object path is invalid
+        """
+        for f in (self.iterFiles() if files is None else files):
+            problem = self.__integrityProblem(f)
+            if problem is not None:
+                yield ValueError(f.getPath(), problem)
+    
+    def __integrityProblem(self, f):
+        """ 
+        Checks a single file for integrity issues
+        
+        Returns:
+            Issue description (str), or None if file has no issues 
+        """
+        try:
+            indx.parseIndex(f.getName())
+            if f.getDatetime()!=f.getDatetime(fromIndex=True):
+                return "Wrong datetime"
+        except indx.ParserError:
+            return "Invalid index"
+        return None
     
     def __str__(self):
         return self.__dirPath
  
 
-def importFile(srcFile, dstRootPath, organizeBy=None, copy=True, indexing=False):
+def _isRunning(pid):
+    """ Checks whether a process is running (bool) """
+    if pid==os.getpid():
+        return True
+    if os.name!='posix': # os.kill() would terminate the process
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError: # exists, but belongs to another user
+        return True
+    return True
+
+
+IMPORTING_METHODS = ('copy', 'move', 'link', 'rename')
+
+def importFile(srcFile, dstRootPath, organizeBy=None, copy=True, indexing=False, method=None, verify=False, catalog=None, journal=None, dedup=None):
     """
     Imports media file to destination, in filesystem
     This function does not deal with files metadata
     @param srcFile: File object to be imported. File must be of a valid media type
     @param dstRootPath: Root of destination directory 
     @param organizeBy: Files organizational method. Available options are defined in the preferences module. If None(default), all files are imported to root
-    @param copy: If true, files are copied instead of being moved. Defaults to True
+    @param copy: If true, files are copied instead of being moved. Defaults to True. Ignored if method is set
     @param indexing: If true, files are automatically indexed on importing. Defaults to False  
+    @param method: One of IMPORTING_METHODS. 'link' imports file as a hard link and 'rename' moves it by renaming; both 
+    are atomic, do not copy any data and are only used when source and destination are on the same device. Otherwise 
+    file is copied. If None (default), method is 'copy' or 'move', according to copy param
+    @param verify: If true, copied files are read back from disk and checked against the checksum computed while copying. 
+    Defaults to False
+    @param catalog: catalog.CatalogWriter where imported file is recorded. Defaults to None (no catalog)
+    @param journal: journaling.ImportJournal where importing is recorded. A file already imported according to 
+    the journal is not imported again. Defaults to None (no journal)
+    @param dedup: dedup.ArchiveDedup of the archive under dstRootPath. A file whose contents are anywhere on the archive
+    is not imported, and imported files are recorded on it. Defaults to None (only destination directory is looked up)
     @return: Reference to imported file  
-    @raise FileImportingError: if importing fails 
+    @raise FileImportingError: if importing fails (including failed verification)
+    @raise ValueError: if method is invalid
     """ 
+    if method is None:
+        method = 'copy' if copy else 'move'
+    elif method not in IMPORTING_METHODS:
+        raise ValueError("Invalid importing method: %s"%method)
+    
+    srcPath = srcFile.getPath()
+    if journal is not None and journal.isDone(srcPath):
+        dstPath = journal.getDestination(srcPath)
+        try:
+            return File(dstPath, mediaType=srcFile.getMediaType())
+        except FileNotFoundError: # imported file was removed or moved since; source is imported again, if still there
+            if not os.path.lexists(srcPath):
+                raise FileImportingError(errno.ENOENT, "Could not import file(Imported file is missing)", dstPath)
+    
+    start = time.perf_counter()
+    try:
+        digest = None
+        if dedup is not None:
+            duplicate, digest = dedup.reserve(srcPath, size=srcFile.getSize())
+            if duplicate is not None:
+                raise FileImportingError(errno.EPERM, "Could not import file(File already exists)", duplicate)
+        newf = _importFile(srcFile, dstRootPath, organizeBy, indexing, method, verify, catalog, journal)
+    except BaseException as e:
+        metrics.count('import_failures')
+        if dedup is not None:
+            dedup.release(srcPath)
+        if journal is not None:
+            journal.fail(srcPath, e, final=isFinalFailure(e))
+        raise
+    if dedup is not None:
+        checksum = newf.getChecksum()
+        if digest is None and checksum is not None and checksum[0]==dedup.getAlgorithm():
+            digest = checksum[1]
+        try:
+            dedup.add(newf.getPath(), size=newf.getSize(), digest=digest)
+        finally: # only once contents can be found on the catalog
+            dedup.release(srcPath)
+    logImported(srcPath, newf, method, time.perf_counter()-start)
+    return newf
+
+def isFinalFailure(e):
+    """
+    Checks whether an importing failure cannot be fixed by retrying, as when file already exists on destination
+    @param e: Exception raised by importing
+    @return: True if retrying is pointless
+    """
+    return isinstance(e, FileExistsError) or (isinstance(e, FileImportingError) and e.errno==errno.EPERM)
+
+def logImported(srcPath, newFile, method, duration):
+    """
+    Records an imported file on metrics and on log, with its importing duration
+    @param srcPath: Source file path
+    @param newFile: Imported File object
+    @param method: Importing method
+    @param duration: Importing duration, in seconds
+    """
+    metrics.count('files_imported')
+    metrics.observe('import_seconds', duration)
+    if _logger.isEnabledFor(logging.INFO):
+        checksum = newFile.getChecksum()
+        _logger.info("Imported file %s into %s", srcPath, newFile.getPath(),
+                     extra={'src':srcPath, 'dst':newFile.getPath(), 'method':method, 'backend':newFile.getCopyBackend(),
+                            'checksum':None if checksum is None else "%s:%s"%checksum, 'duration':round(duration, 6)})
+
+def _importFile(srcFile, dstRootPath, organizeBy, indexing, method, verify, catalog, journal):
+    """ Importing routine of importFile(), with method already validated """
     try:
         # find out the target directory for file
         if organizeBy is not None: # use some organizational method
@@ -624,20 +1223,34 @@ def importFile(srcFile, dstRootPath, organizeBy=None, copy=True, indexing=False)
                 dstDir = Directory(dstDir)
             except NotADirectoryError:
                 try:
-                    os.makedirs(dstDir) 
+                    os.makedirs(dstDir, exist_ok=True) # directory may be concurrently created by another importer
                 except FileNotFoundError:
                     raise OSError(errno.EINVAL, "Could not create directory", dstRootPath)
           
                 continue
             break
+        
+        # linking and renaming only happen within a device
+        if method in ('link', 'rename'):
+            if os.stat(dstDir.getPath()).st_dev!=srcFile.getStat().st_dev:
+                method = 'copy'
+            elif method=='rename': # on the same device, moving is an atomic rename
+                method = 'move'
             
-        # if copy file method is chosen
-        if copy:
+        # if copy (or link) file method is chosen
+        if method in ('copy', 'link'):
+            newf = None # only for purposes of rolling back
             try:
-                rollbackPath = os.path.join(dstDir.getPath(), srcFile.getName()+srcFile.getExt()) # only for purposes of rolling back
-                newf = srcFile.copyTo(os.path.join(dstDir.getPath(), srcFile.getName()+srcFile.getExt()))
+                dstPath = os.path.join(dstDir.getPath(), srcFile.getName()+srcFile.getExt())
+                if journal is not None and not os.path.lexists(dstPath): # an existing file is a conflict, never claimed by journal
+                    journal.start(srcFile.getPath(), dstPath, srcFile.getStat().st_mtime_ns)
+                newf = writeImportedFile(srcFile, dstPath, method, verify)
                 if indexing: 
                     newf.setIndex()
+                if catalog is not None:
+                    catalog.add(newf)
+                if journal is not None:
+                    journal.done(srcFile.getPath(), newf.getPath())
                 return newf
 
             except indx.FileIndexingError as e:
@@ -648,15 +1261,23 @@ def importFile(srcFile, dstRootPath, organizeBy=None, copy=True, indexing=False)
                 raise FileImportingError(errno.EPERM, "Could not import file(%s)"%e.strerror, e.filename)
             
             except (KeyboardInterrupt, SystemExit) as e:
-                File(rollbackPath).delete() # rollback
+                if newf is not None: # partial copies are already removed by copyTo
+                    newf.delete() # rollback
                 raise
         # if move file method is chosen                          
         else:
             try:
                 oldPath = srcFile.getPath()
-                srcFile.moveTo(os.path.join(dstDir.getPath(), srcFile.getName()+srcFile.getExt()))
+                dstPath = os.path.join(dstDir.getPath(), srcFile.getName()+srcFile.getExt())
+                if journal is not None and not os.path.lexists(dstPath):
+                    journal.start(oldPath, dstPath, srcFile.getStat().st_mtime_ns)
+                writeImportedFile(srcFile, dstPath, 'move')
                 if indexing:
                     srcFile.setIndex()
+                if catalog is not None:
+                    catalog.add(srcFile)
+                if journal is not None:
+                    journal.done(oldPath, srcFile.getPath())
                 return srcFile
             
             except indx.FileIndexingError as e:
@@ -673,6 +1294,95 @@ def importFile(srcFile, dstRootPath, organizeBy=None, copy=True, indexing=False)
     except KeyError as e:
         raise e
 
+def writeImportedFile(srcFile, dstPath, method, verify=False):
+    """
+    Writes a file being imported to its destination: as a hard link (or a copy, if filesystem does not support 
+    hard links), by moving it, or by copying it
+    @param srcFile: Source File object
+    @param dstPath: Full destination path
+    @param method: One of 'link', 'move' or 'copy'
+    @param verify: If true, copied files are verified. See importFile()
+    @return: Reference to written file (srcFile itself, if moved)
+    @raise FileImportingError: if destination exists (errno EPERM), or if data could not be written or verified (errno EIO)
+    """
+    try:
+        if method=='link':
+            try:
+                return srcFile.linkTo(dstPath)
+            except FileExistsError:
+                raise
+            except OSError as e: # filesystem does not support hard links
+                if e.errno not in (errno.EPERM, errno.EXDEV, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+                    raise
+        elif method=='move':
+            srcFile.moveTo(dstPath)
+            return srcFile
+        return srcFile.copyTo(dstPath, verify=verify)
+    
+    except FileExistsError as e:
+        raise FileImportingError(errno.EPERM, "Could not import file(%s)"%e.strerror, e.filename)
+    
+    except OSError as e:
+        if e.errno!=errno.EIO:
+            raise
+        raise FileImportingError(errno.EIO, "Could not import file(%s)"%e.strerror, e.filename)
+
+
+def importFiles(srcFiles, dstRootPath, organizeBy=None, copy=True, indexing=False, jobs=1, method=None, verify=False, catalog=None, journal=None, dedup=None):
+    """
+    Imports many media files, with the same options as importFile()
+    With more than one job, files are imported by a bounded pool of threads, so that disk and CPU work 
+    of different files overlap. Results are yielded in the same order as input files regardless
+    @param srcFiles: Iterable of File objects to be imported. It is consumed lazily
+    @param dstRootPath: Root of destination directory
+    @param organizeBy: Files organizational method. See importFile()
+    @param copy: If true, files are copied instead of being moved. Defaults to True
+    @param indexing: If true, files are automatically indexed on importing. Defaults to False
+    @param jobs: Number of files imported concurrently. Defaults to 1
+    @param method: Importing method. See importFile()
+    @param verify: If true, copied files are verified. See importFile()
+    @param catalog: catalog.CatalogWriter where imported files are recorded. See importFile()
+    @param journal: journaling.ImportJournal where importing is recorded. See importFile()
+    @param dedup: dedup.ArchiveDedup for archive-wide duplicate lookups. See importFile()
+    @return: Generator of (source File, imported File or FileImportingError) tuples
+    """
+    def work(f):
+        try:
+            return importFile(f, dstRootPath, organizeBy=organizeBy, copy=copy, indexing=indexing, method=method, verify=verify, catalog=catalog, journal=journal, dedup=dedup)
+        except FileImportingError as e:
+            return e
+    
+    return mapOrdered(work, srcFiles, jobs)
+
+def mapOrdered(func, items, jobs=1):
+    """
+    Applies a function to many items. With more than one job, items are processed by a bounded pool of threads,
+    and results are still yielded in input order
+    @param func: Function of one argument
+    @param items: Iterable of items. It is consumed lazily, keeping a bounded amount of items in flight
+    @param jobs: Number of items processed concurrently. Defaults to 1
+    @return: Generator of (item, result) tuples
+    """
+    if jobs<=1:
+        for item in items:
+            yield item, func(item)
+        return
+    
+    window = collections.deque()
+    items = iter(items)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for item in items:
+                window.append((item, executor.submit(func, item)))
+                if len(window)>=2*jobs: # keep a bounded amount of items in flight
+                    item, future = window.popleft()
+                    yield item, future.result()
+            while window:
+                item, future = window.popleft()
+                yield item, future.result()
+        finally: # on interruption, items not started yet are dropped; running ones are completed
+            for item, future in window:
+                future.cancel()
 
 class DirectoryIntegrityError(Exception):
     def __init__(self, *args):
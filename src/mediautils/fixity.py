@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+This module audits the fixity of archived files: their checksums are stored
+once, and a bounded slice of the archive is read back and checked against
+them on each run, so that bit rot is found without full-archive passes
+
+Checksums live in an SQLite database per archive, in the package state
+directory (see preferences module), with the size and modification time
+each file had when its checksum was taken and the time it was last verified.
+Each run first brings the database up to date with an incremental scan of
+the archive (see scanning module), which leaves out the quarantine and the
+import journal, as they change all the time, and then verifies files that were not
+verified for the longest time (files never checksummed come first), until
+its byte budget is spent. Files are streamed and dropped from page cache as
+they are read, so that audits do not evict what other programs use
+
+A file whose contents no longer match its checksum while its size and
+modification time did not change is reported as corrupt; its stored checksum
+is kept as reference. A file rewritten by other means (size or modification
+time changed) gets a new checksum
+
+Name:        CARIAMA Fixity Audit Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, time, sqlite3, hashlib, collections
+import hashing
+from scanning import ArchiveScanner, archiveExcludes
+from preferences import FIXITY_STATE_ROOT, HASH_ALGORITHM, HASH_WORKERS
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+""" Audit outcomes of a file """
+OK, NEW, CHANGED, CORRUPT, MISSING, ERROR = 'OK', 'NEW', 'CHANGED', 'CORRUPT', 'MISSING', 'ERROR'
+
+""" Outcome of verifying a file. Size is the amount of data read; expected and actual are hexadecimal digests (None if unknown) """
+FixityResult = collections.namedtuple('FixityResult', ['path', 'status', 'size', 'expected', 'actual'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,   -- relative to archive root
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT,             -- NULL until first verified
+    verified REAL,           -- time of last verification, NULL if never verified
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_verified ON files (COALESCE(verified, 0), path);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class FixityAuditor:
+    """
+    Incremental fixity audit of an archive
+
+    Args:
+        rootPath(str): Path to the root of the archive
+        storeRoot(str, optional): Directory where checksum databases and scan snapshots are kept. Default defined on preferences module
+        algo(str, optional): Name of the hashing algorithm. Default defined on preferences module
+        exclude(iterable, optional): Paths under archive root which are not audited. Defaults to None (quarantine and 
+            import journal, see scanning.archiveExcludes())
+
+    Attributes:
+        private db: Connection to the checksum database of the archive
+    """
+    def __init__(self, rootPath, storeRoot=FIXITY_STATE_ROOT, algo=HASH_ALGORITHM, exclude=None):
+        self.__rootPath = os.path.abspath(rootPath)
+        self.__exclude = archiveExcludes(self.__rootPath) if exclude is None else list(exclude)
+        self.__storeRoot = storeRoot
+        self.__algo = algo
+        os.makedirs(storeRoot, exist_ok=True)
+        self.__db = sqlite3.connect(self.getStorePath())
+        self.__db.executescript(_SCHEMA)
+        row = self.__db.execute("SELECT value FROM meta WHERE key='algo'").fetchone()
+        if row is None:
+            with self.__db:
+                self.__db.execute("INSERT INTO meta VALUES ('algo', ?)", (algo,))
+        elif row[0]!=algo:
+            raise ValueError("Checksums of %s were taken with %s, not %s"%(self.__rootPath, row[0], algo))
+
+    def getPath(self):
+        """ Retrieves archive root path (str) """
+        return self.__rootPath
+
+    def getStorePath(self):
+        """ Retrieves path of the checksum database of the archive (str) """
+        key = hashlib.sha1(os.path.normcase(self.__rootPath).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.__storeRoot, key+'.sqlite3')
+
+    def sync(self):
+        """
+        Brings the database up to date with the archive, through an incremental scan. New files are queued to
+        be checksummed first; removed files are dropped
+
+        Returns:
+            ScanDiff namedtuple of added, removed and modified file paths (see scanning module)
+
+        Raises:
+            NotADirectoryError: If archive root is not a directory
+        """
+        scanner = ArchiveScanner(self.__rootPath, storeRoot=os.path.join(self.__storeRoot, 'scans'), exclude=self.__exclude)
+        diff = scanner.scan(save=False)
+        with self.__db:
+            self.__db.executemany("DELETE FROM files WHERE path=?", ((self.__relPath(p),) for p in diff.removed))
+            for path in diff.added+diff.modified:
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError: # vanished after scanning
+                    continue
+                # size and mtime of files already known are left to audit(), which tells rewrites apart
+                self.__db.execute("INSERT OR IGNORE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)", (self.__relPath(path), st.st_size, st.st_mtime_ns))
+        scanner.save() # only once changes are on the database
+        return diff
+
+    def __relPath(self, path):
+        return os.path.relpath(path, self.__rootPath)
+
+    def __selectDue(self, budgetBytes):
+        """ Picks files not verified for the longest time, up to budgetBytes (at least one file) """
+        due, total = [], 0
+        for relPath, size, mtime, digest in self.__db.execute("SELECT path, size, mtime_ns, digest FROM files ORDER BY COALESCE(verified, 0), path"):
+            if due and total+size>budgetBytes:
+                break
+            due.append((relPath, size, mtime, digest))
+            total += size
+        return due
+
+    def audit(self, budgetBytes, workers=HASH_WORKERS, commitEvery=64):
+        """
+        Verifies files not verified for the longest time, until byte budget is spent
+
+        Args:
+            budgetBytes(int): Amount of data read by this run. A file larger than the budget is verified alone
+            workers(int, optional): Number of worker processes hashing files. Default defined on preferences module
+            commitEvery(int, optional): Number of results between database commits, so that an interrupted run keeps its progress. Defaults to 64
+
+        Returns:
+            Generator of FixityResult namedtuples, as files are verified (not in verification order)
+        """
+        due = {os.path.join(self.__rootPath, relPath): (relPath, size, mtime, digest) for relPath, size, mtime, digest in self.__selectDue(budgetBytes)}
+        stats = {}
+        for path in due:
+            try:
+                stats[path] = os.stat(path)
+            except OSError as e:
+                stats[path] = e
+        pending = 0
+        try:
+            for path in [p for p in due if isinstance(stats[p], OSError)]:
+                yield self.__record(due[path], None, stats[path])
+            for path, res in hashing.hashFiles([p for p in due if not isinstance(stats[p], OSError)], self.__algo, workers, dropCache=True):
+                yield self.__record(due[path], stats[path], res)
+                pending += 1
+                if pending>=commitEvery:
+                    self.__db.commit()
+                    pending = 0
+        finally:
+            self.__db.commit()
+
+    def __record(self, entry, st, res):
+        """ Compares a digest against the database, and records the outcome """
+        relPath, size, mtime, expected = entry
+        path = os.path.join(self.__rootPath, relPath)
+        now = time.time()
+        if isinstance(res, FileNotFoundError):
+            self.__db.execute("UPDATE files SET verified=?, status=? WHERE path=?", (now, MISSING, relPath))
+            return FixityResult(path, MISSING, 0, expected, None)
+        if isinstance(res, OSError):
+            self.__db.execute("UPDATE files SET verified=?, status=? WHERE path=?", (now, ERROR, relPath))
+            return FixityResult(path, ERROR, 0, expected, None)
+        if expected is None:
+            status = NEW
+        elif st.st_size!=size or st.st_mtime_ns!=mtime:
+            status = CHANGED
+        elif res!=expected:
+            self.__db.execute("UPDATE files SET verified=?, status=? WHERE path=?", (now, CORRUPT, relPath))
+            return FixityResult(path, CORRUPT, st.st_size, expected, res)
+        else:
+            status = OK
+        self.__db.execute("UPDATE files SET size=?, mtime_ns=?, digest=?, verified=?, status=? WHERE path=?",
+                          (st.st_size, st.st_mtime_ns, res, now, status, relPath))
+        return FixityResult(path, status, st.st_size, expected, res)
+
+    def getCounts(self):
+        """
+        Retrieves the state of the audit
+
+        Returns:
+            Dict with number of files and bytes tracked ('files', 'bytes'), files never verified ('unverified'),
+            time of the oldest verification ('oldest', None if none), and number of files of each last status
+        """
+        files, nbytes, unverified, oldest = self.__db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(*)-COUNT(verified), MIN(verified) FROM files").fetchone()
+        counts = {'files':files, 'bytes':nbytes, 'unverified':unverified, 'oldest':oldest}
+        for status, n in self.__db.execute("SELECT status, COUNT(*) FROM files WHERE status IS NOT NULL GROUP BY status"):
+            counts[status] = n
+        return counts
+
+    def iterFailures(self):
+        """ Iterates over (path, status) of files whose last verification found them corrupt, missing or unreadable """
+        for relPath, status in self.__db.execute("SELECT path, status FROM files WHERE status IN (?, ?, ?) ORDER BY path", (CORRUPT, MISSING, ERROR)):
+            yield os.path.join(self.__rootPath, relPath), status
+
+    def close(self):
+        """ Closes checksum database """
+        self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,667 @@
+#!/usr/bin/env python
+"""
+This module gathers functions and classes for content hashing of media
+files and for keeping track of file contents inside directories, so that
+duplicate detection does not need to read and compare every file already
+stored on a destination
+
+Hash indexes are kept in memory for each directory and persisted to the
+package state directory (see preferences module). They are only a cache:
+every index is reconciled against the directory listing when it is loaded,
+and whenever the directory changes behind its back. Only the indexes used
+most recently are kept in memory, and persisted indexes which were not used
+for a while expire (see preferences module)
+
+Hash indexes are thread safe. Files on their way to a directory may be
+reserved on its index, so that concurrent writers see them as conflicts
+before they are actually written
+
+Name:        CARIAMA Content Hashing Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, json, time, errno, hashlib, filecmp, atexit, threading, mmap, itertools, collections
+import multiprocessing, concurrent.futures
+import metrics
+from preferences import HASH_ALGORITHM, HASH_INDEX_ROOT, HASH_INDEX_CACHE_SIZE, HASH_INDEX_MAX_AGE_DAYS, HASH_WORKERS, HASH_PROCESS_MIN_BYTES
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+def hashFile(filePath, algo=HASH_ALGORITHM, bufferSize=1048576, useMmap=False, dropCache=False):
+    """
+    Computes the digest of a file contents
+    @param filePath: Path to the file to be hashed
+    @param algo: Name of the hashing algorithm, as accepted by hashlib. Default defined on preferences
+    @param bufferSize: Size of the chunks read from file (or fed to the hasher, with mmap). Defaults to 1MB
+    @param useMmap: If True, file is memory mapped instead of read into buffers. Defaults to False
+    @param dropCache: If True, file is read into buffers and the kernel is told to drop each chunk from page cache
+    once hashed, so that reading large amounts of cold data does not evict what other programs use. Defaults to False
+    @return: Hexadecimal digest (str)
+    """
+    with metrics.timer('hash_seconds'):
+        hasher = hashlib.new(algo)
+        with open(filePath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            metrics.count('hashed_bytes', size)
+            if useMmap and not dropCache and size>0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    view = memoryview(m)
+                    try:
+                        for start in range(0, size, bufferSize):
+                            hasher.update(view[start:start+bufferSize])
+                    finally:
+                        view.release()
+            else:
+                dropCache = dropCache and hasattr(os, 'posix_fadvise')
+                if dropCache:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                offset = 0
+                while True:
+                    chunk = f.read(bufferSize)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    if dropCache:
+                        os.posix_fadvise(f.fileno(), offset, len(chunk), os.POSIX_FADV_DONTNEED)
+                    offset += len(chunk)
+    metrics.count('files_hashed')
+    return hasher.hexdigest()
+
+def _hashBatch(filePaths, algo, bufferSize, dropCache=False):
+    """ Hashes a batch of files, on a worker process. Errors are returned, not raised """
+    results = []
+    for filePath in filePaths:
+        try:
+            results.append((filePath, hashFile(filePath, algo, bufferSize, useMmap=not dropCache, dropCache=dropCache)))
+        except OSError as e:
+            results.append((filePath, e))
+    return results
+
+_pool = None
+_poolWorkers = 0
+_poolLock = threading.Lock()
+
+def _getPool(workers):
+    """ Retrieves the process pool shared by hashFiles() calls, replacing it if it has fewer workers than needed """
+    global _pool, _poolWorkers
+    with _poolLock:
+        if _pool is None or _poolWorkers<workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # workers must not be forked from a multithreaded parent
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+            _poolWorkers = workers
+        return _pool
+
+@atexit.register
+def _shutdownPool():
+    global _pool
+    with _poolLock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+def hashFiles(files, algo=HASH_ALGORITHM, workers=HASH_WORKERS, bufferSize=1048576, batchBytes=HASH_PROCESS_MIN_BYTES, dropCache=False):
+    """
+    Computes the digests of many files on a pool of worker processes, so that hashing is not bound to a single core.
+    A digest cannot be split among chunks hashed apart, so each file is hashed by a single worker, reading it through
+    mmap. Files are sent to workers in batches of about batchBytes, so large files go one by one. Files adding up to
+    less than a single batch are hashed in process, as starting workers would cost more than hashing them
+    @param files: Iterable of file paths or File objects. It is consumed lazily
+    @param algo: Name of the hashing algorithm. Default defined on preferences
+    @param workers: Number of worker processes. Default defined on preferences
+    @param bufferSize: Size of chunks fed to the hasher. Defaults to 1MB
+    @param batchBytes: Amount of data handed to a worker at a time. Default defined on preferences
+    @param dropCache: If True, files are streamed and dropped from page cache as they are hashed (see hashFile()). Defaults to False
+    @return: Generator of (file path, hexadecimal digest or OSError) tuples, as files are hashed (not in input order)
+    """
+    sizes = {}
+    def batches():
+        batch, batchSize = [], 0
+        for f in files:
+            filePath = f.getPath() if hasattr(f, 'getPath') else f
+            try:
+                sizes[filePath] = os.path.getsize(filePath)
+            except OSError as e:
+                yield None, [(filePath, e)]
+                continue
+            batch.append(filePath)
+            batchSize += sizes[filePath]
+            if batchSize>=batchBytes or len(batch)>=1024:
+                yield batch, None
+                batch, batchSize = [], 0
+        if batch:
+            yield batch, None
+
+    def report(results):
+        """ Counts metrics of files hashed by workers, as they are not collected on worker processes """
+        for filePath, res in results:
+            if not isinstance(res, OSError):
+                metrics.count('hashed_bytes', sizes.pop(filePath, 0))
+                metrics.count('files_hashed')
+            yield filePath, res
+
+    it = batches()
+    head = list(itertools.islice(it, 2))
+    inline = workers<=1 or not head or (len(head)==1 and sum(sizes.values())<batchBytes)
+    window = set()
+    try:
+        for batch, errors in itertools.chain(head, it):
+            if batch is None:
+                yield from errors
+            elif inline: # hashFile() counts metrics itself
+                yield from _hashBatch(batch, algo, bufferSize, dropCache)
+            else:
+                window.add(_getPool(workers).submit(_hashBatch, batch, algo, bufferSize, dropCache))
+                while len(window)>=2*workers: # bounds memory held by pending batches
+                    done, window = concurrent.futures.wait(window, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield from report(future.result())
+        while window:
+            done, window = concurrent.futures.wait(window, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield from report(future.result())
+    finally: # on early exit, batches not started yet are dropped
+        for future in window:
+            future.cancel()
+
+def compareFiles(filePath1, filePath2):
+    """
+    Compares the contents of two files, byte by byte
+    @param filePath1: Path to one file
+    @param filePath2: Path to the other file
+    @return: True if files have the same contents, and False otherwise
+    """
+    with metrics.timer('compare_seconds'):
+        same = filecmp.cmp(filePath1, filePath2, shallow=False)
+    if metrics.isEnabled(): # sizes are only fetched for metrics
+        metrics.count('comparisons')
+        metrics.count('compared_bytes', os.path.getsize(filePath1))
+    return same
+
+
+class HashIndex:
+    """
+    Content index of the files at a single directory level
+
+    Each entry maps a file name to its size, modification time and (lazily
+    computed) content digest. Entries are also grouped by size, so that a
+    duplicate lookup only hashes files which share the size of the candidate,
+    and only compares bytes when digests match
+
+    Args:
+        dirPath(str): Path to an existing directory
+        algo(str, optional): Hashing algorithm. Default defined on preferences module
+        storeRoot(str, optional): Directory where index is persisted. If None, index lives only in memory. Default defined on preferences module
+
+    Attributes:
+        private dirPath: The path to indexed directory
+        private entries: Dict of name -> [size, mtime_ns, digest]
+        private bySize: Dict of size -> set of names
+        private pending: Dict of name -> [size, source path, digest, sequence number] for reserved files
+    """
+    def __init__(self, dirPath, algo=HASH_ALGORITHM, storeRoot=HASH_INDEX_ROOT):
+        self.__dirPath = os.path.abspath(dirPath)
+        self.__algo = algo
+        self.__storeRoot = storeRoot
+        self.__entries = {}
+        self.__bySize = {}
+        self.__pending = {}
+        self.__sequence = itertools.count()
+        self.__dirMtime = None
+        self.__dirty = False
+        self.__lock = threading.RLock()
+        self.__load()
+        self.reconcile()
+
+    def getPath(self):
+        """ Retrieves indexed directory path
+
+        Returns:
+            Directory path (str)
+        """
+        return self.__dirPath
+
+    def getAlgorithm(self):
+        """ Retrieves the hashing algorithm of the index
+        
+        Returns:
+            Algorithm name (str)
+        """
+        return self.__algo
+    
+    def getLock(self):
+        """ Retrieves the (reentrant) lock guarding this index. Hold it to check and reserve a destination atomically
+        
+        Returns:
+            Lock object (threading.RLock)
+        """
+        return self.__lock
+    
+    def getStorePath(self):
+        """ Retrieves path of the file where index is persisted
+
+        Returns:
+            Index file path (str), or None if index is not persisted
+        """
+        if self.__storeRoot is None:
+            return None
+        return _storePath(self.__dirPath, self.__storeRoot)
+
+    def __load(self):
+        """ Loads persisted entries, if any. Corrupt or foreign index files are ignored """
+        storePath = self.getStorePath()
+        if storePath is None:
+            return
+        try:
+            with open(storePath, 'r') as f:
+                data = json.load(f)
+            if data.get('dir')!=self.__dirPath or data.get('algo')!=self.__algo:
+                return
+            for name, (size, mtime, digest) in data['entries'].items():
+                self.__addEntry(name, size, mtime, digest)
+            os.utime(storePath) # index is in use, and must not expire
+        except (OSError, ValueError, KeyError, TypeError):
+            self.__entries = {}
+            self.__bySize = {}
+
+    def flush(self):
+        """ Persists index to its store file, if it changed since last flush """
+        storePath = self.getStorePath()
+        with self.__lock:
+            if storePath is None or not self.__dirty:
+                return
+            os.makedirs(self.__storeRoot, exist_ok=True)
+            tmpPath = storePath+'.tmp'
+            with open(tmpPath, 'w') as f:
+                json.dump({'dir':self.__dirPath, 'algo':self.__algo, 'entries':self.__entries}, f)
+            os.replace(tmpPath, storePath)
+            self.__dirty = False
+
+    def __addEntry(self, name, size, mtime, digest=None):
+        self.__discardEntry(name)
+        self.__entries[name] = [size, mtime, digest]
+        self.__bySize.setdefault(size, set()).add(name)
+
+    def __discardEntry(self, name):
+        entry = self.__entries.pop(name, None)
+        if entry is not None:
+            names = self.__bySize[entry[0]]
+            names.discard(name)
+            if not names:
+                del self.__bySize[entry[0]]
+
+    def __statDir(self):
+        try:
+            return os.stat(self.__dirPath).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reconcile(self):
+        """
+        Brings index up to date with directory contents. Only file metadata is read:
+        digests of unchanged files are kept, and digests of new or modified files are
+        computed on demand
+        """
+        with self.__lock:
+            self.__reconcile()
+    
+    def __reconcile(self):
+        self.__dirMtime = self.__statDir()
+        if self.__dirMtime is None:
+            if self.__entries:
+                self.__entries, self.__bySize, self.__dirty = {}, {}, True
+            return
+
+        seen = set()
+        with os.scandir(self.__dirPath) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name in self.__pending:
+                    continue
+                st = entry.stat()
+                seen.add(entry.name)
+                known = self.__entries.get(entry.name)
+                if known is None or known[0]!=st.st_size or known[1]!=st.st_mtime_ns:
+                    self.__addEntry(entry.name, st.st_size, st.st_mtime_ns)
+                    self.__dirty = True
+
+        for name in [n for n in self.__entries if n not in seen and n not in self.__pending]:
+            self.__discardEntry(name)
+            self.__dirty = True
+
+    def __refresh(self):
+        """ Reconciles index if directory listing changed since last time it was seen """
+        if self.__statDir()!=self.__dirMtime:
+            self.__reconcile()
+
+    def __digest(self, name):
+        """ 
+        Retrieves digest for an indexed file, hashing it if necessary or if file was modified in place. 
+        Files are hashed without holding the lock, so that lookups on other files are not held back
+        """
+        path = os.path.join(self.__dirPath, name)
+        st = os.stat(path)
+        with self.__lock:
+            entry = self.__entries.get(name)
+            if entry is not None and entry[0]==st.st_size and entry[1]==st.st_mtime_ns and entry[2] is not None:
+                return entry[2]
+        digest = hashFile(path, self.__algo)
+        with self.__lock:
+            if name in self.__entries:
+                self.__addEntry(name, st.st_size, st.st_mtime_ns, digest)
+                self.__dirty = True
+        return digest
+
+    def __prefetch(self, names, filePath=None):
+        """
+        Hashes at once the indexed files lacking digests among names, along with input file if given, so that
+        a lookup among many same-size files is hashed on a pool of processes rather than one file after another.
+        Files are hashed without holding the lock; digests are only kept for files that did not change meanwhile
+        @return: Digest of input file, or None if it was not given or could not be hashed
+        """
+        paths = {}
+        with self.__lock:
+            for name in names:
+                entry = self.__entries.get(name)
+                if entry is None:
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.__dirPath, name))
+                except FileNotFoundError:
+                    continue
+                if entry[0]!=st.st_size or entry[1]!=st.st_mtime_ns:
+                    self.__addEntry(name, st.st_size, st.st_mtime_ns)
+                if self.__entries[name][2] is None:
+                    paths[os.path.join(self.__dirPath, name)] = (name, st.st_size, st.st_mtime_ns)
+        if filePath is not None:
+            paths[filePath] = None
+        if len(paths)<2:
+            return None
+        digest = None
+        for path, res in hashFiles(paths, self.__algo):
+            if isinstance(res, OSError): # left to be hashed (or reported) one by one
+                continue
+            if path==filePath:
+                digest = res
+                continue
+            name, size, mtime = paths[path]
+            with self.__lock:
+                entry = self.__entries.get(name)
+                if entry is not None and entry[0]==size and entry[1]==mtime:
+                    entry[2] = res
+                    self.__dirty = True
+        return digest
+
+    def findDuplicate(self, filePath, size=None, digest=None, reservedAs=None):
+        """
+        Looks for a file with the same contents as input file on indexed directory. Candidates are picked under
+        the lock, and hashed and compared without holding it
+
+        Args:
+            filePath(str): Path of the file to be looked up
+            size(int, optional): Size of input file, if already known
+            digest(str, optional): Digest of input file, if already known
+            reservedAs(str, optional): Name reserved for input file. Only files reserved before it are considered, so
+                that of two files with the same contents reserved at once, the first one is written and the last one
+                finds it. Defaults to None (all reserved files are considered)
+
+        Returns:
+            Path to the duplicate (str), or None if there is no duplicate
+        """
+        if size is None:
+            size = os.path.getsize(filePath)
+        with self.__lock:
+            self.__refresh()
+            candidates = sorted(self.__bySize.get(size, ()))
+            own = self.__pending.get(reservedAs)
+            # files reserved by concurrent writers are compared against their sources
+            pending = [(name, entry) for name, entry in sorted(self.__pending.items()) 
+                       if entry[0]==size and (own is None or entry[3]<own[3])]
+        if len(candidates)>1:
+            digest = self.__prefetch(candidates, filePath if digest is None else None) or digest
+        
+        for name in candidates:
+            candPath = os.path.join(self.__dirPath, name)
+            try:
+                if digest is None:
+                    digest = hashFile(filePath, self.__algo)
+                if self.__digest(name)==digest and compareFiles(filePath, candPath):
+                    return candPath
+            except FileNotFoundError: # file vanished from directory; index will be reconciled
+                with self.__lock:
+                    self.__dirMtime = None
+        
+        for name, entry in pending:
+            if digest is None:
+                digest = hashFile(filePath, self.__algo)
+            if entry[2] is None:
+                entry[2] = hashFile(entry[1], self.__algo)
+            if entry[2]==digest and compareFiles(filePath, entry[1]):
+                return os.path.join(self.__dirPath, name)
+        if own is not None and own[2] is None: # spares later lookups from hashing input file again
+            own[2] = digest
+        return None
+    
+    def isReserved(self, name):
+        """ 
+        Checks whether a name is reserved by a file on its way to the directory
+        
+        Returns:
+            True if name is reserved, and False otherwise
+        """
+        return name in self.__pending
+    
+    def hasReservations(self):
+        """ 
+        Checks whether some file is on its way to the directory
+        
+        Returns:
+            True if some name is reserved, and False otherwise
+        """
+        return bool(self.__pending)
+    
+    def hasSize(self, size):
+        """ 
+        Checks whether some indexed or reserved file has a given size, that is, whether looking up a file of
+        that size may need its digest
+        
+        Returns:
+            True if some file has the size, and False otherwise
+        """
+        with self.__lock:
+            self.__refresh()
+            return size in self.__bySize or any(entry[0]==size for entry in self.__pending.values())
+    
+    def reserve(self, name, srcPath, size=None, digest=None):
+        """
+        Reserves a name for a file that is about to be written to the indexed directory. Until it is 
+        registered by add() or released, the reserved file is considered by duplicate lookups through its source
+        
+        Args:
+            name(str): Destination file basename
+            srcPath(str): Path of the file whose contents are going to be written
+            size(int, optional): Size of source file, if already known
+            digest(str, optional): Digest of source file, if already known
+        
+        Raises:
+            FileExistsError: If name is already reserved
+        """
+        with self.__lock:
+            if name in self.__pending:
+                raise FileExistsError(errno.EEXIST, "File already exists", os.path.join(self.__dirPath, name))
+            if size is None:
+                size = os.path.getsize(srcPath)
+            self.__pending[name] = [size, srcPath, digest, next(self.__sequence)]
+    
+    def release(self, name):
+        """ Drops a reservation without registering the file """
+        with self.__lock:
+            self.__pending.pop(name, None)
+    
+    def add(self, name, digest=None):
+        """
+        Registers a file of the indexed directory
+
+        Args:
+            name(str): File basename
+            digest(str, optional): Content digest, if already known
+        """
+        st = os.stat(os.path.join(self.__dirPath, name))
+        with self.__lock:
+            pending = self.__pending.pop(name, None)
+            if digest is None and pending is not None and pending[0]==st.st_size:
+                digest = pending[2]
+            self.__addEntry(name, st.st_size, st.st_mtime_ns, digest)
+            self.__dirMtime = self.__statDir()
+            self.__dirty = True
+
+    def remove(self, name):
+        """
+        Unregisters a file from the indexed directory
+
+        Args:
+            name(str): File basename
+        """
+        with self.__lock:
+            self.__discardEntry(name)
+            self.__dirMtime = self.__statDir()
+            self.__dirty = True
+
+    def rename(self, oldName, newName):
+        """ Renames an entry, keeping its digest """
+        with self.__lock:
+            entry = self.__entries.get(oldName)
+            self.__discardEntry(oldName)
+            self.add(newName, None if entry is None else entry[2])
+
+    def getDigest(self, name):
+        """
+        Retrieves content digest of an indexed file
+
+        Returns:
+            Hexadecimal digest (str)
+
+        Raises:
+            FileNotFoundError: If file is not in index
+        """
+        with self.__lock:
+            self.__refresh()
+            if name not in self.__entries:
+                raise FileNotFoundError(errno.ENOENT, "File not indexed", os.path.join(self.__dirPath, name))
+        return self.__digest(name)
+
+    def __contains__(self, name):
+        return name in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+def _storePath(dirPath, storeRoot):
+    """ Path of the file where the index of a directory is persisted under storeRoot """
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(dirPath)).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(storeRoot, key+'.json')
+
+
+""" Registry of loaded hash indexes, least recently used first """
+
+_indexes = collections.OrderedDict()
+_indexesLock = threading.Lock()
+
+def getHashIndex(dirPath, create=True):
+    """
+    Retrieves the hash index for a directory, building or loading it on first access. When more than
+    HASH_INDEX_CACHE_SIZE indexes are loaded, the least recently used ones without reservations are persisted
+    and dropped from memory
+    @param dirPath: Path to the directory
+    @param create: If False, only indexes already loaded are returned
+    @return: HashIndex object, or None if not loaded and create is False
+    """
+    key = os.path.normcase(os.path.abspath(dirPath))
+    evicted = []
+    with _indexesLock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+        elif create:
+            index = _indexes[key] = HashIndex(dirPath, storeRoot=HASH_INDEX_ROOT)
+            for oldKey in list(_indexes):
+                if len(_indexes)-len(evicted)<=HASH_INDEX_CACHE_SIZE:
+                    break
+                if not _indexes[oldKey].hasReservations():
+                    evicted.append(_indexes.pop(oldKey))
+    for oldIndex in evicted:
+        try:
+            oldIndex.flush()
+        except OSError:
+            pass
+    return index
+
+def removeHashIndex(dirPath):
+    """
+    Drops the index of a directory from memory and removes its persisted file, as when directory is removed
+    @param dirPath: Path to the directory
+    """
+    key = os.path.normcase(os.path.abspath(dirPath))
+    with _indexesLock:
+        index = _indexes.pop(key, None)
+    storePath = _storePath(dirPath, HASH_INDEX_ROOT) if index is None else index.getStorePath()
+    if storePath is not None:
+        try:
+            os.remove(storePath)
+        except FileNotFoundError:
+            pass
+
+def expireHashIndexes(maxAgeDays=HASH_INDEX_MAX_AGE_DAYS):
+    """
+    Removes persisted indexes which were not loaded nor changed for a while, as those of removed directories
+    @param maxAgeDays: Number of days an unused index is kept. Default defined on preferences module
+    @return: Number of removed index files
+    """
+    with _indexesLock:
+        loaded = {index.getStorePath() for index in _indexes.values()}
+    limit = time.time()-maxAgeDays*86400
+    removed = 0
+    try:
+        entries = list(os.scandir(HASH_INDEX_ROOT))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.endswith(('.json', '.json.tmp')) or entry.path in loaded:
+            continue
+        try:
+            if entry.stat().st_mtime<limit:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def flushHashIndexes():
+    """ Persists all loaded hash indexes """
+    with _indexesLock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        try:
+            index.flush()
+        except OSError:
+            pass
+
+def _atExit():
+    flushHashIndexes()
+    try:
+        expireHashIndexes()
+    except OSError:
+        pass
+
+atexit.register(_atExit)
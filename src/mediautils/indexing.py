@@ -7,11 +7,19 @@ This module operates based on the package's preferences
 Name:        CARIAMA Indexing System Module
 Package:     CARIAMA Media Archive Utilities
 
-Next: Implement index parser class?
+Index parsing is done by IndexParser objects, which are built once for
+each parsing expression and datetime format and then reused
 """
-import re, time
+import re, time, calendar
+import metrics
+from functools import lru_cache
 from datetime import datetime
-from preferences import INDEX_SUFFIX_LENGTH, INDEX_PARSING_EXPRESSION, INDEX_DATETIME_FORMAT, INDEX_PREFIX
+from preferences import INDEX_SUFFIX_LENGTH, INDEX_PARSING_EXPRESSION, INDEX_DATETIME_FORMAT, INDEX_DATETIME_LENGTH, INDEX_PREFIX
+
+try:
+    import numpy as np
+except ImportError: # batch functions fall back to plain lists
+    np = None
 from parser import ParserError
 
 __author__ = "Pedro Correia de Siracusa"
@@ -48,6 +56,7 @@ def genIndex(prefix, timestamp, suffixNum):
     @return: index string
     @raise ValuError: if generated index was not valid
     '''   
+    metrics.count('indexes_generated')
     try:            
         indx = prefix + \
                 datetime.fromtimestamp(timestamp).strftime(INDEX_DATETIME_FORMAT) + \
@@ -97,34 +106,333 @@ def parseIndex(index, parseExp = INDEX_PARSING_EXPRESSION, parseDtFormat = INDEX
     @return: Dictionary with parsed contents
     @raise ParserError: If index parsing failed
     """
-    res={}
+    metrics.count('indexes_parsed')
+    return getParser(parseExp, parseDtFormat).parse(index, ignoreErrors=ignoreErrors)
+
+def parseIndexes(indexes, parseExp = INDEX_PARSING_EXPRESSION, parseDtFormat = INDEX_DATETIME_FORMAT):
+    """
+    Parses a sequence of indexes at once. Invalid indexes do not raise errors; they are flagged instead
+    When NumPy is available, datestrings of fixed-width datetime formats are decoded as arrays, and local 
+    time conversion is done once for each distinct hour
+    @param indexes: Sequence of index strings
+    @param parseExp: Regular expression to be matched
+    @param parseDtFormat: Datetime format of the index datestring
+    @return: Dictionary of columns, each with one item per index: 'pref', 'mediatype', 'datestring' and 'suff' (lists, 
+    None where missing); 'datets' (timestamps, nan where invalid); 'code' (ParserError code, -1 if valid) and 'valid' (bool)
+    """
+    parser = getParser(parseExp, parseDtFormat)
+    n = len(indexes)
+    metrics.count('indexes_parsed', n)
+    cols = {'pref':[None]*n, 'mediatype':[None]*n, 'datestring':[None]*n, 'suff':[None]*n}
+    datets = [float('nan')]*n
+    codes = [-1]*n
+    
+    pending = [] # positions with a datestring yet to be decoded
+    for i, index in enumerate(indexes):
+        pIdx = parser.match(index)
+        if pIdx is None:
+            codes[i] = 0
+            continue
+        if 'pref' in pIdx:
+            cols['pref'][i] = pIdx['pref']
+            cols['mediatype'][i] = parser.getMediaType(pIdx['pref'])
+            if cols['mediatype'][i] is None:
+                codes[i] = 1
+        if 'suff' in pIdx:
+            cols['suff'][i] = pIdx['suff']
+        if 'date' in pIdx:
+            cols['datestring'][i] = pIdx['date']
+            pending.append(i)
+    
+    if np is not None and parser.getDatetimeLayout() is not None and pending:
+        decoded, undecided = _decodeDatestrings([cols['datestring'][i] for i in pending], parser.getDatetimeLayout())
+        for j, i in enumerate(pending):
+            datets[i] = decoded[j]
+        pending = [pending[j] for j in undecided]
+    
+    for i in pending:
+        try:
+            datets[i] = parser.parseDatetime(cols['datestring'][i])
+        except ValueError:
+            datets[i] = float('nan')
+            if codes[i]==-1: codes[i] = 2
+    
+    if np is not None:
+        cols['datets'] = np.array(datets, dtype=float)
+        cols['code'] = np.array(codes, dtype=np.int16)
+        cols['valid'] = cols['code']==-1
+    else:
+        cols['datets'] = datets
+        cols['code'] = codes
+        cols['valid'] = [c==-1 for c in codes]
+    return cols
+
+def _decodeDatestrings(datestrings, layout):
+    """
+    Decodes fixed-width datestrings with NumPy
+    @param datestrings: List of datestrings
+    @param layout: Datetime layout, as given by IndexParser.getDatetimeLayout()
+    @return: (timestamps array, positions of datestrings that could not be decided and must be parsed one by one)
+    """
+    width = layout[-1][2]
+    chars = np.array(datestrings, dtype='U%d'%width)
+    ok = np.array([len(d)==width for d in datestrings], dtype=bool)
+    digits = chars.view(np.uint32).reshape(len(datestrings), width).astype(np.int64) - ord('0')
+    ok &= ((digits>=0) & (digits<=9)).all(axis=1)
+    
+    values = {'%Y':np.full(len(datestrings), 1900), '%m':np.ones(len(datestrings), dtype=np.int64), '%d':np.ones(len(datestrings), dtype=np.int64),
+              '%H':np.zeros(len(datestrings), dtype=np.int64), '%M':np.zeros(len(datestrings), dtype=np.int64), '%S':np.zeros(len(datestrings), dtype=np.int64)}
+    for field, start, end in layout:
+        weights = 10**np.arange(end-start-1, -1, -1)
+        values[field] = digits[:, start:end] @ weights
+    year, month, day = values['%Y'], values['%m'], values['%d']
+    leap = (year%4==0) & ((year%100!=0) | (year%400==0))
+    monthDays = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 0, 12)] + ((month==2) & leap)
+    ok &= (year>=1) & (month>=1) & (month<=12) & (day>=1) & (day<=monthDays) & \
+          (values['%H']<=23) & (values['%M']<=59) & (values['%S']<=61)
+    
+    # local time conversion, once for each distinct hour. Hours next to a daylight saving 
+    # time change are ambiguous, and are left to be converted one by one
+    timestamps = np.full(len(datestrings), np.nan)
+    hours = ((year*100+month)*100+day)*100+values['%H']
+    uniqueHours, inverse = np.unique(hours[ok], return_inverse=True)
+    hourTs = np.empty((len(uniqueHours), 5))
+    for k, h in enumerate(uniqueHours):
+        for j, offset in enumerate((-2, -1, 0, 1, 2)):
+            hourTs[k, j] = time.mktime((int(h//1000000), int(h//10000%100), int(h//100%100), int(h%100)+offset, 0, 0, 0, 0, -1))
+    regular = (np.diff(hourTs, axis=1)==3600).all(axis=1)
+    okPos = np.flatnonzero(ok)
+    keep = regular[inverse]
+    ok[okPos[~keep]] = False
+    timestamps[okPos[keep]] = hourTs[inverse[keep], 2] + values['%M'][okPos[keep]]*60 + values['%S'][okPos[keep]]
+    
+    return timestamps, np.flatnonzero(~ok).tolist()
+
+def genIndexes(prefixes, timestamps, suffixNums):
+    """
+    Generates a sequence of indexes at once, equivalent to calling genIndex() for each item
+    Invalid items do not raise errors; they are flagged instead
+    @param prefixes: Sequence of prefixes, or a single prefix for all indexes
+    @param timestamps: Sequence of timestamps
+    @param suffixNums: Sequence of numeric suffixes
+    @return: (list of index strings, None where invalid; validity mask)
+    """
+    n = len(timestamps)
+    metrics.count('indexes_generated', n)
+    if isinstance(prefixes, str):
+        prefixes = [prefixes]*n
+    if not len(prefixes)==len(suffixNums)==n:
+        raise ValueError("Input sequences must have the same length")
+    
+    datestrings = _formatTimestamps(timestamps, INDEX_DATETIME_FORMAT)
+    indexes = [None]*n
+    for i in range(n):
+        try:
+            if datestrings[i] is not None:
+                indexes[i] = prefixes[i] + datestrings[i] + numberFormatToString(suffixNums[i], length=INDEX_SUFFIX_LENGTH, strict=False)
+        except (TypeError, ValueError):
+            pass
+    
+    # generated indexes are validated at once, as genIndex() does for each of them
+    toCheck = [i for i in range(n) if indexes[i] is not None]
+    checked = parseIndexes([indexes[i] for i in toCheck])['valid']
+    for i, valid in zip(toCheck, checked):
+        if not valid:
+            indexes[i] = None
+    
+    valid = [index is not None for index in indexes]
+    if np is not None:
+        valid = np.array(valid, dtype=bool)
+    return indexes, valid
+
+def _formatTimestamps(timestamps, dtFormat):
+    """
+    Formats timestamps as local time datestrings
+    When NumPy is available and format is fixed-width, local time is computed once for each distinct 
+    15 minute interval (time zone offsets and their changes are always aligned to 15 minutes)
+    @return: List of datestrings, None for invalid timestamps
+    """
+    layout = getParser(parseDtFormat=dtFormat).getDatetimeLayout() if np is not None else None
     try:
-        pIdx = re.match(parseExp, index).groupdict()
-        if 'pref' in pIdx.keys():
+        ts = np.asarray(timestamps, dtype=float) if layout is not None else None
+    except (TypeError, ValueError):
+        ts = None
+    if ts is None:
+        res = []
+        for timestamp in timestamps:
+            try:
+                res.append(datetime.fromtimestamp(timestamp).strftime(dtFormat))
+            except (TypeError, ValueError, OverflowError, OSError):
+                res.append(None)
+        return res
+    
+    secs = np.floor(np.round(ts, 6))
+    ok = np.isfinite(secs)
+    blocks = np.floor(secs[ok]/900)*900
+    uniqueBlocks, inverse = np.unique(blocks, return_inverse=True)
+    res = [None]*len(ts)
+    blockLocal = []
+    for b in uniqueBlocks:
+        try:
+            blockLocal.append(np.datetime64(datetime.fromtimestamp(b).replace(microsecond=0), 's'))
+        except (ValueError, OverflowError, OSError):
+            blockLocal.append(np.datetime64('NaT'))
+    local = np.array(blockLocal, dtype='M8[s]')[inverse] + (secs[ok]-blocks).astype('m8[s]')
+    
+    valid = ~np.isnat(local)
+    fields = {'%Y':local.astype('M8[Y]').astype(np.int64)+1970,
+              '%m':local.astype('M8[M]').astype(np.int64)%12+1,
+              '%d':(local.astype('M8[D]')-local.astype('M8[M]')).astype(np.int64)+1,
+              '%H':(local-local.astype('M8[D]')).astype(np.int64)//3600,
+              '%M':(local-local.astype('M8[h]')).astype(np.int64)//60,
+              '%S':(local-local.astype('M8[m]')).astype(np.int64)}
+    out = np.full(len(local), '', dtype='U%d'%layout[-1][2])
+    for field, start, end in layout:
+        values = fields[field].astype(str)
+        out = np.char.add(out, values if field=='%Y' else np.char.zfill(values, end-start)) # %Y is not padded, as in strftime
+    valid &= (fields['%Y']>=1) & (fields['%Y']<=9999)
+    
+    for i, value, isValid in zip(np.flatnonzero(ok), out, valid):
+        res[i] = str(value) if isValid else None
+    return res
+
+@lru_cache(maxsize=64)
+def getParser(parseExp = INDEX_PARSING_EXPRESSION, parseDtFormat = INDEX_DATETIME_FORMAT):
+    """
+    Gets the index parser for a parsing expression and datetime format. Parsers are built once and reused
+    @param parseExp: Regular expression to be matched
+    @param parseDtFormat: Datetime format of the index datestring
+    @return: IndexParser object
+    """
+    return IndexParser(parseExp, parseDtFormat)
+
+@lru_cache(maxsize=64)
+def datetimeExpression(parseDtFormat = INDEX_DATETIME_FORMAT):
+    """
+    Gets the loose parsing expression used to retrieve only prefix and datetime from an index
+    @param parseDtFormat: Datetime format of the index datestring
+    @return: Regular expression (str)
+    """
+    return '(?P<pref>[A-Za-z]+)(?P<date>\\d{'+str(INDEX_DATETIME_LENGTH(parseDtFormat))+'}).*'
+
+
+class IndexParser:
+    """
+    Index parser for a given parsing expression and datetime format
+    
+    The expression is compiled and the prefix to media type mapping is built once,
+    on construction. When the datetime format is only made of fixed-width numeric
+    fields (such as the default '%Y%m%d%H%M%S'), datestrings are decoded by slicing
+    their digits, instead of going through time.strptime
+    
+    Args:
+        parseExp(str, optional): Regular expression to be matched. Named groups 'pref', 'date' and 'suff' are parsed. Default set on preferences module
+        parseDtFormat(str, optional): Datetime format of the datestring. Default set on preferences module
+    """
+    FIXED_WIDTH_FIELDS = {'%Y':4, '%m':2, '%d':2, '%H':2, '%M':2, '%S':2}
+    
+    def __init__(self, parseExp=INDEX_PARSING_EXPRESSION, parseDtFormat=INDEX_DATETIME_FORMAT):
+        self.__regex = re.compile(parseExp)
+        self.__dtFormat = parseDtFormat
+        self.__mediaTypes = {}
+        for key, value in INDEX_PREFIX.items():
+            self.__mediaTypes.setdefault(value, key)
+        self.__dtLayout = self.__fixedWidthLayout(parseDtFormat)
+    
+    def __fixedWidthLayout(self, dtFormat):
+        """ 
+        Splits datetime format into fixed-width fields
+        @return: Tuple of (field, start, end) tuples, or None if format has other directives or literals
+        """
+        fields = re.findall('%.', dtFormat)
+        if ''.join(fields)!=dtFormat or len(set(fields))!=len(fields):
+            return None
+        layout, pos = [], 0
+        for field in fields:
+            if field not in self.FIXED_WIDTH_FIELDS:
+                return None
+            layout.append((field, pos, pos+self.FIXED_WIDTH_FIELDS[field]))
+            pos += self.FIXED_WIDTH_FIELDS[field]
+        return tuple(layout)
+    
+    def getDatetimeFormat(self):
+        """ @return: Datetime format of the parser (str) """
+        return self.__dtFormat
+    
+    def getDatetimeLayout(self):
+        """ @return: Tuple of (field, start, end) for fixed-width datetime formats, or None """
+        return self.__dtLayout
+    
+    def match(self, index):
+        """ 
+        Matches index against parser expression
+        @return: Dictionary of named groups, or None if index does not match
+        """
+        match = self.__regex.match(index)
+        return None if match is None else match.groupdict()
+    
+    def getMediaType(self, prefix):
+        """
+        Gets the media type corresponding to an index prefix
+        @param prefix: Index prefix
+        @return: Media type (str), or None if prefix is not valid
+        """
+        return self.__mediaTypes.get(prefix)
+    
+    def parseDatetime(self, datestring):
+        """
+        Converts a datestring to a timestamp, in local time
+        @param datestring: String formatted according to parser datetime format
+        @return: Timestamp (float)
+        @raise ValueError: If datestring is not valid 
+        """
+        layout = self.__dtLayout
+        if layout is not None and len(datestring)==layout[-1][2] and datestring.isdigit() and datestring.isascii():
+            values = {'%Y':1900, '%m':1, '%d':1, '%H':0, '%M':0, '%S':0} # same defaults as time.strptime
+            for field, start, end in layout:
+                values[field] = int(datestring[start:end])
+            year, month, day = values['%Y'], values['%m'], values['%d']
+            if year>=1 and 1<=month<=12 and 1<=day<=calendar.monthrange(year, month)[1] and \
+                values['%H']<=23 and values['%M']<=59 and values['%S']<=61:
+                return time.mktime((year, month, day, values['%H'], values['%M'], values['%S'], 0, 0, -1))
+        
+        # general case (and any doubtful datestring) is handled by strptime
+        return time.mktime(time.strptime(datestring, self.__dtFormat))
+    
+    def parse(self, index, ignoreErrors=False):
+        """
+        Validates and parses an index
+        @param index: Index string to be parsed
+        @param ignoreErrors: Prevents function from raising errors. Tries to build dictionary as best as possible
+        @return: Dictionary with parsed contents
+        @raise ParserError: If index parsing failed
+        """
+        match = self.__regex.match(index)
+        if match is None:
+            raise ParserError(0)
+        pIdx = match.groupdict()
+        
+        res={}
+        if 'pref' in pIdx:
             res['pref']=pIdx['pref']
-            if not pIdx['pref'] in INDEX_PREFIX.values():
+            mediaType = self.__mediaTypes.get(pIdx['pref'])
+            if mediaType is None:
                 if not ignoreErrors: raise ParserError(1)  
             else:
-                res['mediatype']=[key for key, value in INDEX_PREFIX.items() if value==pIdx['pref']][0]    
+                res['mediatype']=mediaType
         
-        if 'date' in pIdx.keys():
+        if 'date' in pIdx:
             try:
                 res['datestring'] = pIdx['date']                
-                idxDate=time.strptime(pIdx['date'], parseDtFormat)
-                res['datets'] = time.mktime(idxDate)                
+                res['datets'] = self.parseDatetime(pIdx['date'])
             except ValueError:
                 if not ignoreErrors: raise ParserError(2, "Invalid datestring: %s"%pIdx['date'])
 
-        if 'suff' in pIdx.keys():
+        if 'suff' in pIdx:
             res['suff']=pIdx['suff']
-
         
         return res
     
-    except AttributeError:
-        raise ParserError(0)
-    
-            
         
 class FileIndexingError(Exception):
     """ 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+This module keeps a write-ahead journal of batch imports, so that an
+interrupted import resumes exactly where it stopped
+
+The journal is an append-only file of JSON lines at the root of the import
+destination. Each source file goes through the following records:
+    PLAN  - file is part of the batch
+    START - file is about to be written to destination (always on disk before data is)
+    DONE  - file was imported, with its final path
+    FAIL  - file could not be imported. It is retried on next run, but failures
+            that retrying cannot fix (e.g. file already exists) are final, and
+            count as handled when telling whether the batch is complete
+PLAN, DONE and FAIL records are synced to disk in batches: losing some of them
+on a crash only means that a few files are checked again on next run
+
+When a journal is opened, files started but not finished are recovered:
+destinations with the modification time of their source were completely
+written (copies preserve source dates) and are marked as done; others are
+half-written and removed
+
+Name:        CARIAMA Import Journaling Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, json, threading
+from preferences import IMPORT_JOURNAL_NAME
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+PLAN, START, DONE, FAIL = 'PLAN', 'START', 'DONE', 'FAIL'
+
+
+class ImportJournal:
+    """
+    Write-ahead journal of an import batch. Thread safe
+
+    Args:
+        dstRootPath(str): Root of import destination, where journal file is kept
+        syncEvery(int, optional): Number of batched records written between syncs. Defaults to 64
+
+    Attributes:
+        private entries: Dict of source path -> [state, destination path, source mtime_ns, final failure]
+    """
+    def __init__(self, dstRootPath, syncEvery=64):
+        self.__path = os.path.join(dstRootPath, IMPORT_JOURNAL_NAME)
+        self.__syncEvery = syncEvery
+        self.__entries = {}
+        self.__unsynced = 0
+        self.__lock = threading.Lock()
+        self.__load()
+        os.makedirs(dstRootPath, exist_ok=True)
+        self.__file = open(self.__path, 'a')
+
+    def getPath(self):
+        """ Retrieves journal file path (str) """
+        return self.__path
+
+    def __load(self):
+        """ Replays journal file, if any. A torn last record (from a crash) is ignored """
+        try:
+            with open(self.__path, 'r') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        op, src = rec['op'], rec['src']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    entry = self.__entries.setdefault(src, [PLAN, None, None, False])
+                    if op==START:
+                        entry[:] = [START, rec['dst'], rec['mtime'], False]
+                    elif op==DONE:
+                        entry[:] = [DONE, rec['dst'], entry[2], False]
+                    elif op==FAIL:
+                        entry[0], entry[3] = FAIL, rec.get('final', False)
+        except FileNotFoundError:
+            pass
+
+    def __write(self, rec, sync):
+        self.__file.write(json.dumps(rec)+'\n')
+        self.__unsynced += 1
+        if sync or self.__unsynced>=self.__syncEvery:
+            self.__sync()
+
+    def __sync(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__unsynced = 0
+
+    def sync(self):
+        """ Forces batched records to disk """
+        with self.__lock:
+            self.__sync()
+
+    def recover(self):
+        """
+        Deals with files started but not finished by a previous run
+
+        Returns:
+            List of half-written destination files which were removed
+        """
+        removed = []
+        with self.__lock:
+            started = [(src, entry) for src, entry in self.__entries.items() if entry[0]==START]
+            claimed = {entry[1] for entry in self.__entries.values() if entry[0]==DONE}
+
+            # first, destinations completely written; they may also be claimed by other entries started concurrently
+            for src, entry in started:
+                try:
+                    if os.stat(entry[1]).st_mtime_ns==entry[2]:
+                        self.__write({'op':DONE, 'src':src, 'dst':entry[1]}, sync=False)
+                        entry[0] = DONE
+                        claimed.add(entry[1])
+                except FileNotFoundError:
+                    pass
+
+            for src, entry in started:
+                if entry[0]==DONE:
+                    continue
+                if entry[1] not in claimed:
+                    try:
+                        os.remove(entry[1])
+                        removed.append(entry[1])
+                    except FileNotFoundError:
+                        pass
+                self.__write({'op':FAIL, 'src':src, 'error':"interrupted"}, sync=False)
+                entry[0] = FAIL
+            self.__sync()
+        return removed
+
+    def plan(self, srcPaths):
+        """
+        Records the files of a batch. Files already known are left as they are
+        @param srcPaths: Iterable of source file paths
+        """
+        with self.__lock:
+            for src in srcPaths:
+                if src not in self.__entries:
+                    self.__entries[src] = [PLAN, None, None, False]
+                    self.__write({'op':PLAN, 'src':src}, sync=False)
+            self.__sync()
+
+    def isDone(self, srcPath):
+        """ Checks whether a file was imported (bool) """
+        entry = self.__entries.get(srcPath)
+        return entry is not None and entry[0]==DONE
+
+    def getDestination(self, srcPath):
+        """ Retrieves final path of an imported file, or None if it was not imported """
+        entry = self.__entries.get(srcPath)
+        if entry is None or entry[0]!=DONE:
+            return None
+        return entry[1]
+
+    def pending(self, files):
+        """
+        Filters out files already imported. No file is stat'ed or compared
+        @param files: Iterable of File objects
+        @return: List of File objects not imported yet
+        """
+        return [f for f in files if not self.isDone(f.getPath())]
+
+    def start(self, srcPath, dstPath, srcMtime):
+        """
+        Records that a file is about to be written. Record is on disk when this method returns
+        @param srcPath: Source file path
+        @param dstPath: Destination file path
+        @param srcMtime: Source file modification time (st_mtime_ns)
+        """
+        with self.__lock:
+            self.__entries[srcPath] = [START, dstPath, srcMtime, False]
+            self.__write({'op':START, 'src':srcPath, 'dst':dstPath, 'mtime':srcMtime}, sync=True)
+
+    def done(self, srcPath, dstPath):
+        """
+        Records that a file was imported
+        @param srcPath: Source file path
+        @param dstPath: Final path of imported file
+        """
+        with self.__lock:
+            entry = self.__entries.setdefault(srcPath, [PLAN, None, None, False])
+            entry[0], entry[1], entry[3] = DONE, dstPath, False
+            self.__write({'op':DONE, 'src':srcPath, 'dst':dstPath}, sync=False)
+
+    def fail(self, srcPath, error, final=False):
+        """
+        Records that a file could not be imported, so that nothing is cleaned up for it on recovery
+        @param srcPath: Source file path
+        @param error: Error description (str)
+        @param final: If True, retrying cannot fix the failure (e.g. file already exists on destination), and 
+        the file counts as handled by isComplete(). Defaults to False
+        """
+        with self.__lock:
+            entry = self.__entries.setdefault(srcPath, [PLAN, None, None, False])
+            entry[0], entry[3] = FAIL, final
+            rec = {'op':FAIL, 'src':srcPath, 'error':str(error)}
+            if final:
+                rec['final'] = True
+            self.__write(rec, sync=False)
+
+    def getCounts(self):
+        """ Retrieves number of files on each state
+
+        Returns:
+            Dict of state -> count
+        """
+        counts = {PLAN:0, START:0, DONE:0, FAIL:0}
+        with self.__lock:
+            for entry in self.__entries.values():
+                counts[entry[0]] += 1
+        return counts
+
+    def isComplete(self):
+        """ Checks whether all files of the journal were imported, or failed for good (bool) """
+        with self.__lock:
+            return all(entry[0]==DONE or (entry[0]==FAIL and entry[3]) for entry in self.__entries.values())
+
+    def close(self, remove=False):
+        """
+        Syncs and closes journal
+        @param remove: If True, journal file is deleted
+        """
+        with self.__lock:
+            if self.__file.closed:
+                return
+            self.__sync()
+            self.__file.close()
+            if remove:
+                os.remove(self.__path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+This module sets up logging for the package applications, once per process
+
+Records are handed to a queue by the threads that log them, and written to
+file by a single listener thread, so that importing threads never wait on
+file I/O. Each record is written as one JSON object per line, with any
+extra fields given to the logging call (e.g. source and destination paths,
+durations), and the log file is rotated by size
+
+Name:        CARIAMA Logging Configuration Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, json, queue, atexit, logging, threading, datetime
+import logging.handlers
+from preferences import LOG_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+# attributes every log record has; any other attribute came from the extra argument of a logging call
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None)))|{'message', 'asctime'}
+
+_lock = threading.Lock()
+_listener = None
+_queueHandler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats records as single line JSON objects, with time, level, logger name, message, extra fields and traceback """
+    def format(self, record):
+        data = {
+                'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'logger': record.name,
+                'thread': record.threadName,
+                'message': record.getMessage(),
+                }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['traceback'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler which keeps records structured: only message and traceback are rendered before queueing """
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setupLogging(logPath=LOG_PATH, level=logging.INFO, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT):
+    """
+    Sends the records of every logger to a size rotated JSON lines file, through a queue. Calls after
+    the first one do nothing, so handlers are never stacked
+    @param logPath: Path to log file. Default defined on preferences module
+    @param level: Minimum level of logged records. Defaults to logging.INFO
+    @param maxBytes: Size at which log file is rotated. Default defined on preferences module
+    @param backupCount: Number of rotated files kept. Default defined on preferences module
+    @return: True if logging was set up by this call, and False if it already was
+    """
+    global _listener, _queueHandler
+    with _lock:
+        if _listener is not None:
+            return False
+        logDir = os.path.dirname(os.path.abspath(logPath))
+        os.makedirs(logDir, exist_ok=True)
+        fileHandler = logging.handlers.RotatingFileHandler(logPath, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8', delay=True)
+        fileHandler.setFormatter(JsonFormatter())
+
+        records = queue.SimpleQueue()
+        _queueHandler = _QueueHandler(records)
+        _listener = logging.handlers.QueueListener(records, fileHandler)
+        _listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(_queueHandler)
+        root.setLevel(level)
+        atexit.register(shutdownLogging)
+        return True
+
+def shutdownLogging():
+    """ Writes queued records, and stops the listener thread. Logging may be set up again afterwards """
+    global _listener, _queueHandler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_queueHandler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener, _queueHandler = None, None
@@ -2,44 +2,31 @@
 """
 MediaUtils Package Management Module
 
+Subcommands load the package modules (and the clint console toolkit) they
+use only when they run, so that the command line starts fast and file
+selection helpers can be imported on headless servers
+
 Name:        Package Management Module (management)
 Package:     CARIAMA Media Archive Utilities
 """
 
-import tkinter as tk
-from tkinter import filedialog
-
 import argparse
-from clint.textui import prompt, validators, puts, colored, progress, indent
-
-from preferences import INDEX_PREFIX, MEDIA_DB_QUARANTINE_ROOT, MEDIA_DB_ROOT, MEDIA_DB_DIR_STRUCTURE
-import fdmgm
-from fdmgm import File, Directory
-from fdmgm import importFile
-from fdmgm import FileImportingError, DirectoryIntegrityError
-
-from indexing import ParserError, FileIndexingError
-
-import os, sys, time, logging
-from argparse import Namespace
 
+from preferences import INDEX_PREFIX, MEDIA_DB_QUARANTINE_ROOT, MEDIA_DB_ROOT, MEDIA_DB_DIR_STRUCTURE, FIXITY_BUDGET_GB, HASH_WORKERS
 
-""" Setup logger """
-
-handler = logging.FileHandler('log.log')
-handler.setLevel(logging.DEBUG)
-
-formatter = logging.Formatter('\n%(asctime)s - %(name)s - %(levelname)s - %(message)s\n')
-handler.setFormatter(formatter)
-
+import os, sys, time, glob, logging
 
 
 """ Functions """
 
 def getFilesFromDialog(args):
-    """ Opens file dialog GUI for file or directory
+    """ Opens file dialog GUI for file or directory. GUI toolkit is only loaded here
     @return: a list of selected files
     """
+    import tkinter as tk
+    from tkinter import filedialog
+    from fdmgm import File, Directory
+    
     root = tk.Tk()
     root.withdraw()
     if args.file_select:
@@ -51,6 +38,93 @@ def getFilesFromDialog(args):
             return []
     else:
         raise ValueError("Invalid mode")
+
+def iterPathsFromStream(stream, bufferSize=65536):
+    """ 
+    Reads file paths from a binary stream, as they arrive. Paths are separated by NUL characters
+    (as printed by find -print0) if a NUL comes before the first newline, and by newlines otherwise
+    @param stream: Binary file object
+    @return: a generator of paths
+    """
+    sep, rest = None, b''
+    while True:
+        chunk = stream.read1(bufferSize) if hasattr(stream, 'read1') else stream.read(bufferSize)
+        if not chunk:
+            break
+        if sep is None:
+            nul, newline = chunk.find(b'\0'), chunk.find(b'\n')
+            if nul<0 and newline<0:
+                rest += chunk
+                continue
+            sep = b'\0' if nul>=0 and (newline<0 or nul<newline) else b'\n'
+        parts = (rest+chunk).split(sep)
+        rest = parts.pop()
+        for part in parts:
+            if sep==b'\n':
+                part = part.rstrip(b'\r')
+            if part:
+                yield os.fsdecode(part)
+    if rest.strip(b'\r\n'):
+        yield os.fsdecode(rest.rstrip(b'\r\n'))
+
+def iterFilesFromPaths(paths):
+    """ 
+    Streams File objects from paths. Directories are walked recursively, and invalid paths are reported and skipped
+    @param paths: Iterable of file or directory paths
+    @return: a generator of File objects
+    """
+    import metrics
+    from fdmgm import File, Directory
+    for path in paths:
+        if os.path.isdir(path):
+            for f in Directory(path).iterFiles():
+                metrics.count('files_selected')
+                yield f
+        else:
+            try:
+                f = File(path)
+                metrics.count('files_selected')
+                yield f
+            except FileNotFoundError:
+                from clint.textui import puts, colored, indent
+                with indent(4): puts(colored.red("Skipping invalid path: %s"%path))
+
+def getSelectedFiles(args):
+    """ 
+    Selects files from command line paths, glob patterns or a list file (- for stdin), or otherwise from a file dialog.
+    Files given on command line are streamed as they are found
+    @return: an iterable of selected files
+    """
+    if getattr(args, 'paths', None):
+        return iterFilesFromPaths(args.paths)
+    elif getattr(args, 'glob', None):
+        return iterFilesFromPaths(p for pattern in args.glob for p in glob.iglob(pattern, recursive=True))
+    elif getattr(args, 'from_file', None):
+        if args.from_file=='-':
+            return iterFilesFromPaths(iterPathsFromStream(sys.stdin.buffer))
+        def fromFile():
+            with open(args.from_file, 'rb') as f:
+                yield from iterPathsFromStream(f)
+        return iterFilesFromPaths(fromFile())
+    else:
+        return getFilesFromDialog(args)
+
+def withMediaType(f, mediaType):
+    """ Sets media type of a file and returns it """
+    f.setMediaType(mediaType)
+    return f
+
+def hasSelection(args):
+    """ Checks whether some file selection method was given on command line """
+    return any(getattr(args, name, None) for name in ('dir_select', 'file_select', 'paths', 'glob', 'from_file'))
+
+def addSelectorArguments(group):
+    """ Adds file selection arguments to a (mutually exclusive) argument group """
+    group.add_argument('-d', help="Use directory selector assistant", action="store_true", dest="dir_select")
+    group.add_argument('-f', help="Use file selector assistant", action="store_true", dest="file_select")
+    group.add_argument('--paths', nargs='+', help="Select files (or directories, recursively) from command line", metavar="PATH")
+    group.add_argument('--glob', nargs='+', help="Select files matching glob patterns (** matches subdirectories)", metavar="PATTERN")
+    group.add_argument('--from-file', help="Select files listed on a file, or on standard input if -. Paths are separated by newlines or NUL characters", metavar="LISTFILE")
     
 
 class Import():
@@ -60,8 +134,8 @@ class Import():
                 parser.error("quarantine importing mode requires -t/--mediatype to be set")
             if args.mediatype not in INDEX_PREFIX.keys():
                 parser.error("invalid media type: %s"%args.mediatype)
-            if not (args.dir_select or args.file_select):
-                parser.error("must specify -d or -f for directory or file selector")
+            if not hasSelection(args):
+                parser.error("must specify -d or -f for directory or file selector, or --paths, --glob or --from-file")
             self.__import_to_quarantine(args)
             
         elif args.database: 
@@ -70,111 +144,219 @@ class Import():
             if args.index and not args.mediatype:
                 parser.error("custom path importing mode can only apply index if -t/--mediatype is set")
             self.__import_to_path(args)
+        elif args.from_plan:
+            self.__import_from_plan(args)
             
     def __del__(self):
+        from clint.textui import puts, colored, indent
         with indent(4, quote=">>"): puts(colored.cyan("Done"))
     
-    def __import_files(self, fList, destPath, organizeBy=None, copy=True, indexing=False):
-        """ Base function for importing files """
+    def __import_files(self, fList, destPath, organizeBy=None, copy=True, indexing=False, jobs=1, method=None, verify=False, useCatalog=False, journal=None,
+                       dryRun=False, planPath=None, plan=None, verbose=False, usePipeline=False, useDedup=False):
+        """ Base function for importing files. With jobs>1 files are imported concurrently, but reported in input order.
+        Progress is reported in bytes, on a throttled progress line; each file is only listed in verbose mode.
+        With usePipeline, walking, duplicate checks and importing overlap, and files are reported as they are done.
+        If useCatalog is set, imported files are recorded on the media catalog, and if a journal is given, importing is journaled.
+        With useDedup, files whose contents are anywhere under destination are not imported (plans are executed as computed, without this lookup).
+        With dryRun or planPath, an import plan is computed and printed (or saved) first, and executed unless on dry run. 
+        A plan computed beforehand may also be given, in place of files """
+        from clint.textui import puts, colored, indent
+        import catalog, planning, reporting, pipeline, dedup
+        from fdmgm import importFiles, FileImportingError
+        
         # set logger
         logger = logging.getLogger(__name__)
-        logger.setLevel(logging.INFO)
-        logger.addHandler(handler)    
+        
+        # planning routine
+        if plan is None and (dryRun or planPath is not None):
+            if method is None:
+                method = 'copy' if copy else 'move'
+            plan = planning.ImportPlanner(destPath, organizeBy=organizeBy, indexing=indexing, method=method).plan(fList)
+            self.__print_plan(plan, listAll=dryRun)
+            if planPath is not None:
+                plan.save(planPath)
+                with indent(3, quote='>>'): puts(colored.cyan("Import plan saved to %s"%planPath))
+                logger.info("Saved import plan of %d files into %s to %s"%(len(plan.entries), destPath, planPath))
+            if dryRun:
+                return
         
         # importing routine
         with indent(3, quote='>>'): puts(colored.cyan("Importing Files to %s"%destPath))  
-        with progress.Bar(expected_size=len(fList)) as bar:
-                    val=0
-                    for f in fList:
-                        val +=1
-                        try:                        
-                            with indent(5): puts(colored.green("Importing file %s"%f.getPath()))   
-                            bar.show(val-1)                         
-                            impf = importFile(f, destPath, organizeBy=organizeBy, indexing=indexing)
-                            logger.info("Imported file %s successfully into %s"%(f.getPath(),impf.getPath()))
-                        
-                        except FileImportingError as e:
-                            with indent(5): puts(colored.red("%s"%e))
-                            logger.error("Error importing file", exc_info=True)
-                            
-                        finally:                      
-                            bar.show(val)
+        imported, failed = 0, 0
+        writer = catalog.CatalogWriter() if useCatalog else None
+        archiveDedup = None
+        if useDedup and plan is None:
+            archiveDedup = dedup.ArchiveDedup(destPath)
+            with indent(3, quote='>>'): puts(colored.cyan("Updating content index of %s"%destPath))
+            diff = archiveDedup.update()
+            logger.info("Content index of %s updated: %d added, %d removed, %d modified"%(destPath, len(diff.added), len(diff.removed), len(diff.modified)))
+        if plan is not None:
+            okEntries = list(plan.iterEntries(planning.OK))
+            totalFiles, totalBytes = len(okEntries), sum(entry['size'] for entry in okEntries)
+            results = ((entry['src'], entry['size'], res) for entry, res in planning.executePlan(plan, jobs=jobs, verify=verify, catalog=writer, journal=journal))
+        else: # streamed selections have no known size
+            totalFiles, totalBytes = None, None
+            if hasattr(fList, '__len__'):
+                totalFiles, totalBytes = len(fList), sum(self.__sizeOf(f) for f in fList)
+            importOptions = dict(copy=copy, indexing=indexing, method=method, verify=verify, catalog=writer, journal=journal, dedup=archiveDedup)
+            if usePipeline:
+                imports = pipeline.iterImportPipeline(fList, destPath, organizeBy=organizeBy, importWorkers=jobs, **importOptions)
+            else:
+                imports = importFiles(fList, destPath, organizeBy=organizeBy, jobs=jobs, **importOptions)
+            results = ((f.getPath(), self.__sizeOf(f if isinstance(res, Exception) else res), res) for f, res in imports)
+        reporter = reporting.ProgressReporter(totalBytes=totalBytes, totalFiles=totalFiles, stream=sys.stdout)
+        try:
+            for srcPath, size, res in results:
+                if isinstance(res, FileImportingError):
+                    failed += 1
+                    reporter.write(str(colored.red("     Could not import file %s: %s"%(srcPath, res))))
+                    logger.error("Error importing file %s", srcPath, exc_info=(type(res), res, res.__traceback__), extra={'src':srcPath})
+                else: # imported files are logged, with their durations, by importing threads
+                    imported += 1
+                    if verbose:
+                        reporter.write(str(colored.green("     Imported file %s into %s"%(srcPath, res.getPath()))))
+                reporter.update(size, failed=isinstance(res, FileImportingError))
+        finally: # files already imported are recorded even if importing is interrupted
+            reporter.done()
+            if writer is not None:
+                writer.close()
+            if archiveDedup is not None:
+                archiveDedup.close()
+
+        if writer is not None:
+            logger.info("Recorded %d files on media catalog"%writer.getWrittenCount())
+        with indent(3, quote='>>'): puts(colored.cyan("%d files imported, %d failed"%(imported, failed)))
+        logger.info("Imported %d files into %s; %d failed"%(imported, destPath, failed))
+    
+    @staticmethod
+    def __sizeOf(f):
+        """ Retrieves size of a file, or 0 if it vanished """
+        try:
+            return f.getSize()
+        except OSError:
+            return 0
+    
+    def __print_plan(self, plan, listAll=False):
+        """ Prints out an import plan. Entries which will not be imported are always listed """
+        from clint.textui import puts, colored, indent
+        import planning
+        counts = plan.getCounts()
+        with indent(3, quote='>>'): 
+            puts(colored.cyan("Import plan (%s): %d files to import, %d name conflicts, %d duplicates, %d errors; %d directories to create"%(
+                              plan.method, counts[planning.OK], counts[planning.NAME_CONFLICT], counts[planning.DUPLICATE], counts[planning.ERROR], len(plan.dirs))))
+        for entry in plan.iterEntries():
+            if entry['status']==planning.OK:
+                if listAll:
+                    with indent(5): puts(colored.green("%s -> %s"%(entry['src'], entry['dst'])))
+            else:
+                with indent(5): puts(colored.red("[%s] %s: %s"%(entry['status'], entry['src'], entry['reason'])))
+    
+    def __import_from_plan(self, args):
+        """ Executes an import plan saved by a previous run """
+        from clint.textui import puts, colored, indent
+        import planning
+        try:
+            plan = planning.ImportPlan.load(args.from_plan)
+        except (OSError, ValueError) as e:
+            with indent(3, quote='>>'): puts(colored.red("Could not load import plan: %s"%e))
+            return
+        self.__print_plan(plan, listAll=args.dry_run)
+        if not args.dry_run:
+            self.__import_files(None, plan.dstRootPath, jobs=args.jobs, verify=args.verify, useCatalog=args.catalog, plan=plan, verbose=args.verbose)
        
     def __import_to_quarantine(self, args):
         """ 
         Opens a file selector and lets user pick up files to be imported to quarantine 
         @param param: 
         """
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.INFO)
-        logger.addHandler(handler)
-        
-        # file selector dialog
-        flist = getFilesFromDialog(args)
-        
-        # sets media type
-        for f in flist:
-            f.setMediaType(args.mediatype)
+        # file selection, with media type set as files stream in
+        flist = (withMediaType(f, args.mediatype) for f in getSelectedFiles(args))
         
         # importing routine
         importPath = os.path.join(MEDIA_DB_QUARANTINE_ROOT, args.quarantine)
-        self.__import_files(flist, importPath, organizeBy=None, copy=True, indexing=args.index)
+        self.__import_files(flist, importPath, organizeBy=None, copy=True, indexing=args.index, jobs=args.jobs, verify=args.verify, useCatalog=args.catalog, dryRun=args.dry_run, planPath=args.save_plan, verbose=args.verbose, usePipeline=args.pipeline, useDedup=args.dedup)
         
         # finalization
         return
         
     def __import_to_database(self, args):
         """ Imports file to media database from the quarantine. Checks its integrity first """
-        # Verify quarantine before importing files
-        setFix=False
+        from clint.textui import prompt, validators, puts, colored, indent
+        import journaling
+        from fdmgm import Directory, DirectoryIntegrityError
+        
+        # Verify quarantine before importing files; issues are printed out as soon as they are found.
+        # Quarantine is walked once: files are checked, fixed and imported from the same list
+        quarantine = Directory(MEDIA_DB_QUARANTINE_ROOT)
+        flist = quarantine.getFiles(recursive=True)
         while True:
-            try: # tries to pass integrity check
-                quarantine = Directory(MEDIA_DB_QUARANTINE_ROOT)
-                quarantine.checkIntegrity(fix=setFix)
+            numIssues = 0
+            for issue in quarantine.iterIntegrityIssues(files=flist):
+                if numIssues==0:
+                    with indent(4, quote=">>"):
+                        puts("The following issues were detected on the quarantine:")
+                    print("\n")
+                numIssues += 1
+                self.__print_issue(issue.__class__.__name__, issue.args, quarantine)
+            
+            if numIssues==0: # quarantine passed integrity check
                 break
                 
-            # prints out the issues detected on quarantine    
-            except DirectoryIntegrityError as e: 
-                with indent(4, quote=">>"):
-                    puts("The following issues were detected on the quarantine:")
-                print("\n")
-                for issue in e.issues:
-                    with indent(8): puts(colored.red("[%s]\n %s for file %s\n"%(issue[0], issue[1][1], os.path.relpath(issue[1][0], quarantine.getPath()))) )
-                
-                # try to fix issues?
-                setFix = prompt.query("Do you want me to try fixing them? [y/n]", validators=[validators.OptionValidator(["Y", "y", "N", "n"], "type y (yes) or n (no)")])
-                if setFix=='y' or setFix=="Y":
-                    setFix=True
-                    print("trying to fix\n\n\n")
+            # try to fix issues?
+            setFix = prompt.query("Do you want me to try fixing them? [y/n]", validators=[validators.OptionValidator(["Y", "y", "N", "n"], "type y (yes) or n (no)")])
+            if setFix=='y' or setFix=="Y":
+                print("trying to fix\n\n\n")
+                try:
+                    quarantine.checkIntegrity(fix=True, files=flist)
+                except DirectoryIntegrityError: # remaining issues are listed again
                     pass
-                # do not try to fix issues. quit importing routine
-                else:
-                    with indent(3, quote=">>"): puts("Could not fix the issues. Now quitting...")
-                    sys.exit()                     
+            # do not try to fix issues. quit importing routine
+            else:
+                with indent(3, quote=">>"): puts("Could not fix the issues. Now quitting...")
+                sys.exit()                     
         
         
-        # if quarantine is all set, start importing routine
-        flist = [f for f in quarantine.getFiles(recursive=True)]
-        self.__import_files(flist, MEDIA_DB_ROOT, organizeBy=MEDIA_DB_DIR_STRUCTURE, copy=True, indexing=False)
+        # if quarantine is all set, start importing routine. Files are promoted without copying if requested and possible
+        
+        # a dry run only prints out the import plan, leaving the journal alone
+        if args.dry_run:
+            self.__import_files(flist, MEDIA_DB_ROOT, organizeBy=MEDIA_DB_DIR_STRUCTURE, copy=True, indexing=False, method=args.promote, dryRun=True, planPath=args.save_plan, verbose=args.verbose, usePipeline=args.pipeline, useDedup=args.dedup)
+            return
+        
+        # importing is journaled, so that an interrupted run is resumed by the next one
+        journal = journaling.ImportJournal(MEDIA_DB_ROOT)
+        try:
+            for path in journal.recover():
+                with indent(3, quote='>>'): puts(colored.yellow("Removed half-written file %s"%path))
+            journal.plan(f.getPath() for f in flist)
+            pending = journal.pending(flist)
+            if len(pending)<len(flist):
+                with indent(3, quote='>>'): puts(colored.cyan("Resuming import: %d of %d files already imported"%(len(flist)-len(pending), len(flist))))
+            self.__import_files(pending, MEDIA_DB_ROOT, organizeBy=MEDIA_DB_DIR_STRUCTURE, copy=True, indexing=False, jobs=args.jobs, method=args.promote, verify=args.verify, useCatalog=args.catalog, journal=journal,
+                                dryRun=args.dry_run, planPath=args.save_plan, verbose=args.verbose, usePipeline=args.pipeline, useDedup=args.dedup)
+        finally:
+            journal.close(remove=journal.isComplete())
         
         # finalization
         return
   
+    def __print_issue(self, issueType, issueArgs, directory):
+        """ Prints out an integrity issue detected on a directory """
+        from clint.textui import puts, colored, indent
+        with indent(8): puts(colored.red("[%s]\n %s for file %s\n"%(issueType, issueArgs[1], os.path.relpath(issueArgs[0], directory.getPath()))) )
+  
     def __import_to_path(self, args):
         """ Opens a file selector and lets user pick up files to be imported to custom path """
-        # file selector dialog
-        flist = getFilesFromDialog(args)
-            
-        # sets media type
-        for f in flist:
-            f.setMediaType(args.mediatype)
+        # file selection, with media type set as files stream in
+        flist = (withMediaType(f, args.mediatype) for f in getSelectedFiles(args))
             
         # importing routine
-        self.__import_files(flist, args.path, organizeBy=None, copy=True, indexing=args.index)
+        self.__import_files(flist, args.path, organizeBy=None, copy=True, indexing=args.index, jobs=args.jobs, verify=args.verify, useCatalog=args.catalog, dryRun=args.dry_run, planPath=args.save_plan, verbose=args.verbose, usePipeline=args.pipeline, useDedup=args.dedup)
         
 
 class Datetime():
     def __init__(self, args, parser):
+        from clint.textui import puts, colored, indent
         if args.add:
             with indent(4, quote=">>"): puts(colored.cyan("Entering datetime add mode..."))
             
@@ -184,12 +366,13 @@ class Datetime():
             self.__fix(args)
             
     def __del__(self):
+        from clint.textui import puts, colored, indent
         with indent(4, quote=">>"): puts(colored.cyan("Done"))
     
     def __add(self, args):
         """ Opens a file selector and adds an amount of seconds for each """
         # file selector dialog
-        flist = getFilesFromDialog(args)
+        flist = getSelectedFiles(args)
         
         # add seconds
         numOfSecs=eval(args.add)
@@ -198,8 +381,10 @@ class Datetime():
             
     def __fix(self, args):
         """ Opens a file selector and tries to fix datetime for each file """ 
+        from clint.textui import puts, colored, indent
+        
         # file selector dialog
-        flist = getFilesFromDialog(args)
+        flist = getSelectedFiles(args)
         
         # try to fix
         for f in flist:
@@ -217,25 +402,167 @@ class SetIndex():
         pass
     
     def __update_index(self, args):
+        from clint.textui import puts, colored, indent
+        from fdmgm import Directory
+        
         # file selector dialog
-        flist= getFilesFromDialog(args)
+        flist = getSelectedFiles(args)
         
-        # update files
+        # fix dates, then index the files of each directory at once
+        byDir = {}
         for f in flist:
             try:
                 f.setDatetime(fromIndex=True)
                 f.setMediaType(f.getMediaType())
-                f.setIndex()
+                byDir.setdefault(f.getDir(), []).append(f)
             except ValueError as e:
                 with indent(4): puts(colored.red("Could not update index from %s: %s"%(f.getName(),e)))
-            except FileIndexingError as e:
-                with indent(4): puts(colored.red("Could not update index from %s: %s"%(f.getName(), e.strerror)))
+        
+        for dirPath, files in byDir.items():
+            renamed, errors = Directory(dirPath).reindex(files)
+            for e in errors:
+                with indent(4): puts(colored.red("Could not update index from %s: %s"%(os.path.basename(e.filename), e.strerror)))
+            
+
+class Scan():
+    def __init__(self, args, parser):
+        self.__scan(args)
+    
+    def __scan(self, args):
+        """ Rescans a directory tree, listing only directories changed since last scan, and reports what changed """
+        from clint.textui import puts, colored, indent
+        import scanning, catalog
+        from fdmgm import File
+        from indexing import FileIndexingError
+        
+        logger = logging.getLogger(__name__)
+        
+        rootPath = args.path if args.path is not None else MEDIA_DB_ROOT
+        scanner = scanning.ArchiveScanner(rootPath)
+        firstScan = not scanner.hasSnapshot()
+        with indent(3, quote='>>'): puts(colored.cyan("Scanning %s%s"%(rootPath, " (first scan)" if firstScan else "")))
+        diff = scanner.scan()
+        counters = scanner.getCounters()
+        
+        if not firstScan or args.verbose:
+            for label, color, paths in (('+', colored.green, diff.added), ('-', colored.red, diff.removed), ('M', colored.yellow, diff.modified)):
+                for path in paths:
+                    with indent(5): puts(color("%s %s"%(label, os.path.relpath(path, rootPath))))
+        with indent(3, quote='>>'): puts(colored.cyan("%d added, %d removed, %d modified (%d of %d directories listed)"%(
+                                          len(diff.added), len(diff.removed), len(diff.modified), counters['dirsListed'], counters['dirsStatted'])))
+        logger.info("Scanned %s: %d added, %d removed, %d modified"%(rootPath, len(diff.added), len(diff.removed), len(diff.modified)))
+        
+        # index new files; renamed files are picked up by a rescan
+        if args.index:
+            indexed = 0
+            for path in diff.added:
+                try:
+                    f = File(path, mediaType=args.mediatype)
+                    f.setIndex()
+                    indexed += 1
+                except FileIndexingError as e:
+                    logger.info("File not indexed: %s"%e)
+                except FileNotFoundError:
+                    pass
+            if indexed:
+                with indent(3, quote='>>'): puts(colored.cyan("%d files indexed"%indexed))
+                diff = scanning.mergeDiffs(diff, scanner.scan())
+        
+        if args.catalog:
+            with catalog.CatalogWriter() as writer:
+                writer.remove(diff.removed)
+                for path in diff.added+diff.modified:
+                    try:
+                        writer.add(File(path))
+                    except FileNotFoundError: # file vanished after scanning
+                        pass
+            with indent(3, quote='>>'): puts(colored.cyan("Catalog updated"))
+            logger.info("Catalog updated from scan of %s"%rootPath)
+            
+
+class Watch():
+    def __init__(self, args, parser):
+        self.__watch(args)
+    
+    def __watch(self, args):
+        """ Watches the quarantine and imports files to media database as soon as they are completely written """
+        from clint.textui import puts, colored, indent
+        import watching, catalog
+        
+        limiter = None
+        if args.daily_limit is not None:
+            limiter = watching.RateLimiter.fromDailyBudget(args.daily_limit*1024**3)
+        watcher = watching.getWatcher(MEDIA_DB_QUARANTINE_ROOT, polling=args.poll, interval=args.interval)
+        writer = catalog.CatalogWriter(batchSize=1) if args.catalog else None
+        quarantineWatcher = watching.QuarantineWatcher(MEDIA_DB_QUARANTINE_ROOT, MEDIA_DB_ROOT, organizeBy=MEDIA_DB_DIR_STRUCTURE, 
+                                                       mediaType=args.mediatype, settleTime=args.settle, rateLimiter=limiter, 
+                                                       watcher=watcher, copy=not args.move, verify=args.verify, catalog=writer)
+        
+        with indent(3, quote='>>'): puts(colored.cyan("Watching %s (%s). Press Ctrl+C to stop"%(MEDIA_DB_QUARANTINE_ROOT, type(watcher).__name__)))
+        try:
+            for path, res in quarantineWatcher.run():
+                if isinstance(res, Exception):
+                    with indent(5): puts(colored.red("Could not import %s: %s"%(path, res)))
+                else:
+                    with indent(5): puts(colored.green("Imported %s into %s"%(path, res.getPath())))
+        except KeyboardInterrupt:
+            with indent(3, quote='>>'): puts(colored.cyan("Stopped watching"))
+        finally:
+            if writer is not None:
+                writer.close()
+            
+
+class Fixity():
+    def __init__(self, args, parser):
+        self.__fixity(args)
+    
+    def __fixity(self, args):
+        """ Verifies the checksums of the files not verified for the longest time, up to a byte budget. Exits with status 1 if any file failed """
+        from clint.textui import puts, colored, indent
+        import fixity, reporting
+        
+        logger = logging.getLogger(__name__)
+        
+        rootPath = args.path if args.path is not None else MEDIA_DB_ROOT
+        failed = 0
+        with fixity.FixityAuditor(rootPath) as auditor:
+            if not args.no_scan:
+                diff = auditor.sync()
+                with indent(3, quote='>>'): puts(colored.cyan("%s: %d added, %d removed, %d modified since last audit"%(
+                                                  rootPath, len(diff.added), len(diff.removed), len(diff.modified))))
+                for path in diff.removed:
+                    logger.warning("File removed from archive", extra={'path':path})
+            
+            budget = int(args.budget*1024**3)
+            reporter = reporting.ProgressReporter(budget, stream=sys.stdout)
+            for res in auditor.audit(budget, workers=args.jobs):
+                reporter.update(res.size, failed=res.status in (fixity.CORRUPT, fixity.MISSING, fixity.ERROR))
+                if res.status==fixity.CORRUPT:
+                    failed += 1
+                    reporter.write(colored.red("CORRUPT %s (expected %s, found %s)"%(res.path, res.expected, res.actual)))
+                    logger.error("File corrupt", extra={'path':res.path, 'expected':res.expected, 'actual':res.actual})
+                elif res.status in (fixity.MISSING, fixity.ERROR):
+                    failed += 1
+                    reporter.write(colored.red("%s %s"%(res.status, res.path)))
+                    logger.error("File could not be verified", extra={'path':res.path, 'status':res.status})
+                elif args.verbose:
+                    reporter.write(colored.green("%s %s"%(res.status, res.path)))
+            reporter.done()
+            
+            counts = auditor.getCounts()
+            oldest = "never" if counts['oldest'] is None else time.strftime('%Y-%m-%d %H:%M', time.localtime(counts['oldest']))
+            with indent(3, quote='>>'): puts(colored.cyan("%d files tracked, %d never verified, oldest verification: %s"%(counts['files'], counts['unverified'], oldest)))
+            logger.info("Fixity audit of %s: %d files failed"%(rootPath, failed))
+        if failed:
+            sys.exit(1)
             
 
 def main():
     
     """ Parse arguments """
     parser = argparse.ArgumentParser()
+    parser.add_argument('--stats', help="Print operation counters and latencies when done", action="store_true")
+    parser.add_argument('--metrics-textfile', help="Export operation metrics to a Prometheus textfile (for node_exporter textfile collector) when done", metavar="FILE.prom")
     subparsers = parser.add_subparsers(title='subcommands', help='additional help')  
     
     # Import subcommand
@@ -244,11 +571,20 @@ def main():
     parser_import_fselector = parser_import.add_mutually_exclusive_group()
     parser_import_mode.add_argument('--quarantine', nargs='?', const='.', help="Import files to system quarantine root, or an optional subdir specified by [SUBPATH]. Specify media type with -t/--mtype and selector assistant for file (-f) or directory (-d)", metavar="SUBPATH")
     parser_import_mode.add_argument('--database', help="Import files from quarantine to media database", action="store_true")
+    parser_import_mode.add_argument('--from-plan', help="Import files as planned on an import plan file saved with --save-plan", metavar="PLANFILE")
     parser_import_mode.add_argument('--path', help="Import files to a custom path. Specify whether to apply indexation with -i/--index and choose selector assistant for file (-f) or directory (-d). If indexing, must specify media type -t/--mediatype")
     parser_import.add_argument('-t', '--mediatype', help='Specify media type')
     parser_import.add_argument('-i', '--index', help="Apply indexing to files on importing", action="store_true")
-    parser_import_fselector.add_argument('-d', help="Use directory selector assistant", action="store_true", dest="dir_select")
-    parser_import_fselector.add_argument('-f', help="Use file selector assistant", action="store_true", dest="file_select")
+    parser_import.add_argument('--promote', choices=['link', 'rename'], help="On --database mode, promote files from quarantine by hard linking or renaming them, when quarantine and database are on the same device. Files are copied otherwise")
+    parser_import.add_argument('-j', '--jobs', help="Number of files imported concurrently (defaults to 1)", type=int, default=1, metavar="N")
+    parser_import.add_argument('--catalog', help="Record imported files on the media catalog (media app of the cariama project)", action="store_true")
+    parser_import.add_argument('--verify', help="Read copied files back from disk and check them against the checksum computed while copying", action="store_true")
+    parser_import.add_argument('--dry-run', help="Only compute and print out the import plan, with destinations and conflicts of every file", action="store_true")
+    parser_import.add_argument('--pipeline', help="Overlap directory walking, duplicate checks and importing (-j sets concurrent imports). Files are reported as they are done", action="store_true")
+    parser_import.add_argument('--dedup', help="Do not import files whose contents are anywhere under destination, not only on their destination directories (checked through a content index of destination, updated first)", action="store_true")
+    parser_import.add_argument('-v', '--verbose', help="List every imported file, besides the progress line", action="store_true")
+    parser_import.add_argument('--save-plan', help="Save the import plan to a file, to be inspected and executed later with --from-plan", metavar="PLANFILE")
+    addSelectorArguments(parser_import_fselector)
     parser_import.set_defaults(func=Import, parser_name="parser_import") 
     
        
@@ -258,23 +594,65 @@ def main():
     parser_datetime_fselector = parser_datetime.add_mutually_exclusive_group(required=True)
     parser_datetime_mode.add_argument('--add', help="Add an ammount of seconds to file datetime", metavar="SECS")
     parser_datetime_mode.add_argument('--fix', help="Try to fix file datetime based on index parsing", action="store_true")
-    parser_datetime_fselector.add_argument('-d', help="Use directory selector assistant", action="store_true", dest="dir_select")
-    parser_datetime_fselector.add_argument('-f', help="Use file selector assistant", action="store_true", dest="file_select")
+    addSelectorArguments(parser_datetime_fselector)
     parser_datetime.set_defaults(func=Datetime, parser_name="parser_datetime")
     
     # Setindex subcommand
     parser_setindex = subparsers.add_parser('setindex', help="file indexation")
     parser_setindex_fselector = parser_setindex.add_mutually_exclusive_group(required=True)
     parser_setindex.add_argument('-u','--update', help="try to parse datetime and media type from previous index and update it", action="store_true")
-    parser_setindex_fselector.add_argument('-d', help="use directory selector assistant", action="store_true", dest="dir_select")
-    parser_setindex_fselector.add_argument('-f', help="use file selector assistant", action="store_true", dest="file_select")
+    addSelectorArguments(parser_setindex_fselector)
     parser_setindex.set_defaults(func=SetIndex, parser_name="parser_setindex")
         
+    # Scan subcommand
+    parser_scan = subparsers.add_parser('scan', help="find changes made to an archive tree since last scan")
+    parser_scan.add_argument('path', nargs='?', help="Root of the scanned tree. Defaults to media database root")
+    parser_scan.add_argument('--catalog', help="Update the media catalog with the changes found", action="store_true")
+    parser_scan.add_argument('-i', '--index', help="Apply indexing to added files. Specify media type of non indexed files with -t/--mediatype", action="store_true")
+    parser_scan.add_argument('-t', '--mediatype', help='Specify media type', choices=list(INDEX_PREFIX.keys()))
+    parser_scan.add_argument('-v', '--verbose', help="List every file found on first scan", action="store_true")
+    parser_scan.set_defaults(func=Scan, parser_name="parser_scan")
+        
+    # Watch subcommand
+    parser_watch = subparsers.add_parser('watch', help="import files from quarantine to media database as they arrive")
+    parser_watch.add_argument('-t', '--mediatype', help='Media type of files which are not indexed yet', choices=list(INDEX_PREFIX.keys()))
+    parser_watch.add_argument('--settle', help="Seconds a file must stay unchanged before being imported (defaults to 10)", type=float, default=10, metavar="SECS")
+    parser_watch.add_argument('--daily-limit', help="Spread imports evenly along the day, up to this amount of data per day", type=float, metavar="GB")
+    parser_watch.add_argument('--poll', help="Rescan quarantine periodically instead of using inotify", action="store_true")
+    parser_watch.add_argument('--interval', help="Seconds between rescans when polling (defaults to 5)", type=float, default=5, metavar="SECS")
+    parser_watch.add_argument('--move', help="Move files out of quarantine instead of copying them", action="store_true")
+    parser_watch.add_argument('--catalog', help="Record imported files on the media catalog", action="store_true")
+    parser_watch.add_argument('--verify', help="Verify copied files against the checksum computed while copying", action="store_true")
+    parser_watch.set_defaults(func=Watch, parser_name="parser_watch")
+    
+    # Fixity subcommand
+    parser_fixity = subparsers.add_parser('fixity', help="verify checksums of a slice of the archive, oldest verified first (run it periodically)")
+    parser_fixity.add_argument('path', nargs='?', help="Root of the audited archive. Defaults to media database root")
+    parser_fixity.add_argument('--budget', help="Amount of data verified by this run (defaults to %d)"%FIXITY_BUDGET_GB, type=float, default=FIXITY_BUDGET_GB, metavar="GB")
+    parser_fixity.add_argument('-j', '--jobs', help="Number of processes hashing files (defaults to number of CPUs)", type=int, default=HASH_WORKERS, metavar="N")
+    parser_fixity.add_argument('--no-scan', help="Do not look for files added to or removed from the archive before verifying", action="store_true")
+    parser_fixity.add_argument('-v', '--verbose', help="List every verified file, besides failures", action="store_true")
+    parser_fixity.set_defaults(func=Fixity, parser_name="parser_fixity")
+        
     # arguments parsing
     args = parser.parse_args()  
 
     # call functions
-    args.func(args, eval(args.parser_name))
+    import metrics, logconfig
+    logconfig.setupLogging()
+    if args.stats or args.metrics_textfile:
+        metrics.enable()
+    try:
+        with metrics.timer('command_seconds'):
+            args.func(args, eval(args.parser_name))
+    finally:
+        if args.stats:
+            from clint.textui import puts, colored, indent
+            with indent(3, quote='>>'): puts(colored.cyan("Stats"))
+            for line in metrics.formatStats():
+                with indent(5): puts(line)
+        if args.metrics_textfile:
+            metrics.writeTextfile(args.metrics_textfile, labels={'command':args.parser_name[len('parser_'):]})
       
 if __name__=='__main__':
     main()
\ No newline at end of file
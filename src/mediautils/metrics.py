@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+This module keeps operation-level metrics of the package routines: counters
+(stat calls, renames, bytes copied, compared and hashed, files imported...)
+and latency histograms for each phase of importing
+
+Metrics are disabled by default. While disabled, instrumented routines only
+pay for a function call that returns at once; timers are a shared no-op
+context manager. Once enabled, updates are thread safe
+
+Collected metrics can be printed as a summary or exported in Prometheus text
+format, to a textfile read by node_exporter textfile collector
+
+Name:        CARIAMA Metrics Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, re, time, bisect, threading, contextlib
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+""" Upper bounds (seconds) of latency histogram buckets """
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+PROMETHEUS_PREFIX = 'cariama_'
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_startTime = None
+_noTimer = contextlib.nullcontext()
+
+
+class Histogram:
+    """
+    Distribution of observed values, over fixed buckets
+
+    Args:
+        buckets(tuple, optional): Sorted upper bounds of buckets. Defaults to LATENCY_BUCKETS
+
+    Attributes:
+        counts: Number of observations on each bucket, plus one last bucket for values above all bounds
+        sum: Sum of observed values
+        count: Number of observations
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0]*(len(self.buckets)+1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Estimates a quantile as the upper bound of the bucket where it falls (float, or inf) """
+        if self.count==0:
+            return None
+        rank, seen = q*self.count, 0
+        for bound, n in zip(self.buckets+(float('inf'),), self.counts):
+            seen += n
+            if seen>=rank:
+                return bound
+        return float('inf')
+
+
+def enable():
+    """ Starts collecting metrics """
+    global _enabled, _startTime
+    with _lock:
+        if _startTime is None:
+            _startTime = time.time()
+        _enabled = True
+
+def disable():
+    """ Stops collecting metrics. Collected values are kept """
+    global _enabled
+    _enabled = False
+
+def isEnabled():
+    """ Checks whether metrics are being collected (bool) """
+    return _enabled
+
+def reset():
+    """ Discards collected metrics """
+    global _startTime
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _startTime = time.time() if _enabled else None
+
+def count(name, amount=1):
+    """
+    Increments a counter
+    @param name: Counter name, as in 'files_imported'
+    @param amount: Increment. Defaults to 1
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0)+amount
+
+def observe(name, value):
+    """
+    Records a value on a latency histogram
+    @param name: Histogram name, as in 'copy_seconds'
+    @param value: Observed value, in seconds
+    """
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(value)
+
+@contextlib.contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter()-start)
+
+def timer(name):
+    """
+    Times a block of code into a latency histogram, as in: with metrics.timer('copy_seconds'): ...
+    @param name: Histogram name
+    @return: Context manager. A shared no-op one while metrics are disabled
+    """
+    if not _enabled:
+        return _noTimer
+    return _timer(name)
+
+def getCounter(name):
+    """ Retrieves counter value (int), 0 if never incremented """
+    with _lock:
+        return _counters.get(name, 0)
+
+def snapshot():
+    """
+    Retrieves collected metrics
+    @return: Dictionary with 'elapsed' seconds since metrics were enabled, 'counters' (name -> value) and
+    'histograms' (name -> dict with count, sum, mean, p50, p99 and buckets)
+    """
+    with _lock:
+        elapsed = time.time()-_startTime if _startTime is not None else 0.0
+        histograms = {}
+        for name, h in _histograms.items():
+            histograms[name] = {'count':h.count, 'sum':h.sum, 'mean':h.sum/h.count if h.count else None,
+                                'p50':h.quantile(0.5), 'p99':h.quantile(0.99),
+                                'buckets':list(zip(h.buckets+(float('inf'),), h.counts))}
+        return {'elapsed':elapsed, 'counters':dict(_counters), 'histograms':histograms}
+
+def formatStats():
+    """
+    Formats collected metrics as a human readable summary
+    @return: List of lines (str)
+    """
+    snap = snapshot()
+    elapsed = snap['elapsed']
+    lines = ["elapsed: %.3fs"%elapsed]
+    for name, value in sorted(snap['counters'].items()):
+        line = "%s: %d"%(name, value)
+        if elapsed>0:
+            if name.endswith('_bytes'):
+                line += " (%.2f MB/s)"%(value/elapsed/2**20)
+            else:
+                line += " (%.1f/s)"%(value/elapsed)
+        lines.append(line)
+    for name, h in sorted(snap['histograms'].items()):
+        lines.append("%s: count %d, total %.3fs, mean %.6fs, p50 <= %s, p99 <= %s"%(name, h['count'], h['sum'], h['mean'] or 0.0, h['p50'], h['p99']))
+    return lines
+
+def _metricName(name):
+    return PROMETHEUS_PREFIX+re.sub('[^a-zA-Z0-9_]', '_', name)
+
+def _formatFloat(value):
+    if value==float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def toPrometheus(labels=None):
+    """
+    Formats collected metrics in Prometheus text exposition format
+    @param labels: Dictionary of labels added to every sample, as in {'job':'import'}. Defaults to None
+    @return: Text (str)
+    """
+    snap = snapshot()
+    labels = labels or {}
+    def labelStr(extra=None):
+        items = sorted(labels.items())+(extra or [])
+        if not items:
+            return ''
+        return '{'+','.join('%s="%s"'%(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items)+'}'
+
+    out = []
+    for name, value in sorted(snap['counters'].items()):
+        metric = _metricName(name)+'_total'
+        out.append("# TYPE %s counter"%metric)
+        out.append("%s%s %d"%(metric, labelStr(), value))
+    for name, h in sorted(snap['histograms'].items()):
+        metric = _metricName(name)
+        out.append("# TYPE %s histogram"%metric)
+        cumulative = 0
+        for bound, n in h['buckets']:
+            cumulative += n
+            out.append("%s_bucket%s %d"%(metric, labelStr([('le', _formatFloat(bound))]), cumulative))
+        out.append("%s_sum%s %s"%(metric, labelStr(), _formatFloat(h['sum'])))
+        out.append("%s_count%s %d"%(metric, labelStr(), h['count']))
+    metric = _metricName('last_run_timestamp_seconds')
+    out.append("# TYPE %s gauge"%metric)
+    out.append("%s%s %s"%(metric, labelStr(), _formatFloat(time.time())))
+    return '\n'.join(out)+'\n'
+
+def writeTextfile(filePath, labels=None):
+    """
+    Exports collected metrics to a node_exporter textfile. File is replaced atomically, so that the collector
+    never reads it half-written
+    @param filePath: Path to textfile. node_exporter only reads files ending with '.prom'
+    @param labels: Dictionary of labels added to every sample. Defaults to None
+    """
+    dirPath = os.path.dirname(os.path.abspath(filePath))
+    os.makedirs(dirPath, exist_ok=True)
+    tmpPath = os.path.join(dirPath, '.%s.%d.tmp'%(os.path.basename(filePath), os.getpid()))
+    with open(tmpPath, 'w') as f:
+        f.write(toPrometheus(labels))
+    os.replace(tmpPath, filePath)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+This module imports files through a pipeline of concurrent stages, so that
+walking the source tree, checking files for duplicates and copying them
+overlap instead of running one after another
+
+    walk --queue--> check --queue--> import --queue--> results
+
+The walk stage pulls source files in small batches from an iterable (usually
+a Directory walk). The check stage looks each file up on the hash index of
+its destination directory, hashing and comparing contents where sizes match,
+and drops duplicates before they take an import slot. The import stage runs
+fdmgm.importFile(), which checks the destination again as it reserves it.
+Stages are asyncio tasks connected by bounded queues, and every blocking
+filesystem call runs on an executor of the stage, so that memory stays flat
+on huge trees while disks are kept busy
+
+Name:        CARIAMA Import Pipeline Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, errno, queue, asyncio, itertools, threading, concurrent.futures
+import hashing
+from fdmgm import importFile, FileImportingError, IMPORTING_METHODS
+from preferences import IMPORTING_ORGANIZE_BY
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+_DONE = object() # end of stream marker, one per consumer
+
+
+def _takeBatch(it, batchSize):
+    """ Pulls up to batchSize items. Items pulled before an error are returned along with it """
+    batch = []
+    try:
+        batch.extend(itertools.islice(it, batchSize))
+    except Exception as e:
+        return batch, e
+    return batch, None
+
+def _findDuplicate(f, dstRootPath, organizeBy):
+    """ Looks a file up on its destination directory. Files whose destination cannot be computed are left to importFile() """
+    try:
+        dstDir = IMPORTING_ORGANIZE_BY[organizeBy](dstRootPath, f) if organizeBy is not None else dstRootPath
+    except (KeyError, ValueError, TypeError, OSError):
+        return None
+    if not os.path.isdir(dstDir):
+        return None
+    return hashing.getHashIndex(dstDir).findDuplicate(f.getPath(), size=f.getSize())
+
+
+class ImportPipeline:
+    """
+    Pipelined importing of many files. See fdmgm.importFile() for the meaning of importing options
+
+    Args:
+        dstRootPath(str): Root of destination directory
+        organizeBy(str, optional): Files organizational method. Defaults to None (all files to root)
+        checkWorkers(int, optional): Number of files checked for duplicates concurrently. Defaults to 2
+        importWorkers(int, optional): Number of files imported concurrently. Defaults to 2
+        queueSize(int, optional): Capacity of each queue between stages. Defaults to 64
+        batchSize(int, optional): Number of files pulled from the source walk at a time. Defaults to 32
+        **importOptions: Other keyword arguments of fdmgm.importFile() (copy, indexing, method, verify, catalog, journal)
+
+    Attributes:
+        private counters: Number of files walked, dropped as duplicates by the check stage, and imported
+    """
+    def __init__(self, dstRootPath, organizeBy=None, checkWorkers=2, importWorkers=2, queueSize=64, batchSize=32, **importOptions):
+        if importOptions.get('method') is not None and importOptions['method'] not in IMPORTING_METHODS:
+            raise ValueError("Invalid importing method: %s"%importOptions['method'])
+        self.__dstRootPath = dstRootPath
+        self.__organizeBy = organizeBy
+        self.__checkWorkers = max(1, checkWorkers)
+        self.__importWorkers = max(1, importWorkers)
+        self.__queueSize = queueSize
+        self.__batchSize = batchSize
+        self.__importOptions = importOptions
+        self.__counters = {'walked':0, 'duplicates':0, 'imported':0}
+
+    def getCounters(self):
+        """ Retrieves number of files walked, dropped as duplicates and imported so far (dict) """
+        return dict(self.__counters)
+
+    async def run(self, srcFiles):
+        """
+        Imports files. Results are yielded as files leave the pipeline, which is not necessarily input order
+        @param srcFiles: Iterable of File objects. It is consumed lazily, from a worker thread
+        @return: Asynchronous generator of (source File, imported File or FileImportingError) tuples
+        """
+        loop = asyncio.get_running_loop()
+        walkExecutor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='walk')
+        checkExecutor = concurrent.futures.ThreadPoolExecutor(self.__checkWorkers, thread_name_prefix='check')
+        importExecutor = concurrent.futures.ThreadPoolExecutor(self.__importWorkers, thread_name_prefix='import')
+        toCheck = asyncio.Queue(self.__queueSize)
+        toImport = asyncio.Queue(self.__queueSize)
+        results = asyncio.Queue(self.__queueSize)
+
+        async def finish(downstream, consumers):
+            """ Tells consumers of the next stage that stream ended """
+            for _ in range(consumers):
+                await downstream.put(_DONE)
+
+        async def walk():
+            it = iter(srcFiles)
+            try:
+                while True:
+                    batch, error = await loop.run_in_executor(walkExecutor, _takeBatch, it, self.__batchSize)
+                    for f in batch:
+                        self.__counters['walked'] += 1
+                        await toCheck.put(f)
+                    if error is not None:
+                        raise error
+                    if not batch:
+                        break
+            except Exception: # files walked so far still go through; error is raised at the end
+                await finish(toCheck, self.__checkWorkers)
+                raise
+            await finish(toCheck, self.__checkWorkers)
+
+        async def check():
+            while True:
+                f = await toCheck.get()
+                if f is _DONE:
+                    break
+                try:
+                    duplicate = await loop.run_in_executor(checkExecutor, _findDuplicate, f, self.__dstRootPath, self.__organizeBy)
+                except OSError: # source vanished or unreadable; reported by import stage
+                    duplicate = None
+                if duplicate is not None:
+                    self.__counters['duplicates'] += 1
+                    await results.put((f, FileImportingError(errno.EPERM, "Could not import file(File already exists)", duplicate)))
+                else:
+                    await toImport.put(f)
+
+        async def importer():
+            while True:
+                f = await toImport.get()
+                if f is _DONE:
+                    break
+                try:
+                    res = await loop.run_in_executor(importExecutor, lambda: importFile(f, self.__dstRootPath, organizeBy=self.__organizeBy, **self.__importOptions))
+                    self.__counters['imported'] += 1
+                except FileImportingError as e:
+                    res = e
+                await results.put((f, res))
+
+        async def stage(workers, downstream, consumers):
+            """ Runs the workers of a stage, and then ends the stream of the next stage """
+            try:
+                await asyncio.gather(*workers)
+            except Exception:
+                await finish(downstream, consumers)
+                raise
+            await finish(downstream, consumers)
+
+        tasks = [asyncio.ensure_future(walk()),
+                 asyncio.ensure_future(stage([check() for _ in range(self.__checkWorkers)], toImport, self.__importWorkers)),
+                 asyncio.ensure_future(stage([importer() for _ in range(self.__importWorkers)], results, 1))]
+        try:
+            while True:
+                item = await results.get()
+                if item is _DONE:
+                    break
+                yield item
+            await asyncio.gather(*tasks) # errors other than importing failures are raised here
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for executor in (walkExecutor, checkExecutor, importExecutor):
+                executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iterImportPipeline(srcFiles, dstRootPath, organizeBy=None, checkWorkers=2, importWorkers=2, queueSize=64, **importOptions):
+    """
+    Runs an import pipeline from synchronous code. The event loop runs on a thread of its own, and results are
+    handed over through a bounded queue, so the pipeline stalls if they are not consumed
+    @param srcFiles: Iterable of File objects
+    @param dstRootPath: Root of destination directory
+    @param organizeBy: Files organizational method. Defaults to None
+    @param checkWorkers: Number of files checked for duplicates concurrently. Defaults to 2
+    @param importWorkers: Number of files imported concurrently. Defaults to 2
+    @param queueSize: Capacity of each queue between stages. Defaults to 64
+    @param importOptions: Other keyword arguments of fdmgm.importFile()
+    @return: Generator of (source File, imported File or FileImportingError) tuples, as files leave the pipeline
+    """
+    pipeline = ImportPipeline(dstRootPath, organizeBy, checkWorkers, importWorkers, queueSize, **importOptions)
+    handover = queue.Queue(queueSize)
+    stop = threading.Event()
+
+    async def consume():
+        async for item in pipeline.run(srcFiles):
+            while not stop.is_set():
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, handover.put, item, True, 0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                break
+
+    def runLoop():
+        try:
+            asyncio.run(consume())
+            handover.put((_DONE, None))
+        except BaseException as e:
+            handover.put((_DONE, e))
+
+    thread = threading.Thread(target=runLoop, name='import-pipeline', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = handover.get()
+            if item[0] is _DONE:
+                if item[1] is not None:
+                    raise item[1]
+                break
+            yield item
+    finally: # on early exit, running imports are completed and the rest is dropped
+        stop.set()
+        while thread.is_alive():
+            try:
+                handover.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+This module plans imports before carrying them out
+
+An ImportPlanner computes, in one pass over the source files and with a
+single stat call for each of them, the destination directory, name and
+index of every file. Name collisions, and files with the same contents, are
+detected in memory, both inside the batch and against files already on the
+destination directories, which are listed once each. The resulting plan can
+be saved as JSON, inspected (dry run) and then executed in bulk: required
+directories are created once, and files are written straight to their final
+names
+
+Name:        CARIAMA Import Planning Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, json, time, errno
+import hashing, metrics
+import indexing as indx
+from fdmgm import File, FileImportingError, IMPORTING_METHODS, mapOrdered, logImported, isFinalFailure, writeImportedFile
+from preferences import IMPORTING_ORGANIZE_BY, HASH_ALGORITHM
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+""" Status of plan entries """
+OK = 'ok'
+NAME_CONFLICT = 'name-conflict'
+DUPLICATE = 'duplicate'
+ERROR = 'error'
+
+
+class _PlannedFile:
+    """ Stand-in for a File inside organizational methods, answering from values already computed """
+    def __init__(self, mediaType, timestamp):
+        self.__mediaType = mediaType
+        self.__timestamp = timestamp
+
+    def getMediaType(self):
+        return self.__mediaType
+
+    def getDatetime(self):
+        return self.__timestamp
+
+
+class ImportPlan:
+    """
+    Destinations computed for a batch of files
+
+    Args:
+        dstRootPath(str): Root of destination directory
+        method(str): Importing method, one of fdmgm.IMPORTING_METHODS
+        entries(list): List of entry dicts, with keys src, dst, size, mtime, status and (for entries not ok) reason
+        dirs(list): Directories that must be created
+
+    Attributes:
+        entries: List of entry dicts
+        dirs: List of directories to be created
+    """
+    def __init__(self, dstRootPath, method, entries, dirs):
+        self.dstRootPath = dstRootPath
+        self.method = method
+        self.entries = entries
+        self.dirs = dirs
+
+    def getCounts(self):
+        """ Retrieves number of entries for each status (dict) """
+        counts = {OK:0, NAME_CONFLICT:0, DUPLICATE:0, ERROR:0}
+        for entry in self.entries:
+            counts[entry['status']] += 1
+        return counts
+
+    def iterEntries(self, status=None):
+        """ Iterates over plan entries, optionally only the ones with some status """
+        for entry in self.entries:
+            if status is None or entry['status']==status:
+                yield entry
+
+    def toDict(self):
+        return {'dstRoot':self.dstRootPath, 'method':self.method, 'dirs':self.dirs, 'entries':self.entries}
+
+    @classmethod
+    def fromDict(cls, data):
+        return cls(data['dstRoot'], data['method'], data['entries'], data['dirs'])
+
+    def save(self, planPath):
+        """ Writes plan to a JSON file """
+        with open(planPath, 'w') as f:
+            json.dump(self.toDict(), f, indent=1)
+
+    @classmethod
+    def load(cls, planPath):
+        """
+        Reads a plan from a JSON file
+
+        Raises:
+            ValueError: If file does not hold a plan
+        """
+        with open(planPath, 'r') as f:
+            data = json.load(f)
+        try:
+            return cls.fromDict(data)
+        except (KeyError, TypeError):
+            raise ValueError("Not an import plan: %s"%planPath)
+
+
+class ImportPlanner:
+    """
+    Computes import plans. See fdmgm.importFile() for arguments meaning
+
+    Args:
+        dstRootPath(str): Root of destination directory
+        organizeBy(str, optional): Files organizational method. Defaults to None (all files to root)
+        indexing(bool, optional): If True, files not indexed yet are planned under their index. Defaults to False
+        method(str, optional): Importing method. Defaults to 'copy'
+        strict(bool, optional): If True, files with contents already on destination directory are duplicates. Defaults to True
+        algo(str, optional): Hashing algorithm used to compare contents. Default defined on preferences module
+
+    Attributes:
+        private listings: Cache of destination directory listings (dir path -> (whether directory exists, set of names))
+    """
+    def __init__(self, dstRootPath, organizeBy=None, indexing=False, method='copy', strict=True, algo=HASH_ALGORITHM):
+        if method not in IMPORTING_METHODS:
+            raise ValueError("Invalid importing method: %s"%method)
+        self.__dstRootPath = dstRootPath
+        self.__organizeBy = organizeBy
+        self.__indexing = indexing
+        self.__method = method
+        self.__strict = strict
+        self.__algo = algo
+        self.__listings = {}
+
+    def __listing(self, dirPath):
+        """ Lists a destination directory once. Planned names are added to listings as files are planned """
+        listing = self.__listings.get(dirPath)
+        if listing is None:
+            try:
+                with os.scandir(dirPath) as it:
+                    listing = (True, {e.name for e in it})
+            except (FileNotFoundError, NotADirectoryError):
+                listing = (False, set())
+            self.__listings[dirPath] = listing
+        return listing
+
+    def __destination(self, f, st):
+        """ Computes destination path of a file """
+        mediaType = f.getMediaType()
+        if self.__organizeBy is not None:
+            dstDir = IMPORTING_ORGANIZE_BY[self.__organizeBy](self.__dstRootPath, _PlannedFile(mediaType, st.st_mtime))
+        else:
+            dstDir = self.__dstRootPath
+
+        name = f.getName()
+        if self.__indexing:
+            try:
+                indx.parseIndex(name)
+            except indx.ParserError: # not indexed yet; index is computed as File.setIndex() does
+                name = indx.genIndex(indx.getPrefix(mediaType), st.st_mtime, st.st_size)
+        return os.path.join(dstDir, name+f.getExt())
+
+    def plan(self, files):
+        """
+        Plans the import of many files
+
+        Args:
+            files(iterable): File objects. Each one is stat'ed once, and files sharing their size with another
+                file of the same destination directory are hashed together, on a pool of workers
+
+        Returns:
+            ImportPlan object
+        """
+        entries, dirs = [], []
+        planned = {} # destination path -> entry
+        bySize = {} # size -> list of entries, for duplicates inside the batch
+        digests = {} # source path -> digest, or OSError if file could not be read
+        def digest(path, compute=True):
+            if path not in digests:
+                if not compute:
+                    return None
+                digests[path] = hashing.hashFile(path, self.__algo)
+            if isinstance(digests[path], OSError):
+                raise digests[path]
+            return digests[path]
+
+        located = []
+        for f in files:
+            entry = {'src':f.getPath(), 'dst':None, 'size':None, 'mtime':None, 'status':OK}
+            entries.append(entry)
+            try:
+                st = f.getStat()
+                entry['size'], entry['mtime'] = st.st_size, st.st_mtime_ns
+                entry['dst'] = self.__destination(f, st)
+            except (OSError, ValueError, KeyError, indx.ParserError) as e:
+                entry['status'], entry['reason'] = ERROR, "Could not plan file: %s"%e
+                continue
+            located.append(entry)
+        if self.__strict:
+            for path, res in hashing.hashFiles(self.__toHash(located), self.__algo):
+                digests[path] = res
+
+        for entry in located:
+            dstPath = entry['dst']
+            dstDir, dstName = os.path.split(dstPath)
+            dirExists, listing = self.__listing(dstDir)
+
+            # name collisions
+            if dstPath in planned:
+                entry['status'], entry['reason'] = NAME_CONFLICT, "Same destination as %s"%planned[dstPath]['src']
+                continue
+            if dstName in listing:
+                entry['status'], entry['reason'] = NAME_CONFLICT, "File already exists: %s"%dstPath
+                continue
+
+            # content collisions
+            if self.__strict:
+                try:
+                    duplicate = self.__findDuplicate(entry, bySize.get(entry['size'], ()), digest, dirExists)
+                except OSError as e:
+                    entry['status'], entry['reason'] = ERROR, "Could not read file: %s"%e
+                    continue
+                if duplicate is not None:
+                    entry['status'], entry['reason'] = DUPLICATE, "Same contents as %s"%duplicate
+                    continue
+
+            planned[dstPath] = entry
+            bySize.setdefault(entry['size'], []).append(entry)
+            if not dirExists and dstDir not in dirs:
+                dirs.append(dstDir)
+            listing.add(dstName)
+
+        return ImportPlan(self.__dstRootPath, self.__method, entries, dirs)
+
+    def __toHash(self, located):
+        """ Picks source paths which share their size with another source, or with a file, of the same destination directory """
+        counts = {}
+        for entry in located:
+            key = (os.path.dirname(entry['dst']), entry['size'])
+            counts[key] = counts.get(key, 0)+1
+        paths = []
+        for entry in located:
+            dstDir, dstName = os.path.split(entry['dst'])
+            dirExists, listing = self.__listing(dstDir)
+            if dstName in listing: # name conflict; never compared
+                continue
+            if counts[(dstDir, entry['size'])]>1:
+                paths.append(entry['src'])
+            elif dirExists:
+                index = hashing.getHashIndex(dstDir)
+                if index.getAlgorithm()==self.__algo and index.hasSize(entry['size']):
+                    paths.append(entry['src'])
+        return paths
+
+    def __findDuplicate(self, entry, sameSize, digest, dirExists):
+        """ Looks for files with the same contents on planned entries with the same destination directory, and on destination """
+        dstDir = os.path.dirname(entry['dst'])
+        for other in sameSize:
+            if os.path.dirname(other['dst'])==dstDir and digest(other['src'])==digest(entry['src']) \
+               and hashing.compareFiles(other['src'], entry['src']):
+                return other['src']
+        if dirExists:
+            index = hashing.getHashIndex(dstDir)
+            known = digest(entry['src'], compute=False) if index.getAlgorithm()==self.__algo else None
+            return index.findDuplicate(entry['src'], size=entry['size'], digest=known)
+        return None
+
+
+def executePlan(plan, jobs=1, verify=False, catalog=None, journal=None):
+    """
+    Carries out an import plan. Directories are created first, and then files are written straight to their
+    planned destinations. Files changed since planning are not imported
+    @param plan: ImportPlan object
+    @param jobs: Number of files imported concurrently. Defaults to 1
+    @param verify: If true, copied files are verified. See fdmgm.importFile()
+    @param catalog: catalog.CatalogWriter where imported files are recorded. Defaults to None
+    @param journal: journaling.ImportJournal where importing is recorded. Defaults to None
+    @return: Generator of (plan entry, imported File or FileImportingError) tuples, for entries with ok status
+    """
+    for dstDir in plan.dirs:
+        os.makedirs(dstDir, exist_ok=True)
+
+    def work(entry):
+        start = time.perf_counter()
+        try:
+            newf = _executeEntry(entry, plan.method, verify, catalog, journal)
+        except BaseException as e: # every failure is journaled, as by fdmgm.importFile()
+            metrics.count('import_failures')
+            if journal is not None:
+                journal.fail(entry['src'], e, final=isFinalFailure(e))
+            if isinstance(e, FileImportingError):
+                return e
+            raise
+        logImported(entry['src'], newf, plan.method, time.perf_counter()-start)
+        return newf
+
+    return mapOrdered(work, plan.iterEntries(OK), jobs)
+
+def _executeEntry(entry, method, verify, catalog, journal):
+    """ Imports a single planned file """
+    src, dst = entry['src'], entry['dst']
+    if journal is not None and journal.isDone(src):
+        try:
+            return File(journal.getDestination(src))
+        except FileNotFoundError: # imported file was removed or moved since; imported again as planned
+            pass
+    try:
+        f = File(src)
+        st = f.getStat()
+    except FileNotFoundError:
+        raise FileImportingError(errno.ENOENT, "Could not import file(source vanished)", src)
+    if (st.st_size, st.st_mtime_ns)!=(entry['size'], entry['mtime']):
+        raise FileImportingError(errno.EAGAIN, "Could not import file(source changed since planning)", src)
+
+    if method in ('link', 'rename') and os.stat(os.path.dirname(dst)).st_dev!=st.st_dev:
+        method = 'copy'
+    if journal is not None and not os.path.lexists(dst):
+        journal.start(src, dst, st.st_mtime_ns)
+    newf = writeImportedFile(f, dst, 'move' if method=='rename' else method, verify)
+
+    if catalog is not None:
+        catalog.add(newf)
+    if journal is not None:
+        journal.done(src, newf.getPath())
+    return newf
@@ -48,6 +48,34 @@ IMPORTING_ORGANIZE_BY = { # available organizational methods
 MEDIA_DB_DIR_STRUCTURE = 'PREFIX/date%Y%m' # Chose media db directories structure
 
 
+""" Package state preferences """
+# local directory where the package keeps its caches and bookkeeping files
+CARIAMA_STATE_ROOT = os.path.join(os.path.expanduser('~'), '.cariama')
+HASH_ALGORITHM = 'sha256' # content hashing algorithm (any hashlib algorithm name)
+HASH_WORKERS = os.cpu_count() or 1 # processes used to hash many files at once
+HASH_PROCESS_MIN_BYTES = 64*1024**2 # batches smaller than this are hashed in process, as starting workers costs more
+HASH_INDEX_ROOT = os.path.join(CARIAMA_STATE_ROOT, 'hashindex') # persisted directory hash indexes
+HASH_INDEX_CACHE_SIZE = 256 # directory hash indexes kept in memory
+HASH_INDEX_MAX_AGE_DAYS = 90 # persisted indexes not used for this long are removed
+SCAN_STATE_ROOT = os.path.join(CARIAMA_STATE_ROOT, 'scans') # archive snapshots kept for incremental rescans
+FIXITY_STATE_ROOT = os.path.join(CARIAMA_STATE_ROOT, 'fixity') # checksum databases of fixity audits
+FIXITY_BUDGET_GB = 50 # amount of data verified by each fixity audit run
+DEDUP_STATE_ROOT = os.path.join(CARIAMA_STATE_ROOT, 'dedup') # archive-wide hash catalogs and Bloom filters
+DEDUP_BLOOM_CAPACITY = 1000000 # files Bloom filters are initially sized for (they grow as needed)
+DEDUP_BLOOM_ERROR_RATE = 0.001 # false positive rate of Bloom filters
+WATCH_STATE_ROOT = os.path.join(CARIAMA_STATE_ROOT, 'watch') # files already handled by quarantine watchers
+IMPORT_JOURNAL_NAME = '.cariama-import.journal' # import journal, kept at the root of import destination
+
+""" Logging preferences """
+LOG_PATH = 'log.log' # JSON lines log of package applications
+LOG_MAX_BYTES = 10*1024**2 # log file is rotated when it reaches this size
+LOG_BACKUP_COUNT = 5 # number of rotated log files kept
+
+""" File copying preferences """
+# copy backends, in order of preference (see copying module)
+COPY_BACKENDS = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+
+
 def main():
     print(INDEX_DATETIME_LENGTH())
 
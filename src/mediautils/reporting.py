@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+This module reports the progress of long running operations on a terminal
+
+Progress is tracked in bytes, so that throughput and estimated remaining time
+stay meaningful when a few large videos sit among many small pictures. The
+progress line is redrawn at most once per interval, however many files are
+handled in between, so that terminal output does not slow operations down
+
+Name:        CARIAMA Progress Reporting Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import sys, time
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+def formatBytes(nbytes):
+    """
+    Formats an amount of bytes with binary units
+    @param nbytes: Amount of bytes
+    @return: Formatted amount (str), as in '1.5 GB'
+    """
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(nbytes)<1024 or unit=='TB':
+            return ("%d %s" if unit=='B' else "%.1f %s")%(nbytes, unit)
+        nbytes /= 1024
+
+def formatDuration(seconds):
+    """
+    Formats a duration as H:MM:SS
+    @param seconds: Duration in seconds
+    @return: Formatted duration (str)
+    """
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d"%(seconds//3600, seconds//60%60, seconds%60)
+
+
+class ProgressReporter:
+    """
+    Throttled progress line, based on bytes
+
+    Args:
+        totalBytes(int, optional): Amount of bytes to be handled, if known. Defaults to None (no percentage and ETA)
+        totalFiles(int, optional): Number of files to be handled, if known. Defaults to None
+        interval(float, optional): Minimum time between redraws, in seconds. Defaults to 0.2
+        stream(file, optional): Output stream. Defaults to sys.stderr. On streams other than terminals, a new line is written on each redraw
+        clock(callable, optional): Monotonic clock, in seconds. Defaults to time.monotonic
+        width(int, optional): Width of the progress bar, in characters. Defaults to 30
+
+    Attributes:
+        private doneBytes: Bytes handled so far
+        private doneFiles: Files handled so far
+        private failedFiles: Files which failed so far
+        private lastDraw: Clock time of last redraw
+    """
+    def __init__(self, totalBytes=None, totalFiles=None, interval=0.2, stream=None, clock=time.monotonic, width=30):
+        self.__totalBytes = totalBytes
+        self.__totalFiles = totalFiles
+        self.__interval = interval
+        self.__stream = stream if stream is not None else sys.stderr
+        self.__clock = clock
+        self.__width = width
+        self.__isTerminal = hasattr(self.__stream, 'isatty') and self.__stream.isatty()
+        self.__doneBytes = 0
+        self.__doneFiles = 0
+        self.__failedFiles = 0
+        self.__start = clock()
+        self.__lastDraw = None
+        self.__lineLength = 0
+        self.__draws = 0
+
+    def update(self, nbytes, failed=False):
+        """
+        Records a handled file, redrawing the progress line if interval has passed since last redraw
+        @param nbytes: Size of the file
+        @param failed: If True, file is counted as failed. Defaults to False
+        """
+        self.__doneBytes += nbytes
+        self.__doneFiles += 1
+        if failed:
+            self.__failedFiles += 1
+        now = self.__clock()
+        if self.__lastDraw is None or now-self.__lastDraw>=self.__interval:
+            self.__draw(now)
+
+    def getThroughput(self):
+        """ Retrieves average throughput so far, in bytes per second (float) """
+        elapsed = self.__clock()-self.__start
+        return self.__doneBytes/elapsed if elapsed>0 else 0.0
+
+    def getEta(self):
+        """ Retrieves estimated remaining time, in seconds, or None if it cannot be estimated (float) """
+        throughput = self.getThroughput()
+        if self.__totalBytes is None or throughput<=0:
+            return None
+        return max(0.0, (self.__totalBytes-self.__doneBytes)/throughput)
+
+    def getDrawCount(self):
+        """ Retrieves number of times progress line was drawn (int) """
+        return self.__draws
+
+    def formatLine(self):
+        """ Builds the progress line (str) """
+        parts = []
+        if self.__totalBytes:
+            fraction = min(1.0, self.__doneBytes/self.__totalBytes)
+            filled = int(fraction*self.__width)
+            parts.append("[%s%s] %5.1f%%"%('#'*filled, '-'*(self.__width-filled), 100*fraction))
+            parts.append("%s/%s"%(formatBytes(self.__doneBytes), formatBytes(self.__totalBytes)))
+        else:
+            parts.append(formatBytes(self.__doneBytes))
+        parts.append("%s/s"%formatBytes(self.getThroughput()))
+        eta = self.getEta()
+        if eta is not None:
+            parts.append("ETA %s"%formatDuration(eta))
+        files = "%d"%self.__doneFiles if self.__totalFiles is None else "%d/%d"%(self.__doneFiles, self.__totalFiles)
+        parts.append("%s files%s"%(files, "" if not self.__failedFiles else " (%d failed)"%self.__failedFiles))
+        return "  ".join(parts)
+
+    def __draw(self, now):
+        line = self.formatLine()
+        if self.__isTerminal:
+            self.__stream.write("\r"+line+" "*max(0, self.__lineLength-len(line)))
+            self.__lineLength = len(line)
+        else:
+            self.__stream.write(line+"\n")
+        self.__stream.flush()
+        self.__lastDraw = now
+        self.__draws += 1
+
+    def write(self, text):
+        """
+        Prints a line of text above the progress line
+        @param text: Text to be printed
+        """
+        if self.__isTerminal and self.__lineLength:
+            self.__stream.write("\r"+" "*self.__lineLength+"\r")
+            self.__lineLength = 0
+        self.__stream.write(text+"\n")
+        if self.__isTerminal and self.__lastDraw is not None:
+            self.__draw(self.__clock())
+        else:
+            self.__stream.flush()
+
+    def done(self):
+        """ Draws final progress line """
+        self.__draw(self.__clock())
+        if self.__isTerminal:
+            self.__stream.write("\n")
+            self.__stream.flush()
+            self.__lineLength = 0
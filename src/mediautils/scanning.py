@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+This module keeps snapshots of directory trees, so that changes made to the
+archive by other means than this package are found without a full walk
+
+A snapshot records the modification time of each directory, its subdirectory
+names and, for each file, its size, modification time and inode. Adding,
+removing or renaming an entry changes its parent directory mtime, so on a
+rescan only directories whose mtime changed are listed again and have their
+files stat'ed; other directories cost a single stat call
+
+Paths under the tree which are not part of the archive, as the quarantine
+and the import journal kept at the archive root, may be left out of scans
+
+Note:
+    Files rewritten in place do not change their directory mtime, and are only
+    detected as modified when their directory is listed again for another reason
+
+Name:        CARIAMA Archive Scanning Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, json, time, hashlib, collections
+from fdmgm import Directory
+from preferences import SCAN_STATE_ROOT, MEDIA_DB_QUARANTINE_ROOT, IMPORT_JOURNAL_NAME
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+# directories modified this close to a scan are listed again on next scan, since
+# further changes within the same mtime granularity would go unnoticed
+MTIME_GRANULARITY_NS = 2000000000
+
+""" Changes found by a scan. Each field is a sorted list of file paths """
+ScanDiff = collections.namedtuple('ScanDiff', ['added', 'removed', 'modified'])
+
+
+class ArchiveScanner:
+    """
+    Incremental scanner of a directory tree
+
+    Args:
+        rootPath(str): Path to the root of the scanned tree
+        storeRoot(str, optional): Directory where snapshots are persisted. If None, snapshot lives only in memory. Default defined on preferences module
+        exclude(iterable, optional): Paths of files and directories left out of scans (see archiveExcludes()). Paths outside
+            the tree are ignored. Defaults to None (nothing is left out)
+
+    Attributes:
+        private rootPath: Absolute path to tree root
+        private exclude: Set of excluded paths, relative to tree root
+        private dirs: Snapshot. Dict of relative dir path -> [mtime_ns, {file name: [size, mtime_ns, inode]}, [subdir names]]
+        private counters: Work done by last scan (dirs stat'ed, dirs listed, files stat'ed)
+    """
+    def __init__(self, rootPath, storeRoot=SCAN_STATE_ROOT, exclude=None):
+        self.__rootPath = os.path.abspath(rootPath)
+        self.__storeRoot = storeRoot
+        self.__exclude = set()
+        for path in exclude or ():
+            rel = os.path.relpath(os.path.abspath(path), self.__rootPath)
+            if rel!=os.curdir and rel!=os.pardir and not rel.startswith(os.pardir+os.sep):
+                self.__exclude.add(rel)
+        self.__excludeParents = {os.path.dirname(rel) for rel in self.__exclude}
+        self.__dirs = {}
+        self.__counters = {}
+        self.__load()
+
+    def getPath(self):
+        """ Retrieves scanned tree root path (str) """
+        return self.__rootPath
+
+    def getStorePath(self):
+        """ Retrieves path of the file where snapshot is persisted, or None if it is not persisted """
+        if self.__storeRoot is None:
+            return None
+        key = hashlib.sha1(os.path.normcase(self.__rootPath).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.__storeRoot, key+'.json')
+
+    def hasSnapshot(self):
+        """ Checks whether tree was scanned before (bool) """
+        return bool(self.__dirs)
+
+    def getCounters(self):
+        """ Retrieves amount of work done by last scan
+
+        Returns:
+            Dict with keys 'dirsStatted', 'dirsListed' and 'filesStatted'
+        """
+        return dict(self.__counters)
+
+    def __load(self):
+        """ Loads persisted snapshot, if any. Corrupt or foreign snapshots are ignored """
+        storePath = self.getStorePath()
+        if storePath is None:
+            return
+        try:
+            with open(storePath, 'r') as f:
+                data = json.load(f)
+            if data.get('root')==self.__rootPath:
+                self.__dirs = data['dirs']
+        except (OSError, ValueError, KeyError):
+            self.__dirs = {}
+
+    def save(self):
+        """ Persists current snapshot """
+        storePath = self.getStorePath()
+        if storePath is None:
+            return
+        os.makedirs(self.__storeRoot, exist_ok=True)
+        tmpPath = storePath+'.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'root':self.__rootPath, 'dirs':self.__dirs}, f)
+        os.replace(tmpPath, storePath)
+
+    def __listDir(self, dirPath):
+        """ Lists files (with their size, mtime and inode) and real subdirectories of a directory """
+        d = Directory(dirPath)
+        files = {}
+        for f in d.iterFiles(recursive=False):
+            st = f.getStat()
+            files[os.path.basename(f.getPath())] = [st.st_size, st.st_mtime_ns, st.st_ino]
+        subdirs = sorted(sd.getName() for sd in d.iterDirs(recursive=False) if not os.path.islink(sd.getPath()))
+        self.__counters['dirsListed'] += 1
+        self.__counters['filesStatted'] += len(files)
+        return files, subdirs
+
+    def scan(self, save=True):
+        """
+        Brings snapshot up to date with the tree, and reports what changed since previous scan.
+        On the first scan, every file is reported as added
+
+        Args:
+            save(bool, optional): If True, snapshot is persisted after scanning. Defaults to True
+
+        Returns:
+            ScanDiff namedtuple of added, removed and modified file paths
+
+        Raises:
+            NotADirectoryError: If root path is not a directory
+        """
+        if not os.path.isdir(self.__rootPath):
+            raise NotADirectoryError("Cannot scan non-existing directory: %s"%self.__rootPath)
+
+        self.__counters = {'dirsStatted':0, 'dirsListed':0, 'filesStatted':0}
+        threshold = time.time_ns()-MTIME_GRANULARITY_NS
+        added, removed, modified = [], [], []
+        newDirs = {}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            dirPath = os.path.join(self.__rootPath, rel)
+            try:
+                mtime = os.stat(dirPath).st_mtime_ns
+                self.__counters['dirsStatted'] += 1
+                old = self.__dirs.get(rel)
+                if old is not None and old[0] is not None and old[0]==mtime:
+                    files, subdirs = old[1], old[2]
+                    if rel in self.__excludeParents: # files excluded since snapshot was taken
+                        kept = self.__excludeFiles(rel, files)
+                        removed.extend(os.path.join(dirPath, name) for name in files if name not in kept)
+                        files = kept
+                else:
+                    files, subdirs = self.__listDir(dirPath)
+                    files = self.__excludeFiles(rel, files)
+                    oldFiles = {} if old is None else old[1]
+                    for name, meta in files.items():
+                        known = oldFiles.get(name)
+                        if known is None:
+                            added.append(os.path.join(dirPath, name))
+                        elif known!=meta:
+                            modified.append(os.path.join(dirPath, name))
+                    removed.extend(os.path.join(dirPath, name) for name in oldFiles if name not in files)
+            except (FileNotFoundError, NotADirectoryError): # directory vanished while scanning; reported as removed below
+                continue
+
+            newDirs[rel] = [None if mtime>=threshold else mtime, files, subdirs]
+            stack.extend(sub for sub in (os.path.join(rel, name) for name in reversed(subdirs)) if sub not in self.__exclude)
+
+        # files inside directories that no longer exist
+        for rel, (mtime, files, subdirs) in self.__dirs.items():
+            if rel not in newDirs:
+                removed.extend(os.path.join(self.__rootPath, rel, name) for name in files)
+
+        self.__dirs = newDirs
+        if save:
+            self.save()
+        return ScanDiff(sorted(added), sorted(removed), sorted(modified))
+
+    def __excludeFiles(self, rel, files):
+        """ Leaves excluded files out of a directory listing """
+        if rel not in self.__excludeParents:
+            return files
+        return {name: meta for name, meta in files.items() if os.path.join(rel, name) not in self.__exclude}
+
+    def iterFilePaths(self):
+        """ Iterates over the paths of all files on current snapshot """
+        for rel, (mtime, files, subdirs) in self.__dirs.items():
+            for name in files:
+                yield os.path.join(self.__rootPath, rel, name)
+
+
+def archiveExcludes(rootPath, quarantineRoot=MEDIA_DB_QUARANTINE_ROOT):
+    """
+    Retrieves the paths under an archive root which are not part of the archive: the quarantine, whose files are
+    on their way in, and the import journal
+    @param rootPath: Archive root path
+    @param quarantineRoot: Quarantine root path. Default defined on preferences module
+    @return: List of paths, to be given as exclude to ArchiveScanner
+    """
+    return [quarantineRoot, os.path.join(rootPath, IMPORT_JOURNAL_NAME)]
+
+def mergeDiffs(first, second):
+    """
+    Combines the changes found by two consecutive scans into the changes between first and last snapshots
+    @param first: ScanDiff of the earlier scan
+    @param second: ScanDiff of the later scan
+    @return: ScanDiff namedtuple
+    """
+    a1, r1, m1 = map(set, first)
+    a2, r2, m2 = map(set, second)
+    added = (a1-r2) | (a2-r1)
+    removed = (r1-a2) | (r2-a1)
+    modified = (m1 | m2 | (r1&a2)) - r2 - added
+    return ScanDiff(sorted(added), sorted(removed), sorted(modified))
+
+def scanArchive(rootPath, storeRoot=SCAN_STATE_ROOT):
+    """
+    Scans a directory tree against its last snapshot
+    @param rootPath: Path to the root of the tree
+    @param storeRoot: Directory where snapshots are persisted. Default defined on preferences module
+    @return: ScanDiff namedtuple of added, removed and modified file paths
+    """
+    return ArchiveScanner(rootPath, storeRoot).scan()
@@ -4,12 +4,23 @@ Created on Dec 20, 2015
 @author: PEDRO
 '''
 
-import unittest, os, shutil, filecmp
+import unittest, os, shutil, filecmp, json, time, tempfile, threading, importlib.util
 from fdmgm import File, Directory
 import fdmgm as mgm
 import indexing as indx
+import hashing
 import preferences as prefs
 
+def setUpModule():
+    # hash indexes are persisted to a scratch directory, not to the user state directory
+    global _hashIndexRoot
+    _hashIndexRoot = hashing.HASH_INDEX_ROOT
+    hashing.HASH_INDEX_ROOT = tempfile.mkdtemp()
+
+def tearDownModule():
+    shutil.rmtree(hashing.HASH_INDEX_ROOT, ignore_errors=True)
+    hashing.HASH_INDEX_ROOT = _hashIndexRoot
+
 
 class TestFileMethods(unittest.TestCase):
     validTypes = [t for t in prefs.INDEX_PREFIX.keys()]
@@ -126,6 +137,23 @@ class TestFileMethods(unittest.TestCase):
         self.assertIsInstance(self.testfile.getDatetime(), float)
         self.assertIsInstance(self.testfile.getDatetime(fromIndex=True), float)
         
+    def test_file_caches_stat_until_invalidated(self):
+        """ File metadata is fetched once and kept until the file is changed through its methods or cache is invalidated """
+        t0 = self.testfile.getDatetime()
+        os.utime(self.testfile.getPath(), (self.timestamps[0], self.timestamps[0]))
+        self.assertEqual(self.testfile.getDatetime(), t0)
+        self.testfile.invalidateCache()
+        self.assertEqual(self.testfile.getDatetime(), self.timestamps[0])
+        self.testfile.setDatetime(self.timestamps[1])
+        self.assertEqual(self.testfile.getDatetime(), self.timestamps[1])
+    
+    def test_file_parsed_index_cache_follows_renaming(self):
+        """ Cached index parsing results are discarded when file is renamed """
+        self.assertIsNone(self.testfile.getMediaType())
+        self.testfile.setName(self.validIndex)
+        self.assertIn(self.testfile.getMediaType(), self.validTypes)
+        self.assertEqual(self.testfile.getDatetime(fromIndex=True), self.timestamps[0])
+    
     def test_rename_file_does_not_overwrite(self):
         """ Method .setName does not accidentally overwrite files """
         with self.assertRaises(FileExistsError):
@@ -177,6 +205,88 @@ class TestFileMethods(unittest.TestCase):
         self.assertEqual(originalTsMtime, newFile.getDatetime())
         self.assertEqual(originalTsAtime, newFile.getDatetime(mode="atime"))
     
+    def test_copy_file_strict_detects_same_contents_with_another_name(self):
+        """ Method .copyTo in strict mode refuses to copy a file whose contents already exist on destination """
+        self.testfile.copyTo("fixtures/copy/newfile"+self.testfile.getExt())
+        with self.assertRaises(FileExistsError):
+            self.testfile.copyTo("fixtures/copy/anotherfile"+self.testfile.getExt())
+        # non-strict mode allows the same contents under another name
+        newFile = self.testfile.copyTo("fixtures/copy/anotherfile"+self.testfile.getExt(), strict=False)
+        self.assertTrue(newFile.exists())
+    
+    def test_copy_file_duplicate_index_follows_deletion(self):
+        """ After a copied file is deleted, the same contents may be copied again to that directory """
+        newFile = self.testfile.copyTo("fixtures/copy/newfile"+self.testfile.getExt())
+        newFile.delete()
+        self.assertTrue(self.testfile.copyTo("fixtures/copy/anotherfile"+self.testfile.getExt()).exists())
+    
+    def test_copy_file_duplicate_index_sees_external_changes(self):
+        """ Files placed on destination by other means are still detected as duplicates """
+        os.makedirs(os.path.abspath("fixtures/copy"))
+        self.testfile.copyTo("fixtures/copy/newfile"+self.testfile.getExt())
+        shutil.copyfile(self.tgtfile.getPath(), os.path.abspath("fixtures/copy/external.dat"))
+        with self.assertRaises(FileExistsError):
+            self.tgtfile.copyTo("fixtures/copy/another"+self.tgtfile.getExt())
+    
+    def test_copy_file_reports_backend_and_each_backend_copies_contents(self):
+        """ Method .copyTo reports the backend used, and any backend (or fallback chain) produces an identical copy """
+        import copying
+        self.assertIn(self.testfile.copyTo("fixtures/copy/default.dat").getCopyBackend(), copying.BACKENDS)
+        for i, backend in enumerate(copying.BACKENDS):
+            newFile = self.testfile.copyTo("fixtures/copy%d/newfile.dat"%i, backends=(backend,))
+            self.assertIn(newFile.getCopyBackend(), (backend, 'buffered'))
+            self.assertTrue(filecmp.cmp(self.testfile.getPath(), newFile.getPath(), shallow=False))
+            self.assertEqual(self.testfile.getDatetime(), newFile.getDatetime())
+    
+    def test_copy_file_falls_back_when_kernel_copies_nothing(self):
+        """ A kernel copy returning no data before the end (as on some FUSE filesystems) is finished by another backend """
+        import copying, errno
+        from unittest import mock
+        with mock.patch.object(os, 'copy_file_range', return_value=0, create=True):
+            newFile = self.testfile.copyTo("fixtures/copy/newfile.dat", backends=('copy_file_range',))
+        self.assertEqual('buffered', newFile.getCopyBackend())
+        self.assertTrue(filecmp.cmp(self.testfile.getPath(), newFile.getPath(), shallow=False))
+        with open(self.testfile.getPath(), 'rb') as fsrc, open(os.path.abspath("fixtures/copy/short.dat"), 'wb') as fdst:
+            with self.assertRaises(OSError) as cm:
+                copying.copyFileData(fsrc, fdst, self.testfile.getSize()+1, backends=('buffered',))
+        self.assertEqual(errno.EIO, cm.exception.errno)
+    
+    def test_copy_file_computes_and_records_checksum(self):
+        """ Method .copyTo hashes data while copying, and verified copies keep the checksum """
+        import hashing
+        self.assertIsNone(self.testfile.copyTo("fixtures/copy/plain.dat").getChecksum())
+        for algo in ('sha256', 'blake2b'):
+            newFile = self.testfile.copyTo("fixtures/copy_%s/newfile.dat"%algo, hashAlgo=algo, verify=True)
+            self.assertEqual((algo, hashing.hashFile(self.testfile.getPath(), algo)), newFile.getChecksum())
+            self.assertEqual(newFile.getChecksum()[1], hashing.hashFile(newFile.getPath(), algo, useMmap=True))
+            self.assertTrue(filecmp.cmp(self.testfile.getPath(), newFile.getPath(), shallow=False))
+    
+    def test_copy_file_verification_failure_removes_copy(self):
+        """ When a copy does not match the checksum computed while copying, it is removed and the name is released """
+        import hashing, errno
+        from unittest import mock
+        with mock.patch.object(hashing, 'hashFile', return_value='0'):
+            with self.assertRaises(OSError) as cm:
+                self.testfile.copyTo("fixtures/copy/newfile.dat", verify=True)
+        self.assertEqual(errno.EIO, cm.exception.errno)
+        self.assertFalse(os.path.exists("fixtures/copy/newfile.dat"))
+        self.assertTrue(self.testfile.copyTo("fixtures/copy/newfile.dat", verify=True).exists())
+    
+    def test_catalog_record_gathers_file_fields(self):
+        """ Catalog records carry index fields and the checksum computed while copying, or else the digest from hash index """
+        import catalog
+        newFile = self.testfile.copyTo("fixtures/copy/%s.dat"%self.validIndex, verify=True)
+        record = catalog.fileRecord(newFile)
+        self.assertEqual(os.path.abspath(newFile.getPath()), record['path'])
+        self.assertEqual(prefs.INDEX_PREFIX[self.validType], record['prefix'])
+        self.assertEqual(self.validType, record['mediatype'])
+        self.assertEqual(self.timestamps[0], record['timestamp'].timestamp())
+        self.assertEqual(newFile.getSize(), record['size'])
+        self.assertEqual(newFile.getChecksum()[1], record['hash'])
+        record = catalog.fileRecord(self.tgtfile)
+        self.assertEqual('', record['prefix'])
+        self.assertEqual(hashing.hashFile(self.tgtfile.getPath()), record['hash'])
+    
     def test_move_file_does_not_overwrite(self):
         """ Method .moveTo does not accidentally overwrite files """
         with self.assertRaises(FileExistsError):
@@ -471,7 +581,143 @@ class TestDirectoryMethods(unittest.TestCase):
         for item in [f.getMediaType() for f in self.testdir.getFiles()]:
             self.assertIsNone(item)
       
+    
+    def test_dirs_iter_files_is_lazy_and_equivalent_to_get_files(self):
+        """ Method .iterFiles returns a generator yielding the same files as .getFiles """
+        infraFilePath = os.path.abspath("fixtures/testdir1/testsubdir1/infratestfile.dat")
+        with open(infraFilePath, 'wb') as f:
+            f.write(os.urandom(1024))
+        fileIter = self.testdir.iterFiles()
+        self.assertFalse(isinstance(fileIter, list))
+        self.assertEqual(sorted(f.getPath() for f in fileIter), 
+                         sorted(f.getPath() for f in self.testdir.getFiles()))
+        self.assertEqual(sorted(d.getPath() for d in self.testdir.iterDirs()), 
+                         sorted(d.getPath() for d in self.testdir.getDirs()))
+    
+    def test_dirs_iter_files_filters_by_extension_and_media_type(self):
+        """ Method .iterFiles may filter files by extension and by media type while walking """
+        validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        indexedPath = os.path.abspath("fixtures/testdir1/testsubdir2/"+indx.genIndex(prefs.INDEX_PREFIX[validType], 12423523.0, 1)+".JPG")
+        with open(indexedPath, 'wb') as f:
+            f.write(os.urandom(1024))
+        self.assertEqual([f.getPath() for f in self.testdir.iterFiles(exts=[".jpg"])], [indexedPath])
+        self.assertEqual([f.getPath() for f in self.testdir.iterFiles(mediaTypes=[validType])], [indexedPath])
+        self.assertEqual([f.getMediaType() for f in self.testdir.iterFiles(mediaTypes=[validType])], [validType])
+        self.assertEqual(len(self.testdir.getFiles(exts=[".dat"])), 1)
+    
+    def test_dirs_check_integrity_fixes_all_issues_in_one_pass(self):
+        """ Method .checkIntegrity in fix mode fixes wrong datetimes and incomplete indexes of many files at once """
+        os.remove(self.testfile.getPath())
+        validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        prefix = prefs.INDEX_PREFIX[validType]
+        for i in range(50):
+            fpath = os.path.abspath("fixtures/testdir1/testsubdir1/%s%s.dat"%(prefix, 20100802134400+i))
+            with open(fpath, 'wb') as f:
+                f.write(os.urandom(100+i))
+        issues = list(self.testdir.iterIntegrityIssues())
+        self.assertEqual(len(issues), 50)
+        self.assertTrue(all(issue.args[1]=="Invalid index" for issue in issues))
+        with self.assertRaises(mgm.DirectoryIntegrityError):
+            self.testdir.checkIntegrity()
+        self.assertTrue(self.testdir.checkIntegrity(fix=True))
+        self.assertTrue(self.testdir.checkIntegrity())
+    
+    def test_dirs_check_integrity_of_listed_files(self):
+        """ Files already listed are checked and fixed without scanning directory again; fixed files are renamed in place """
+        os.remove(self.testfile.getPath())
+        prefix = prefs.INDEX_PREFIX[next(iter(prefs.INDEX_PREFIX.keys()))]
+        fpath = os.path.abspath("fixtures/testdir1/testsubdir1/%s%s.dat"%(prefix, 20100802134400))
+        with open(fpath, 'wb') as f:
+            f.write(os.urandom(100))
+        files = self.testdir.getFiles()
+        os.makedirs(os.path.abspath("fixtures/testdir1/unlisted"))
+        shutil.copy(fpath, os.path.abspath("fixtures/testdir1/unlisted/%s%s.dat"%(prefix, 20100802134401)))
+        self.assertEqual([fpath], [issue.args[0] for issue in self.testdir.iterIntegrityIssues(files=files)])
+        self.assertTrue(self.testdir.checkIntegrity(fix=True, files=files))
+        self.assertEqual([], list(self.testdir.iterIntegrityIssues(files=files)))
+        self.assertTrue(all(f.exists() for f in files))
+        self.assertEqual(1, len(list(self.testdir.iterIntegrityIssues()))) # unlisted file was left alone
+    
+    def test_dirs_check_integrity_reports_files_it_cannot_fix(self):
+        """ Method .checkIntegrity in fix mode reports files whose datetime cannot be parsed from name """
+        with self.assertRaises(mgm.DirectoryIntegrityError) as cm:
+            self.testdir.checkIntegrity(fix=True)
+        self.assertEqual(cm.exception.issues, [("ValueError", (os.path.abspath(self.testfile.getPath()), "Index not set"))])
+    
+    def test_dirs_reindex_disambiguates_clashing_indexes(self):
+        """ Method .reindex indexes many files at once; files sharing second and size get the next free suffixes """
+        os.remove(self.testfile.getPath())
+        validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        prefix = prefs.INDEX_PREFIX[validType]
+        testdir = Directory(os.path.abspath("fixtures/testdir1/testsubdir1"), mediaType=validType)
+        for i in range(5):
+            fpath = os.path.abspath("fixtures/testdir1/testsubdir1/frame%d.dat"%i)
+            with open(fpath, 'wb') as f:
+                f.write(os.urandom(1024))
+            os.utime(fpath, (252353423.0, 252353423.0))
+        base = indx.genIndex(prefix, 252353423.0, 1024)
+        renamed, errors = testdir.reindex()
+        self.assertEqual([], errors)
+        self.assertEqual(5, len(renamed))
+        self.assertEqual(sorted(base[:-prefs.INDEX_SUFFIX_LENGTH]+"%05d.dat"%(1024+i) for i in range(5)),
+                         sorted(os.listdir(testdir.getPath())))
         
+        # already indexed files are reported, unless indexing is forced
+        renamed, errors = testdir.reindex()
+        self.assertEqual(([], 5), (renamed, len(errors)))
+        self.assertTrue(all(isinstance(e, indx.FileIndexingError) for e in errors))
+    
+    def test_dirs_reindex_swaps_names(self):
+        """ Method .reindex renames files through temporary names, so that files may take each other's names """
+        os.remove(self.testfile.getPath())
+        validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        prefix = prefs.INDEX_PREFIX[validType]
+        testdir = Directory(os.path.abspath("fixtures/testdir1/testsubdir1"), mediaType=validType)
+        names = [indx.genIndex(prefix, 252353423.0, 100), indx.genIndex(prefix, 252353423.0, 101)]
+        for name, size in zip(names, (101, 100)): # each file is named after the other one
+            fpath = os.path.join(testdir.getPath(), name+".dat")
+            with open(fpath, 'wb') as f:
+                f.write(b'x'*size)
+            os.utime(fpath, (252353423.0, 252353423.0))
+        renamed, errors = testdir.reindex(force=True)
+        self.assertEqual([], errors)
+        self.assertEqual(2, len(renamed))
+        for name in names:
+            self.assertEqual(int(name[-prefs.INDEX_SUFFIX_LENGTH:]), os.path.getsize(os.path.join(testdir.getPath(), name+".dat")))
+        self.assertEqual(2, len(os.listdir(testdir.getPath())))
+        with open(self.testfile.getPath(), 'wb') as f:
+            f.write(b'x')
+        with self.assertRaises(ValueError): # file from another directory
+            testdir.reindex([File(self.testfile.getPath())])
+    
+    def test_dirs_reindex_cycles_and_interrupted_runs(self):
+        """ Files of a renaming cycle end up with their names; files left under temporary names by a dead process get their names back """
+        os.remove(self.testfile.getPath())
+        validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        prefix = prefs.INDEX_PREFIX[validType]
+        testdir = Directory(os.path.abspath("fixtures/testdir1/testsubdir1"), mediaType=validType)
+        names = [indx.genIndex(prefix, 252353423.0, size) for size in (100, 101, 102)]
+        for name, size in zip(names, (101, 102, 100)): # each file is named after the next one
+            fpath = os.path.join(testdir.getPath(), name+".dat")
+            with open(fpath, 'wb') as f:
+                f.write(b'x'*size)
+            os.utime(fpath, (252353423.0, 252353423.0))
+        renamed, errors = testdir.reindex(force=True)
+        self.assertEqual([], errors)
+        self.assertEqual(3, len(renamed))
+        self.assertEqual(sorted(name+".dat" for name in names), sorted(os.listdir(testdir.getPath())))
+        for name in names:
+            self.assertEqual(int(name[-prefs.INDEX_SUFFIX_LENGTH:]), os.path.getsize(os.path.join(testdir.getPath(), name+".dat")))
+        
+        deadPid = 2**22+12345
+        for name in ("lost.dat", names[0]+".dat"):
+            with open(os.path.join(testdir.getPath(), "%s%d-%s"%(mgm.REINDEX_TMP_PREFIX, deadPid, name)), 'wb') as f:
+                f.write(b'y')
+        renamed, errors = testdir.reindex([])
+        self.assertTrue(os.path.exists(os.path.join(testdir.getPath(), "lost.dat")))
+        self.assertEqual([os.path.join(testdir.getPath(), "%s%d-%s.dat"%(mgm.REINDEX_TMP_PREFIX, deadPid, names[0]))], [e.filename for e in errors])
+
+
 class TestIndexing(unittest.TestCase):
     
     def setUp(self):
@@ -569,6 +815,55 @@ class TestIndexing(unittest.TestCase):
             with self.assertRaises(indx.ParserError):
                 indx.parseIndex(val)
             
+    def test_index_parser_fast_datetime_decoding_matches_strptime(self):
+        """ IndexParser decodes fixed-width datestrings to the same timestamps as time.strptime """
+        import time
+        parser = indx.IndexParser()
+        for datestring in ["20100802134454", "20000229235959", "19700101000000", "20151231120000", "20150615000060"]:
+            self.assertEqual(parser.parseDatetime(datestring), time.mktime(time.strptime(datestring, prefs.INDEX_DATETIME_FORMAT)))
+        for datestring in ["20100230134454", "20101302134454", "20100802244454", "2010080213445a"]:
+            with self.assertRaises(ValueError):
+                parser.parseDatetime(datestring)
+        # formats with other directives or literals are handled by strptime
+        self.assertEqual(indx.IndexParser(parseDtFormat="%d/%m/%Y").parseDatetime("01/12/2014"), 
+                         indx.IndexParser(parseDtFormat="%Y%m%d").parseDatetime("20141201"))
+    
+    def test_index_parser_error_codes(self):
+        """ parseIndex() keeps its error codes for each kind of invalid index """
+        codes = {'wrongPref':1, 'noPref':0, 'invalidDate':2, 'noSuff':0}
+        for key, code in codes.items():
+            with self.assertRaises(indx.ParserError) as cm:
+                indx.parseIndex(self.invalidIndex[key])
+            self.assertEqual(cm.exception.code, code)
+        self.assertEqual(indx.parseIndex(self.validIndex)['mediatype'], 'footage')
+        self.assertIs(indx.getParser(), indx.getParser())
+    
+    def test_batch_index_generation_matches_gen_index(self):
+        """ genIndexes() generates the same indexes as genIndex(), flagging invalid items instead of raising """
+        timestamps = [12423523.0, 252353423.0, 48534934.0, 1443672000.5]
+        suffixes = [0, 123, 123456789, 99999]
+        indexes, valid = indx.genIndexes("MVDC", timestamps, suffixes)
+        self.assertEqual(indexes, [indx.genIndex("MVDC", t, n) for t, n in zip(timestamps, suffixes)])
+        self.assertTrue(all(valid))
+        indexes, valid = indx.genIndexes(["MVTC", "MVDC"], [timestamps[0], timestamps[1]], [1, -1])
+        self.assertEqual(list(indexes), [None, None])
+        self.assertFalse(any(valid))
+    
+    def test_batch_index_parsing_matches_parse_index(self):
+        """ parseIndexes() returns columns with the same results and error codes as parseIndex() """
+        names = [self.validIndex] + list(self.invalidIndex.values())
+        cols = indx.parseIndexes(names)
+        for i, name in enumerate(names):
+            try:
+                res = indx.parseIndex(name)
+                self.assertEqual(cols['code'][i], -1)
+                self.assertTrue(cols['valid'][i])
+                self.assertEqual(cols['datets'][i], res['datets'])
+                self.assertEqual(cols['mediatype'][i], res['mediatype'])
+            except indx.ParserError as e:
+                self.assertEqual(cols['code'][i], e.code)
+                self.assertFalse(cols['valid'][i])
+    
     def test_index_generator_raises_exception_if_invalid(self):
         """ Function genIndex() raises value exception if generated index is invalid """
         # test for invalid prefix
@@ -639,12 +934,985 @@ class TestImporting(unittest.TestCase):
         self.assertTrue(self.testfile1)
     
         
+    def test_import_files_in_parallel_keeps_order_and_detects_collisions(self):
+        """ importFiles() with many jobs yields results in input order, and concurrent duplicates are imported only once """
+        os.makedirs(os.path.abspath("fixtures/src/a"))
+        os.makedirs(os.path.abspath("fixtures/src/b"))
+        content = os.urandom(4096)
+        files = []
+        for i in range(20):
+            for sub in ("a", "b"): # each file has a copy with the same name and contents on the other dir
+                fpath = os.path.abspath("fixtures/src/%s/file%02d.dat"%(sub, i))
+                with open(fpath, 'wb') as f:
+                    f.write(content + bytes([i]))
+                files.append(File(fpath))
+        results = list(mgm.importFiles(files, self.testQuarantine, jobs=8))
+        self.assertEqual([f for f, res in results], files)
+        imported = [res for f, res in results if not isinstance(res, mgm.FileImportingError)]
+        self.assertEqual(len(imported), 20)
+        self.assertEqual(len(os.listdir(self.testQuarantine)), 20)
+    
+    def test_import_file_by_link_or_rename_on_same_device(self):
+        """ Importing methods 'link' and 'rename' do not copy data when source and destination share a device """
+        self.testfile1.setMediaType(self.validMediaType)
+        linked = mgm.importFile(self.testfile1, self.testQuarantine, method='link')
+        self.assertEqual(linked.getStat().st_ino, self.testfile1.getStat().st_ino)
+        self.assertIsNone(linked.getCopyBackend())
+        linked.delete()
+        self.testfile2.setMediaType(self.validMediaType)
+        origPath = self.testfile2.getPath()
+        renamed = mgm.importFile(self.testfile2, self.testQuarantine, method='rename', indexing=True)
+        self.assertFalse(os.path.isfile(origPath))
+        self.assertTrue(indx.parseIndex(renamed.getName()))
+        with self.assertRaises(ValueError):
+            mgm.importFile(self.testfile1, self.testQuarantine, method='teleport')
+    
     def test_import_files_rollsback_on_keyboard_interrypt_or_system_failure(self):
         """ 
         TODO
         """
         pass
 
+class TestScanning(unittest.TestCase):
+    def setUp(self):
+        """ Creates a small tree whose directories look untouched for a while """
+        import scanning
+        self.root = os.path.abspath("fixtures/archive")
+        for sub in ("a", "a/aa", "b"):
+            os.makedirs(os.path.join(self.root, sub))
+            for i in range(3):
+                with open(os.path.join(self.root, sub, "file%d.dat"%i), 'wb') as f:
+                    f.write(os.urandom(64))
+        self.ageTree()
+        self.scanner = scanning.ArchiveScanner(self.root, storeRoot=None)
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def ageTree(self):
+        past = os.stat(self.root).st_mtime-60
+        for dirPath, dirs, files in os.walk(self.root):
+            os.utime(dirPath, (past, past))
+    
+    def test_first_scan_reports_every_file_added(self):
+        """ A tree never scanned before has all of its files added """
+        diff = self.scanner.scan()
+        self.assertEqual(9, len(diff.added))
+        self.assertEqual(([], []), (diff.removed, diff.modified))
+    
+    def test_rescan_of_unchanged_tree_lists_no_directory(self):
+        """ Directories whose mtime did not change are only stat'ed """
+        self.scanner.scan()
+        self.assertEqual(([], [], []), tuple(self.scanner.scan()))
+        self.assertEqual(0, self.scanner.getCounters()['dirsListed'])
+        self.assertEqual(4, self.scanner.getCounters()['dirsStatted'])
+    
+    def test_rescan_reports_changes_of_changed_directories(self):
+        """ Added, removed and modified files are reported, and only changed directories are listed """
+        self.scanner.scan()
+        aa = os.path.join(self.root, "a", "aa")
+        with open(os.path.join(aa, "new.dat"), 'wb') as f:
+            f.write(b'new')
+        os.remove(os.path.join(aa, "file0.dat"))
+        with open(os.path.join(aa, "file1.dat"), 'ab') as f:
+            f.write(b'more')
+        shutil.rmtree(os.path.join(self.root, "b"))
+        
+        diff = self.scanner.scan()
+        self.assertEqual([os.path.join(aa, "new.dat")], diff.added)
+        self.assertEqual(sorted([os.path.join(aa, "file0.dat")]+[os.path.join(self.root, "b", "file%d.dat"%i) for i in range(3)]), diff.removed)
+        self.assertEqual([os.path.join(aa, "file1.dat")], diff.modified)
+        self.assertEqual(2, self.scanner.getCounters()['dirsListed']) # root and a/aa
+    
+    def test_snapshot_is_persisted(self):
+        """ A scanner loading a persisted snapshot only reports later changes """
+        import scanning
+        scanner = scanning.ArchiveScanner(self.root, storeRoot=os.path.abspath("fixtures/state"))
+        scanner.scan()
+        self.ageTree()
+        scanner.scan()
+        os.remove(os.path.join(self.root, "a", "file0.dat"))
+        diff = scanning.ArchiveScanner(self.root, storeRoot=os.path.abspath("fixtures/state")).scan()
+        self.assertEqual(([], [os.path.join(self.root, "a", "file0.dat")], []), tuple(diff))
+    
+    def test_merged_diffs_describe_renames(self):
+        """ Files renamed between two scans show up as removed and added """
+        import scanning
+        first = scanning.ScanDiff(['x', 'y'], ['z'], [])
+        second = scanning.ScanDiff(['w', 'z'], ['x'], [])
+        self.assertEqual(scanning.ScanDiff(['w', 'y'], [], ['z']), scanning.mergeDiffs(first, second))
+
+class TestWatching(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(os.path.abspath("fixtures/quarantine"))
+        os.makedirs(os.path.abspath("fixtures/db"))
+        self.validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        self.store = os.path.abspath("fixtures/state")
+        self.now = 0
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def clock(self):
+        return self.now
+    
+    def test_settle_tracker_waits_for_quiet_and_stable_files(self):
+        """ Files are only settled after a quiet period with no change of size or mtime """
+        import watching
+        path = os.path.abspath("fixtures/quarantine/file.dat")
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        tracker = watching.SettleTracker(settleTime=5, clock=self.clock)
+        tracker.touch(path)
+        self.now = 3
+        self.assertEqual([], tracker.popSettled())
+        self.now = 6 # quiet, but size was never checked
+        self.assertEqual([], tracker.popSettled())
+        with open(path, 'ab') as f: # written without an event
+            f.write(b'x')
+        self.now = 12
+        self.assertEqual([], tracker.popSettled())
+        self.now = 18
+        self.assertEqual([path], tracker.popSettled())
+        self.assertEqual(0, len(tracker))
+    
+    def test_rate_limiter_spreads_work(self):
+        """ Work beyond the rate is paid for by waiting """
+        import watching
+        waits = []
+        def sleep(secs):
+            waits.append(secs)
+            self.now += secs
+        limiter = watching.RateLimiter(100, clock=self.clock, sleep=sleep)
+        limiter.acquire(100) # burst
+        limiter.acquire(300)
+        self.assertEqual([], waits)
+        limiter.acquire(10)
+        self.assertEqual([3.0], waits)
+        # a daily budget of 864000 bytes is 10 bytes per second
+        limiter = watching.RateLimiter.fromDailyBudget(864000, clock=self.clock, sleep=sleep)
+        limiter.acquire(30)
+        limiter.acquire(0)
+        self.assertAlmostEqual(2.0, waits[-1])
+    
+    def test_quarantine_watcher_indexes_and_imports_settled_files(self):
+        """ Files arriving at quarantine are indexed and moved into the database, if moving is requested """
+        import watching
+        quarantine, db = os.path.abspath("fixtures/quarantine"), os.path.abspath("fixtures/db")
+        existing = os.path.join(quarantine, "existing.dat")
+        with open(existing, 'wb') as f:
+            f.write(os.urandom(256))
+        for polling in (False, True):
+            watcher = watching.getWatcher(quarantine, polling=polling, interval=0)
+            qw = watching.QuarantineWatcher(quarantine, db, mediaType=self.validType, settleTime=0, watcher=watcher, storeRoot=self.store, copy=False)
+            arriving = os.path.join(quarantine, "arriving%d.dat"%polling)
+            with open(arriving, 'wb') as f:
+                f.write(os.urandom(512+polling)) # size is part of the index
+            results = list(qw.run(timeout=0.05, maxIdle=0.5))
+            self.assertEqual(set([existing, arriving]) if not polling else set([arriving]), set(path for path, res in results))
+            for path, res in results:
+                self.assertIsInstance(res, File)
+                self.assertEqual(db, res.getDir())
+                self.assertFalse(os.path.exists(path))
+            self.assertEqual([], os.listdir(quarantine))
+    
+    def test_quarantine_watcher_copies_by_default(self):
+        """ Settled files are copied, and left on quarantine, unless moving is requested """
+        import watching
+        quarantine, db = os.path.abspath("fixtures/quarantine"), os.path.abspath("fixtures/db")
+        watcher = watching.getWatcher(quarantine, polling=True, interval=0)
+        qw = watching.QuarantineWatcher(quarantine, db, mediaType=self.validType, settleTime=0, watcher=watcher, storeRoot=self.store)
+        with open(os.path.join(quarantine, "arriving.dat"), 'wb') as f:
+            f.write(os.urandom(256))
+        results = list(qw.run(timeout=0.05, maxIdle=0.5))
+        self.assertEqual(1, len(results))
+        newf = results[0][1]
+        self.assertIsInstance(newf, File)
+        self.assertEqual([os.path.basename(newf.getPath())], os.listdir(quarantine))
+        self.assertEqual([os.path.basename(newf.getPath())], os.listdir(db))
+    
+    def test_restarted_quarantine_watcher_skips_copied_files(self):
+        """ Files copied before a restart are neither imported again nor charged to the rate limiter """
+        import watching
+        quarantine, db = os.path.abspath("fixtures/quarantine"), os.path.abspath("fixtures/db")
+        for i in range(2):
+            with open(os.path.join(quarantine, "arriving%d.dat"%i), 'wb') as f:
+                f.write(os.urandom(256+i))
+        charged = []
+        class Limiter:
+            def acquire(self, amount):
+                charged.append(amount)
+                return 0
+        for polling in (True, False):
+            watcher = watching.getWatcher(quarantine, polling=polling, interval=0)
+            qw = watching.QuarantineWatcher(quarantine, db, mediaType=self.validType, settleTime=0, rateLimiter=Limiter(),
+                                            watcher=watcher, storeRoot=self.store)
+            results = list(qw.run(timeout=0.05, maxIdle=0.5))
+            self.assertEqual(2 if polling else 0, len(results)) # restarted watcher finds nothing new
+            self.assertTrue(all(isinstance(res, File) for path, res in results))
+        self.assertEqual([256, 257], sorted(amount for amount in charged if amount))
+        self.assertEqual(2, len(os.listdir(db)))
+        # a file removed from quarantine is forgotten
+        removed = os.path.join(quarantine, sorted(os.listdir(quarantine))[0])
+        os.remove(removed)
+        qw = watching.QuarantineWatcher(quarantine, db, mediaType=self.validType, settleTime=0, rateLimiter=Limiter(),
+                                        watcher=watching.getWatcher(quarantine, polling=True, interval=0), storeRoot=self.store)
+        self.assertEqual([], list(qw.run(timeout=0.05, maxIdle=0.5)))
+        with open(qw.getStorePath(), 'r') as f:
+            self.assertNotIn(removed, json.load(f)['handled'])
+
+class TestJournaling(unittest.TestCase):
+    def setUp(self):
+        import journaling
+        self.journaling = journaling
+        self.dst = os.path.abspath("fixtures/db")
+        os.makedirs(os.path.abspath("fixtures/src"))
+        self.files = []
+        for i in range(3):
+            fpath = os.path.abspath("fixtures/src/file%d.dat"%i)
+            with open(fpath, 'wb') as f:
+                f.write(os.urandom(1024))
+            self.files.append(File(fpath))
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_resumed_import_skips_completed_files(self):
+        """ Files recorded as imported are neither imported again nor stat'ed """
+        journal = self.journaling.ImportJournal(self.dst)
+        journal.plan(f.getPath() for f in self.files)
+        imported = mgm.importFile(self.files[0], self.dst, journal=journal)
+        journal.close()
+        
+        journal = self.journaling.ImportJournal(self.dst)
+        self.assertEqual([], journal.recover())
+        self.assertEqual(self.files[1:], journal.pending(self.files))
+        self.assertEqual(imported.getPath(), mgm.importFile(self.files[0], self.dst, journal=journal).getPath())
+        for res in mgm.importFiles(journal.pending(self.files), self.dst, journal=journal):
+            self.assertIsInstance(res[1], File)
+        self.assertTrue(journal.isComplete())
+        journal.close(remove=True)
+        self.assertFalse(os.path.exists(journal.getPath()))
+    
+    def test_recovery_removes_half_written_files(self):
+        """ Destinations started but not finished are removed if half-written, and kept if complete """
+        journal = self.journaling.ImportJournal(self.dst)
+        journal.plan(f.getPath() for f in self.files)
+        half, whole = os.path.join(self.dst, "file0.dat"), os.path.join(self.dst, "file1.dat")
+        journal.start(self.files[0].getPath(), half, self.files[0].getStat().st_mtime_ns)
+        with open(half, 'wb') as f:
+            f.write(b'partial')
+        journal.start(self.files[1].getPath(), whole, self.files[1].getStat().st_mtime_ns)
+        self.files[1].copyTo(whole)
+        journal.close()
+        with open(journal.getPath(), 'a') as f: # record torn by a crash
+            f.write('{"op": "DONE", "src": ')
+        
+        journal = self.journaling.ImportJournal(self.dst)
+        self.assertEqual([half], journal.recover())
+        self.assertFalse(os.path.exists(half))
+        self.assertTrue(journal.isDone(self.files[1].getPath()))
+        self.assertEqual([self.files[0], self.files[2]], journal.pending(self.files))
+        for f, res in mgm.importFiles(journal.pending(self.files), self.dst, journal=journal):
+            self.assertIsInstance(res, File)
+        self.assertTrue(journal.isComplete())
+        journal.close()
+    
+    def test_failed_conflicts_are_not_cleaned_up(self):
+        """ A destination that already existed is never removed on recovery """
+        existing = self.files[0].copyTo(os.path.join(self.dst, "file0.dat"))
+        journal = self.journaling.ImportJournal(self.dst)
+        res = list(mgm.importFiles([self.files[0]], self.dst, journal=journal))
+        self.assertIsInstance(res[0][1], mgm.FileImportingError)
+        journal.close()
+        journal = self.journaling.ImportJournal(self.dst)
+        self.assertEqual([], journal.recover())
+        self.assertTrue(journal.isComplete()) # conflicts are final failures
+        journal.close()
+        self.assertTrue(existing.exists())
+    
+    def test_resumed_import_of_missing_destination(self):
+        """ A file recorded as imported whose destination is gone is imported again; interrupted files keep journal incomplete """
+        journal = self.journaling.ImportJournal(self.dst)
+        imported = mgm.importFile(self.files[0], self.dst, journal=journal)
+        os.remove(imported.getPath())
+        self.assertTrue(filecmp.cmp(self.files[0].getPath(), mgm.importFile(self.files[0], self.dst, journal=journal).getPath(), shallow=False))
+        journal.fail(self.files[1].getPath(), "interrupted")
+        self.assertFalse(journal.isComplete())
+        journal.close()
+
+class TestPlanning(unittest.TestCase):
+    def setUp(self):
+        import planning
+        self.planning = planning
+        self.validType = next(iter(prefs.INDEX_PREFIX.keys()))
+        self.dst = os.path.abspath("fixtures/db")
+        os.makedirs(os.path.abspath("fixtures/src/sub"))
+        os.makedirs(self.dst)
+        data = os.urandom(1024)
+        self.files = []
+        for i, (name, contents) in enumerate([("a.dat", data), ("b.dat", data), ("sub/a.dat", os.urandom(512)), ("c.dat", os.urandom(256))]):
+            fpath = os.path.abspath(os.path.join("fixtures/src", name))
+            with open(fpath, 'wb') as f:
+                f.write(contents)
+            os.utime(fpath, (self.validTimestamp(i), self.validTimestamp(i)))
+            self.files.append(File(fpath, mediaType=self.validType))
+        self.existing = self.files[3].copyTo(os.path.join(self.dst, "existing.dat"))
+    
+    def validTimestamp(self, i):
+        return 252353423.0+86400*40*i
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_plan_detects_collisions_in_memory(self):
+        """ Name conflicts and duplicates, inside the batch and against destination, are found while planning """
+        plan = self.planning.ImportPlanner(self.dst).plan(self.files)
+        statuses = [e['status'] for e in plan.entries]
+        self.assertEqual([self.planning.OK, self.planning.DUPLICATE, self.planning.NAME_CONFLICT, self.planning.DUPLICATE], statuses)
+        self.assertEqual(os.path.join(self.dst, "a.dat"), plan.entries[0]['dst'])
+        self.assertEqual([], plan.dirs)
+        # non strict planning lets the same contents in, under another name
+        plan = self.planning.ImportPlanner(self.dst, strict=False).plan(self.files)
+        self.assertEqual(3, plan.getCounts()[self.planning.OK])
+    
+    def test_plan_hashes_same_size_sources_at_once(self):
+        """ Sources sharing their size with another file are hashed in a single batch, with the planner's algorithm """
+        from unittest import mock
+        algo = hashing.getHashIndex(self.dst).getAlgorithm()
+        with mock.patch.object(hashing, 'hashFiles', wraps=hashing.hashFiles) as hashFiles, \
+             mock.patch.object(hashing, 'hashFile', wraps=hashing.hashFile) as hashFile:
+            plan = self.planning.ImportPlanner(self.dst, algo=algo).plan(self.files)
+        self.assertEqual(1, hashFiles.call_count)
+        paths, calledAlgo = hashFiles.call_args[0]
+        self.assertEqual(algo, calledAlgo)
+        # the name conflict is never compared
+        self.assertEqual(sorted(f.getPath() for f in (self.files[0], self.files[1], self.files[3])), sorted(paths))
+        hashed = [c[0][0] for c in hashFile.call_args_list if c[0][0] in paths] # small batches are hashed in process
+        self.assertEqual(len(set(hashed)), len(hashed)) # sources are not hashed again while planning
+        self.assertEqual(2, plan.getCounts()[self.planning.DUPLICATE])
+    
+    def test_plan_computes_organized_and_indexed_destinations(self):
+        """ Destinations follow organizational method and index, as importFile would """
+        plan = self.planning.ImportPlanner(self.dst, organizeBy=prefs.MEDIA_DB_DIR_STRUCTURE, indexing=True).plan(self.files[2:3])
+        entry = plan.entries[0]
+        f = self.files[2]
+        expectedDir = prefs.IMPORTING_ORGANIZE_BY[prefs.MEDIA_DB_DIR_STRUCTURE](self.dst, f)
+        self.assertEqual(os.path.join(expectedDir, indx.genIndex(prefs.INDEX_PREFIX[self.validType], f.getDatetime(), f.getSize())+".dat"), entry['dst'])
+        self.assertEqual([expectedDir], plan.dirs)
+    
+    def test_plan_is_saved_and_executed(self):
+        """ A saved plan is executed in bulk; files changed since planning are left alone """
+        planPath = os.path.abspath("fixtures/plan.json")
+        self.planning.ImportPlanner(self.dst, organizeBy=prefs.MEDIA_DB_DIR_STRUCTURE, indexing=True).plan(self.files).save(planPath)
+        with open(self.files[2].getPath(), 'ab') as f:
+            f.write(b'changed')
+        plan = self.planning.ImportPlan.load(planPath)
+        results = list(self.planning.executePlan(plan, jobs=2))
+        self.assertEqual(4, len(results)) # all files are ok: indexes and destination dirs differ
+        imported = [res for entry, res in results if isinstance(res, File)]
+        self.assertEqual(3, len(imported))
+        for entry, res in results:
+            if isinstance(res, File):
+                self.assertEqual(entry['dst'], res.getPath())
+                self.assertTrue(filecmp.cmp(entry['src'], res.getPath(), shallow=False))
+            else:
+                self.assertEqual(self.files[2].getPath(), entry['src'])
+    
+    def test_every_plan_failure_is_journaled(self):
+        """ Failures other than importing errors are journaled too, before they propagate """
+        import journaling
+        class FailingCatalog:
+            def add(self, f):
+                raise RuntimeError("catalog is down")
+        plan = self.planning.ImportPlanner(self.dst).plan(self.files[:1])
+        journal = journaling.ImportJournal(self.dst)
+        try:
+            with self.assertRaises(RuntimeError):
+                list(self.planning.executePlan(plan, catalog=FailingCatalog(), journal=journal))
+            self.assertEqual(1, journal.getCounts()[journaling.FAIL])
+        finally:
+            journal.close(remove=True)
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        import benchmark
+        self.benchmark = benchmark
+        self.root = os.path.abspath("fixtures/bench")
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_generated_archive_is_valid_and_benchmarked(self):
+        """ Generated archives follow media database layout and pass the integrity check; results are JSON serializable """
+        info = self.benchmark.generateArchive(os.path.join(self.root, "archive"), smallFiles=30, largeFiles=1, smallSize=256, largeSize=2**20)
+        archive = Directory(os.path.join(self.root, "archive"))
+        files = archive.getFiles()
+        self.assertEqual(31, len(files))
+        self.assertEqual(info['bytes'], archive.getSize())
+        self.assertTrue(archive.checkIntegrity())
+        for f in files:
+            self.assertEqual(prefs.IMPORTING_ORGANIZE_BY[prefs.MEDIA_DB_DIR_STRUCTURE](archive.getPath(), f), f.getDir())
+        
+        hashing.flushHashIndexes()
+        stored = set(os.listdir(hashing.HASH_INDEX_ROOT))
+        results = self.benchmark.runBenchmarks(archive.getPath(), os.path.join(self.root, "work"), repeat=1, sample=5)
+        hashing.flushHashIndexes()
+        self.assertEqual(stored, set(os.listdir(hashing.HASH_INDEX_ROOT)))
+        self.assertEqual(set(self.benchmark.BENCHMARKS), set(results))
+        self.assertEqual(6, results['copyTo']['items'])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "work")))
+        json.dumps(results)
+        with self.assertRaises(ValueError):
+            self.benchmark.runBenchmarks(archive.getPath(), os.path.join(self.root, "work"), names=['invalid'])
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        import metrics
+        self.metrics = metrics
+        metrics.reset()
+        os.makedirs(os.path.abspath("fixtures"))
+        self.fpath = os.path.abspath("fixtures/testfile.dat")
+        with open(self.fpath, 'wb') as f:
+            f.write(os.urandom(4096))
+    
+    def tearDown(self):
+        self.metrics.disable()
+        self.metrics.reset()
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_disabled_metrics_record_nothing(self):
+        """ While disabled, instrumented routines do not record anything, and timers are a shared no-op """
+        File(self.fpath).copyTo(os.path.abspath("fixtures/out/copy.dat"))
+        self.assertEqual({}, self.metrics.snapshot()['counters'])
+        self.assertIs(self.metrics.timer('a'), self.metrics.timer('b'))
+    
+    def test_copying_and_hashing_are_measured(self):
+        """ Copies, hashing and stat calls feed counters and latency histograms """
+        self.metrics.enable()
+        f = File(self.fpath)
+        f.copyTo(os.path.abspath("fixtures/out/copy.dat"), verify=True)
+        snap = self.metrics.snapshot()
+        self.assertEqual(4096, snap['counters']['copied_bytes'])
+        self.assertEqual(1, snap['counters']['files_copied'])
+        self.assertEqual(4096, snap['counters']['hashed_bytes'])
+        self.assertGreaterEqual(snap['counters']['stat_calls'], 1)
+        self.assertEqual(1, snap['histograms']['copy_seconds']['count'])
+        self.assertTrue(any(line.startswith("copied_bytes: 4096") for line in self.metrics.formatStats()))
+    
+    def test_prometheus_textfile_export(self):
+        """ Metrics are exported in Prometheus text format, with cumulative histogram buckets """
+        self.metrics.enable()
+        self.metrics.count('files_imported', 3)
+        self.metrics.observe('import_seconds', 0.002)
+        self.metrics.observe('import_seconds', 100)
+        promPath = os.path.abspath("fixtures/cariama.prom")
+        self.metrics.writeTextfile(promPath, labels={'command':'import'})
+        with open(promPath) as f:
+            text = f.read()
+        self.assertIn('cariama_files_imported_total{command="import"} 3\n', text)
+        self.assertIn('cariama_import_seconds_bucket{command="import",le="0.005"} 1\n', text)
+        self.assertIn('cariama_import_seconds_bucket{command="import",le="+Inf"} 2\n', text)
+        self.assertIn('cariama_import_seconds_count{command="import"} 2\n', text)
+        self.assertEqual({"cariama.prom", "testfile.dat"}, set(os.listdir(os.path.abspath("fixtures"))))
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        import logconfig
+        self.logconfig = logconfig
+        os.makedirs(os.path.abspath("fixtures/src"))
+        self.logPath = os.path.abspath("fixtures/logs/test.log")
+    
+    def tearDown(self):
+        self.logconfig.shutdownLogging()
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def readRecords(self):
+        self.logconfig.shutdownLogging() # flushes queue
+        with open(self.logPath) as f:
+            return [json.loads(line) for line in f]
+    
+    def test_logging_is_set_up_once(self):
+        """ Further setups do not stack handlers, so each record is written once """
+        import logging
+        self.assertTrue(self.logconfig.setupLogging(self.logPath))
+        self.assertFalse(self.logconfig.setupLogging(self.logPath))
+        logging.getLogger("test").info("message %d", 1, extra={'duration':0.5})
+        try:
+            raise ValueError("failure")
+        except ValueError:
+            logging.getLogger("test").error("failed", exc_info=True)
+        records = self.readRecords()
+        self.assertEqual(2, len(records))
+        self.assertEqual(("INFO", "message 1", 0.5), (records[0]['level'], records[0]['message'], records[0]['duration']))
+        self.assertIn("ValueError: failure", records[1]['traceback'])
+    
+    def test_imported_files_are_logged_with_durations(self):
+        """ Importing threads log each imported file, with source, destination and duration """
+        self.logconfig.setupLogging(self.logPath)
+        for i in range(3):
+            with open(os.path.abspath("fixtures/src/f%d.dat"%i), 'wb') as f:
+                f.write(os.urandom(100+i))
+        files = Directory(os.path.abspath("fixtures/src")).getFiles()
+        results = list(mgm.importFiles(files, os.path.abspath("fixtures/dst"), jobs=2))
+        self.assertTrue(all(isinstance(res, File) for f, res in results))
+        records = [r for r in self.readRecords() if r['logger']=='fdmgm']
+        self.assertEqual(sorted(f.getPath() for f in files), sorted(r['src'] for r in records))
+        self.assertTrue(all(r['duration']>=0 and r['method']=='copy' and r['dst'].startswith(os.path.abspath("fixtures/dst")) for r in records))
+    
+    def test_log_file_is_rotated(self):
+        """ Log file is rotated by size """
+        import logging
+        self.logconfig.setupLogging(self.logPath, maxBytes=1000, backupCount=2)
+        for i in range(100):
+            logging.getLogger("test").info("message %d", i)
+        self.logconfig.shutdownLogging()
+        self.assertEqual(["test.log", "test.log.1", "test.log.2"], sorted(os.listdir(os.path.dirname(self.logPath))))
+        self.assertLessEqual(os.path.getsize(self.logPath), 1000)
+
+class TestReporting(unittest.TestCase):
+    def setUp(self):
+        import io, reporting
+        self.reporting = reporting
+        self.now = 0.0
+        self.stream = io.StringIO()
+        self.reporter = reporting.ProgressReporter(totalBytes=100*2**20, totalFiles=1001, interval=0.5, stream=self.stream, clock=lambda: self.now)
+    
+    def test_progress_is_redrawn_at_most_once_per_interval(self):
+        """ Many files handled within an interval only cause one redraw """
+        for i in range(1000):
+            self.now += 0.001
+            self.reporter.update(50*2**10)
+        self.assertEqual(2, self.reporter.getDrawCount()) # first update, and once interval passed
+        self.assertEqual(2, len(self.stream.getvalue().splitlines()))
+    
+    def test_progress_tracks_bytes(self):
+        """ Throughput and ETA are computed from bytes, so that a large file weighs as much as its size """
+        self.now = 10.0
+        self.reporter.update(50*2**20) # half of the data, as a single large file
+        self.assertAlmostEqual(5*2**20, self.reporter.getThroughput())
+        self.assertAlmostEqual(10.0, self.reporter.getEta())
+        line = self.reporter.formatLine()
+        self.assertIn(" 50.0%", line)
+        self.assertIn("5.0 MB/s", line)
+        self.assertIn("ETA 0:00:10", line)
+        self.assertIn("1/1001 files", line)
+        self.reporter.write("a message")
+        self.reporter.done()
+        self.assertEqual(["a message"], [l for l in self.stream.getvalue().splitlines() if "files" not in l])
+    
+    def test_formatting(self):
+        """ Amounts of bytes and durations are formatted for humans """
+        self.assertEqual("512 B", self.reporting.formatBytes(512))
+        self.assertEqual("1.5 GB", self.reporting.formatBytes(1.5*2**30))
+        self.assertEqual("1:01:01", self.reporting.formatDuration(3661))
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        import pipeline
+        self.pipeline = pipeline
+        os.makedirs(os.path.abspath("fixtures/src"))
+        os.makedirs(os.path.abspath("fixtures/dst"))
+        for i in range(40):
+            with open(os.path.abspath("fixtures/src/f%02d.dat"%i), 'wb') as f:
+                f.write(os.urandom(100+i))
+        shutil.copy(os.path.abspath("fixtures/src/f07.dat"), os.path.abspath("fixtures/dst/existing.dat"))
+        self.src = Directory(os.path.abspath("fixtures/src"))
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_pipeline_imports_and_drops_duplicates(self):
+        """ Pipeline imports every file streamed from a walk; files already on destination are dropped by the check stage """
+        results = list(self.pipeline.iterImportPipeline(self.src.iterFiles(), os.path.abspath("fixtures/dst"), queueSize=4))
+        self.assertEqual(40, len(results))
+        failed = [(f, res) for f, res in results if isinstance(res, mgm.FileImportingError)]
+        self.assertEqual(1, len(failed))
+        self.assertEqual("f07", failed[0][0].getName())
+        for f, res in results:
+            if isinstance(res, File):
+                self.assertTrue(filecmp.cmp(f.getPath(), res.getPath(), shallow=False))
+        self.assertEqual(40, len(os.listdir(os.path.abspath("fixtures/dst"))))
+    
+    def test_pipeline_may_be_left_early(self):
+        """ Leaving the results loop stops the pipeline; files not started are not imported """
+        it = self.pipeline.iterImportPipeline(self.src.iterFiles(), os.path.abspath("fixtures/dst"), queueSize=2, importWorkers=1)
+        next(it)
+        it.close()
+        self.assertLess(len(os.listdir(os.path.abspath("fixtures/dst"))), 40)
+    
+    def test_pipeline_raises_walk_errors(self):
+        """ Errors of the source walk are raised once files walked before it went through """
+        def walk():
+            yield from self.src.iterFiles()
+            raise NotADirectoryError("walk failed")
+        results = []
+        with self.assertRaises(NotADirectoryError):
+            for item in self.pipeline.iterImportPipeline(walk(), os.path.abspath("fixtures/dst")):
+                results.append(item)
+        self.assertEqual(40, len(results))
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(os.path.abspath("fixtures/dir"))
+        os.makedirs(os.path.abspath("fixtures/store"))
+        self.paths = []
+        for i in range(12):
+            path = os.path.abspath("fixtures/dir/f%02d.dat"%i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(4096))
+            self.paths.append(path)
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_hash_files_on_worker_processes(self):
+        """ Digests computed by worker processes match those computed in process, whatever order they come in """
+        results = dict(hashing.hashFiles(self.paths, workers=2, batchBytes=8192))
+        self.assertEqual(set(self.paths), set(results))
+        for path in self.paths:
+            self.assertEqual(hashing.hashFile(path), results[path])
+        self.assertEqual(dict(hashing.hashFiles([File(p) for p in self.paths], workers=1)), results)
+    
+    def test_hash_files_streams_errors(self):
+        """ Files that cannot be read are yielded with their errors, and do not stop other files from being hashed """
+        missing = os.path.abspath("fixtures/dir/missing.dat")
+        results = dict(hashing.hashFiles(self.paths[:3]+[missing], workers=2, batchBytes=4096))
+        self.assertIsInstance(results[missing], FileNotFoundError)
+        self.assertEqual(hashing.hashFile(self.paths[0]), results[self.paths[0]])
+    
+    def test_find_duplicate_among_same_size_files(self):
+        """ Same-size candidates are hashed at once, and their digests kept on index """
+        index = hashing.HashIndex(os.path.abspath("fixtures/dir"), storeRoot=os.path.abspath("fixtures/store"))
+        src = os.path.abspath("fixtures/src.dat")
+        shutil.copy(self.paths[5], src)
+        self.assertEqual(self.paths[5], index.findDuplicate(src))
+        for path in self.paths:
+            self.assertEqual(hashing.hashFile(path), index.getDigest(os.path.basename(path)))
+        with open(src, 'wb') as f:
+            f.write(os.urandom(4096))
+        self.assertIsNone(index.findDuplicate(src))
+    
+    def test_same_size_candidates_are_hashed_without_lock(self):
+        """ Index lock stays free while same-size candidates are batch hashed """
+        index = hashing.HashIndex(os.path.abspath("fixtures/dir"), storeRoot=None)
+        hashFiles, free = hashing.hashFiles, []
+        def probe():
+            free.append(index.getLock().acquire(timeout=5))
+            index.getLock().release()
+        def hashFilesProbed(*args, **kwargs):
+            thread = threading.Thread(target=probe)
+            thread.start()
+            thread.join()
+            return hashFiles(*args, **kwargs)
+        hashing.hashFiles = hashFilesProbed
+        try:
+            src = os.path.abspath("fixtures/src.dat")
+            shutil.copy(self.paths[3], src)
+            self.assertEqual(self.paths[3], index.findDuplicate(src))
+        finally:
+            hashing.hashFiles = hashFiles
+        self.assertEqual([True], free)
+    
+    def test_reserved_duplicates_are_found_by_later_reservations(self):
+        """ Of two files with the same contents reserved at once, only the one reserved last finds a duplicate """
+        index = hashing.HashIndex(os.path.abspath("fixtures/dir"), storeRoot=None)
+        srcs = [os.path.abspath("fixtures/src%d.dat"%i) for i in range(2)]
+        for src in srcs:
+            with open(src, 'wb') as f:
+                f.write(b"same contents")
+        index.reserve("first.dat", srcs[0])
+        index.reserve("second.dat", srcs[1])
+        self.assertIsNone(index.findDuplicate(srcs[0], reservedAs="first.dat"))
+        self.assertEqual(os.path.abspath("fixtures/dir/first.dat"), index.findDuplicate(srcs[1], reservedAs="second.dat"))
+        self.assertEqual(os.path.abspath("fixtures/dir/first.dat"), index.findDuplicate(srcs[1]))
+    
+    def test_least_recently_used_indexes_are_evicted(self):
+        """ Loaded indexes beyond cache size are persisted and dropped, except those with reservations """
+        cacheSize = hashing.HASH_INDEX_CACHE_SIZE
+        hashing.HASH_INDEX_CACHE_SIZE = 2
+        hashing.flushHashIndexes()
+        with hashing._indexesLock: # indexes loaded by other tests
+            hashing._indexes.clear()
+        try:
+            dirs = [os.path.abspath("fixtures/d%d"%i) for i in range(4)]
+            for d in dirs:
+                os.makedirs(d)
+            first = hashing.getHashIndex(dirs[0])
+            first.reserve("f.dat", self.paths[0])
+            second = hashing.getHashIndex(dirs[1])
+            second.add(os.path.basename(shutil.copy(self.paths[1], dirs[1])))
+            hashing.getHashIndex(dirs[2])
+            self.assertIs(first, hashing.getHashIndex(dirs[0], create=False))
+            self.assertIsNone(hashing.getHashIndex(dirs[1], create=False))
+            self.assertTrue(os.path.exists(second.getStorePath()))
+            hashing.getHashIndex(dirs[0])
+            hashing.getHashIndex(dirs[3])
+            self.assertIsNone(hashing.getHashIndex(dirs[2], create=False))
+            first.release("f.dat")
+        finally:
+            hashing.HASH_INDEX_CACHE_SIZE = cacheSize
+            for d in dirs:
+                hashing.removeHashIndex(d)
+    
+    def test_unused_indexes_are_removed_or_expire(self):
+        """ Removed indexes leave no persisted file; persisted indexes not used for a while expire """
+        index = hashing.getHashIndex(os.path.abspath("fixtures/dir"))
+        index.getDigest("f00.dat")
+        index.flush()
+        storePath = index.getStorePath()
+        hashing.removeHashIndex(os.path.abspath("fixtures/dir"))
+        self.assertFalse(os.path.exists(storePath))
+        self.assertIsNone(hashing.getHashIndex(os.path.abspath("fixtures/dir"), create=False))
+        index = hashing.getHashIndex(os.path.abspath("fixtures/dir"))
+        index.getDigest("f00.dat")
+        index.flush()
+        old = time.time()-(prefs.HASH_INDEX_MAX_AGE_DAYS+1)*86400
+        os.utime(storePath, (old, old))
+        self.assertEqual(0, hashing.expireHashIndexes()) # still loaded
+        hashing.removeHashIndex(os.path.abspath("fixtures/other")) # never indexed
+        with hashing._indexesLock:
+            del hashing._indexes[os.path.normcase(os.path.abspath("fixtures/dir"))]
+        self.assertEqual(1, hashing.expireHashIndexes())
+        self.assertFalse(os.path.exists(storePath))
+
+class TestFixity(unittest.TestCase):
+    def setUp(self):
+        import fixity
+        self.fixity = fixity
+        os.makedirs(os.path.abspath("fixtures/archive/2015/12"))
+        self.paths = []
+        for i in range(5):
+            path = os.path.abspath("fixtures/archive/2015/12/f%d.dat"%i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000))
+            self.paths.append(path)
+        self.auditor = fixity.FixityAuditor(os.path.abspath("fixtures/archive"), storeRoot=os.path.abspath("fixtures/state"))
+        self.auditor.sync()
+    
+    def tearDown(self):
+        self.auditor.close()
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def audit(self, budget=10**6):
+        return {res.path: res for res in self.auditor.audit(budget, workers=1)}
+    
+    def test_fixity_checksums_then_verifies(self):
+        """ First run takes checksums of every file, and next runs check files against them """
+        self.assertEqual({self.fixity.NEW}, set(res.status for res in self.audit().values()))
+        results = self.audit()
+        self.assertEqual({self.fixity.OK}, set(res.status for res in results.values()))
+        self.assertEqual(hashing.hashFile(self.paths[0]), results[self.paths[0]].actual)
+        self.assertEqual(0, self.auditor.getCounts()['unverified'])
+    
+    def test_fixity_verifies_oldest_first_within_budget(self):
+        """ Each run reads up to its budget, starting from files not verified for the longest time """
+        seen = []
+        for _ in range(5):
+            results = self.audit(budget=1500)
+            self.assertEqual(1, len(results))
+            seen.extend(results)
+        self.assertEqual(sorted(self.paths), sorted(seen))
+        self.assertEqual(2, len(self.audit(budget=2000)))
+    
+    def test_fixity_reports_corrupt_and_changed_files(self):
+        """ Contents changed under the same size and mtime are corrupt; rewritten and missing files are told apart """
+        self.audit()
+        st = os.stat(self.paths[0])
+        with open(self.paths[0], 'r+b') as f:
+            f.write(b'\0')
+        os.utime(self.paths[0], ns=(st.st_atime_ns, st.st_mtime_ns))
+        with open(self.paths[1], 'ab') as f:
+            f.write(b'more')
+        os.remove(self.paths[2])
+        results = self.audit()
+        self.assertEqual(self.fixity.CORRUPT, results[self.paths[0]].status)
+        self.assertEqual(self.fixity.CHANGED, results[self.paths[1]].status)
+        self.assertEqual(self.fixity.MISSING, results[self.paths[2]].status)
+        self.assertEqual([(self.paths[0], self.fixity.CORRUPT), (self.paths[2], self.fixity.MISSING)], list(self.auditor.iterFailures()))
+        # corrupt files keep their reference checksum
+        self.assertEqual(self.fixity.CORRUPT, self.audit()[self.paths[0]].status)
+        self.auditor.sync()
+        self.assertEqual(4, self.auditor.getCounts()['files'])
+    
+    def test_fixity_leaves_out_quarantine_and_journal(self):
+        """ Files on their way into the archive, and the import journal, are not audited """
+        import scanning
+        root = os.path.abspath("fixtures/archive")
+        quarantine = os.path.join(root, "quarantine")
+        os.makedirs(quarantine)
+        with open(os.path.join(quarantine, "new.dat"), 'wb') as f:
+            f.write(os.urandom(100))
+        open(os.path.join(root, prefs.IMPORT_JOURNAL_NAME), 'w').close()
+        with self.fixity.FixityAuditor(root, storeRoot=os.path.abspath("fixtures/state2"), exclude=scanning.archiveExcludes(root, quarantineRoot=quarantine)) as auditor:
+            self.assertEqual(sorted(self.paths), auditor.sync().added)
+            self.assertEqual(5, auditor.getCounts()['files'])
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        import dedup
+        self.dedup = dedup
+        os.makedirs(os.path.abspath("fixtures/archive/2015/11"))
+        os.makedirs(os.path.abspath("fixtures/src"))
+        for i in range(4):
+            with open(os.path.abspath("fixtures/archive/2015/11/f%d.dat"%i), 'wb') as f:
+                f.write(os.urandom(1000+i))
+        self.store = os.path.abspath("fixtures/state")
+        self.archive = dedup.ArchiveDedup(os.path.abspath("fixtures/archive"), storeRoot=self.store, capacity=16)
+        self.archive.update(workers=1)
+    
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_bloom_filter_has_no_false_negatives(self):
+        """ Every added key is found, also after saving and loading the filter; few others are """
+        bloom = self.dedup.BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(b"key%d"%i)
+        bloom.save(os.path.abspath("fixtures/test.bloom"))
+        loaded = self.dedup.BloomFilter.load(os.path.abspath("fixtures/test.bloom"))
+        self.assertEqual(1000, len(loaded))
+        self.assertTrue(all(b"key%d"%i in loaded for i in range(1000)))
+        self.assertLess(sum(b"other%d"%i in loaded for i in range(1000)), 50)
+    
+    def test_duplicate_found_under_another_directory(self):
+        """ A file already archived under another directory is found, and not imported again """
+        src = os.path.abspath("fixtures/src/copy.dat")
+        shutil.copy(os.path.abspath("fixtures/archive/2015/11/f2.dat"), src)
+        self.assertEqual(os.path.abspath("fixtures/archive/2015/11/f2.dat"), self.archive.findDuplicate(src))
+        with self.assertRaises(mgm.FileImportingError):
+            mgm.importFile(File(src), os.path.abspath("fixtures/archive/2015/12"), dedup=self.archive)
+        self.assertFalse(os.path.exists(os.path.abspath("fixtures/archive/2015/12")))
+    
+    def test_imported_files_are_recorded(self):
+        """ Imported files are found by later lookups; files of sizes never archived are not even hashed """
+        src = os.path.abspath("fixtures/src/new.dat")
+        with open(src, 'wb') as f:
+            f.write(os.urandom(3000))
+        self.assertEqual((None, None), self.archive.lookup(src))
+        newf = mgm.importFile(File(src), os.path.abspath("fixtures/archive/2015/12"), dedup=self.archive)
+        self.assertEqual(newf.getPath(), self.archive.findDuplicate(src))
+        self.assertEqual(5, len(self.archive))
+    
+    def test_filters_are_reloaded_or_rebuilt(self):
+        """ Persisted filters survive reopening; filters grow when full, and stale ones are rebuilt from the catalog """
+        for i in range(20):
+            path = os.path.abspath("fixtures/archive/2015/11/g%d.dat"%i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(500+i))
+            self.archive.add(path)
+        self.archive.close()
+        os.remove(self.archive.getStorePath()+'.digests.bloom')
+        self.archive = self.dedup.ArchiveDedup(os.path.abspath("fixtures/archive"), storeRoot=self.store, capacity=16)
+        self.assertEqual(24, len(self.archive))
+        src = os.path.abspath("fixtures/src/copy.dat")
+        shutil.copy(os.path.abspath("fixtures/archive/2015/11/g7.dat"), src)
+        self.assertEqual(os.path.abspath("fixtures/archive/2015/11/g7.dat"), self.archive.findDuplicate(src))
+    
+    def test_reserved_contents_are_imported_once(self):
+        """ Contents reserved by a file on its way to the archive are found by concurrent lookups, until released """
+        data = os.urandom(2000)
+        srcs = [os.path.abspath("fixtures/src/same%d.dat"%i) for i in range(4)]
+        for src in srcs:
+            with open(src, 'wb') as f:
+                f.write(data)
+        self.assertEqual((None, None), self.archive.reserve(srcs[0]))
+        self.assertEqual(srcs[0], self.archive.reserve(srcs[1])[0])
+        self.archive.release(srcs[0])
+        self.assertIsNone(self.archive.lookup(srcs[1])[0])
+        results = list(mgm.importFiles([File(src) for src in srcs], os.path.abspath("fixtures/archive/2015/12"), jobs=4, dedup=self.archive))
+        self.assertEqual(1, sum(not isinstance(newf, mgm.FileImportingError) for f, newf in results))
+        self.assertEqual(1, len(os.listdir(os.path.abspath("fixtures/archive/2015/12"))))
+    
+    def test_quarantine_inside_archive_is_imported_once(self):
+        """ Quarantine and journal under archive root are not indexed; of two identical files being imported, one is """
+        import scanning
+        root = os.path.abspath("fixtures/archive")
+        quarantine = os.path.join(root, "quarantine")
+        os.makedirs(quarantine)
+        srcs = [os.path.join(quarantine, "same%d.dat"%i) for i in range(2)]
+        open(os.path.join(root, prefs.IMPORT_JOURNAL_NAME), 'w').close()
+        for i, exclude in enumerate((scanning.archiveExcludes(root, quarantineRoot=quarantine), [])):
+            data = os.urandom(1500)
+            for src in srcs:
+                with open(src, 'wb') as f:
+                    f.write(data)
+            with self.dedup.ArchiveDedup(root, storeRoot=os.path.abspath("fixtures/state%d"%i), capacity=16, exclude=exclude) as archive:
+                archive.update(workers=1)
+                self.assertEqual(4 if exclude else 8, len(archive)) # unexcluded: quarantine, journal and first import
+                dst = os.path.join(root, "2016/%02d"%(i+1))
+                results = []
+                for src in srcs:
+                    try:
+                        results.append(mgm.importFile(File(src), dst, dedup=archive))
+                    except mgm.FileImportingError as e:
+                        results.append(e)
+                imported = [res for res in results if isinstance(res, File)]
+                self.assertEqual(1, len(imported))
+                self.assertEqual(1, len(os.listdir(dst)))
+    
+    def test_filters_are_persisted_on_close(self):
+        """ Adding files commits the catalog only; filters are written when closing """
+        bloomPath = self.archive.getStorePath()+'.digests.bloom'
+        os.remove(bloomPath)
+        for i in range(3):
+            path = os.path.abspath("fixtures/archive/2015/11/g%d.dat"%i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(500+i))
+            self.archive.add(path, commitEvery=1)
+        self.assertFalse(os.path.exists(bloomPath))
+        self.archive.close()
+        self.archive = self.dedup.ArchiveDedup(os.path.abspath("fixtures/archive"), storeRoot=self.store, capacity=16)
+        self.assertEqual(self.dedup.BloomFilter.load(bloomPath).generation, self.dedup.BloomFilter.load(self.archive.getStorePath()+'.sizes.bloom').generation)
+        self.assertEqual(7, len(self.archive))
+
+class TestManager(unittest.TestCase):
+    def setUp(self):
+        import argparse, manager
+        self.manager = manager
+        self.parser = argparse.ArgumentParser()
+        manager.addSelectorArguments(self.parser.add_mutually_exclusive_group())
+        os.makedirs(os.path.abspath("fixtures/sel/sub"))
+        self.paths = [os.path.abspath(p) for p in ("fixtures/sel/a.jpg", "fixtures/sel/b.png", "fixtures/sel/sub/c.jpg")]
+        for path in self.paths:
+            open(path, 'w').close()
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.abspath("fixtures"))
+    
+    def test_paths_are_read_from_stream_as_they_arrive(self):
+        """ Paths are split on NUL if a NUL comes before the first newline, and on newlines otherwise, across reads """
+        import io
+        self.assertEqual(["a b", "c"], list(self.manager.iterPathsFromStream(io.BytesIO(b"a b\0c\0"), bufferSize=2)))
+        self.assertEqual(["a b", "c\nd"], list(self.manager.iterPathsFromStream(io.BytesIO(b"a b\0c\nd"))))
+        self.assertEqual(["a", "b", "c"], list(self.manager.iterPathsFromStream(io.BytesIO(b"a\r\n\nb\nc\r\n"), bufferSize=3)))
+        self.assertEqual([], list(self.manager.iterPathsFromStream(io.BytesIO(b""))))
+    
+    def test_files_are_streamed_from_paths(self):
+        """ Directories are walked recursively, files are taken as they are """
+        files = list(self.manager.iterFilesFromPaths([os.path.abspath("fixtures/sel/sub"), self.paths[0]]))
+        self.assertEqual([self.paths[2], self.paths[0]], [f.getPath() for f in files])
+    
+    @unittest.skipUnless(importlib.util.find_spec('clint'), "clint is not installed")
+    def test_invalid_paths_are_skipped(self):
+        """ Invalid paths are reported and skipped """
+        files = list(self.manager.iterFilesFromPaths([os.path.abspath("fixtures/sel/missing.jpg"), self.paths[1]]))
+        self.assertEqual([self.paths[1]], [f.getPath() for f in files])
+    
+    def test_files_are_selected_from_command_line(self):
+        """ --paths, --glob and --from-file select the same files, without opening a file dialog """
+        listFile = os.path.abspath("fixtures/list.txt")
+        with open(listFile, 'wb') as f:
+            f.write(b"\0".join(os.fsencode(p) for p in self.paths))
+        for argv in (['--paths']+self.paths, ['--glob', os.path.abspath("fixtures/sel/**/*.*")], ['--from-file', listFile]):
+            args = self.parser.parse_args(argv)
+            self.assertTrue(self.manager.hasSelection(args))
+            self.assertEqual(sorted(self.paths), sorted(f.getPath() for f in self.manager.getSelectedFiles(args)))
+        self.assertFalse(self.manager.hasSelection(self.parser.parse_args([])))
+        with self.assertRaises(SystemExit):
+            self.parser.parse_args(['--paths', self.paths[0], '--glob', '*'])
+
 def main():
     
     open(os.path.abspath("file.txt"),'a').close()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+"""
+This module watches a directory tree (usually the quarantine) and imports
+files into the media database as soon as they are completely written
+
+Changes are received from Linux inotify, called through ctypes. Where
+inotify is not available, the tree is rescanned periodically instead (see
+scanning module). Files only count as settled after some quiet time with
+no events and no change of size or mtime, so files still being written are
+left alone. Imports may be throttled to a byte rate, so that a daily
+volume is spread evenly along the day instead of saturating the disks
+
+Name:        CARIAMA Directory Watching Module
+Package:     CARIAMA Media Archive Utilities
+"""
+
+import os, json, time, errno, select, struct, hashlib, logging
+import ctypes, ctypes.util
+import fdmgm, scanning
+import indexing as indx
+from fdmgm import File, FileImportingError
+from preferences import WATCH_STATE_ROOT
+
+__author__ = "Pedro Correia de Siracusa"
+__copyright__ = "Copyright 2015, CARIAMA project"
+__credits__ = ["Pedro de Siracusa"]
+
+__licence__ = "Still not defined"
+__version__ = "0.1"
+__maintainer__ = "Pedro de Siracusa"
+__email__ = "pedrosiracusa@gmail.com"
+__status__ = "Development"
+
+
+""" inotify constants (linux/inotify.h) """
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+class InotifyWatcher:
+    """
+    Recursive directory watcher built on Linux inotify
+
+    Args:
+        rootPath(str): Path to the watched directory
+
+    Raises:
+        OSError: If inotify is not available
+    """
+    def __init__(self, rootPath):
+        libcName = ctypes.util.find_library('c')
+        if libcName is None:
+            raise OSError(errno.ENOSYS, "C library not found")
+        self.__libc = ctypes.CDLL(libcName, use_errno=True)
+        if not hasattr(self.__libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify not available")
+        self.__libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd<0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.__rootPath = os.path.abspath(rootPath)
+        self.__watches = {} # wd -> directory path
+        self.__overflowed = False
+        self.__pending = set(self.__addTree(self.__rootPath)) # files already there are reported on first poll
+
+    def __addWatch(self, dirPath):
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(dirPath), WATCH_MASK)
+        if wd<0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), dirPath)
+        self.__watches[wd] = dirPath
+
+    def __addTree(self, dirPath):
+        """ Watches a directory and its subdirectories. Returns paths of files already there """
+        found = []
+        for dirPath, dirNames, fileNames in os.walk(dirPath):
+            try:
+                self.__addWatch(dirPath)
+            except FileNotFoundError:
+                continue
+            found.extend(os.path.join(dirPath, name) for name in fileNames)
+        return found
+
+    def poll(self, timeout):
+        """
+        Waits for changes
+
+        Args:
+            timeout(float): Maximum waiting time, in seconds
+
+        Returns:
+            Set of paths of files that were created, written, renamed or removed
+        """
+        changed, self.__pending = self.__pending, set()
+        if self.__overflowed: # events were lost; report every file
+            self.__overflowed = False
+            changed.update(self.__addTree(self.__rootPath))
+
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if not ready:
+            return changed
+        try:
+            data = os.read(self.__fd, 65536)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset<len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.__overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self.__watches.pop(wd, None)
+                continue
+            dirPath = self.__watches.get(wd)
+            if dirPath is None or not name:
+                continue
+            path = os.path.join(dirPath, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO): # files may be inside already
+                    changed.update(self.__addTree(path))
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        """ Stops watching """
+        if self.__fd>=0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+
+class PollingWatcher:
+    """
+    Directory watcher which rescans the tree periodically. Only directories whose mtime changed are listed
+
+    Args:
+        rootPath(str): Path to the watched directory
+        interval(float, optional): Minimum time between scans, in seconds. Defaults to 5
+    """
+    def __init__(self, rootPath, interval=5):
+        self.__scanner = scanning.ArchiveScanner(rootPath, storeRoot=None)
+        self.__interval = interval
+        self.__pending = set(self.__scanner.scan(save=False).added)
+
+    def poll(self, timeout):
+        """ Waits for changes. See InotifyWatcher.poll() """
+        if self.__pending:
+            changed, self.__pending = self.__pending, set()
+            return changed
+        time.sleep(max(timeout, self.__interval))
+        diff = self.__scanner.scan(save=False)
+        return set(diff.added) | set(diff.modified) | set(diff.removed)
+
+    def close(self):
+        pass
+
+
+def getWatcher(rootPath, polling=False, interval=5):
+    """
+    Builds the best watcher available for a directory
+    @param rootPath: Path to the watched directory
+    @param polling: If True, a polling watcher is used even where inotify is available
+    @param interval: Time between scans of polling watchers, in seconds
+    @return: InotifyWatcher or PollingWatcher object
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(rootPath)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(rootPath, interval)
+
+
+class SettleTracker:
+    """
+    Debounces file changes: a file is settled when it had no events for settleTime seconds,
+    and its size and mtime did not change between the last two checks
+
+    Args:
+        settleTime(float, optional): Quiet time, in seconds. Defaults to 10
+        clock(callable, optional): Time source. Defaults to time.monotonic
+
+    Attributes:
+        private pending: Dict of path -> [time of last change, (size, mtime_ns) seen on last check]
+    """
+    def __init__(self, settleTime=10, clock=time.monotonic):
+        self.__settleTime = settleTime
+        self.__clock = clock
+        self.__pending = {}
+
+    def touch(self, path):
+        """ Records a change of a file """
+        entry = self.__pending.get(path)
+        if entry is None:
+            self.__pending[path] = [self.__clock(), None]
+        else:
+            entry[0] = self.__clock()
+
+    def discard(self, path):
+        """ Stops tracking a file """
+        self.__pending.pop(path, None)
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def popSettled(self):
+        """
+        Retrieves files which settled since last call. Files which vanished are dropped
+
+        Returns:
+            List of file paths, in order of last change
+        """
+        now = self.__clock()
+        settled = []
+        for path, entry in list(self.__pending.items()):
+            if now-entry[0]<self.__settleTime:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.__pending[path]
+                continue
+            meta = (st.st_size, st.st_mtime_ns)
+            if entry[1]!=meta: # changed silently, or first check: wait one more period
+                entry[0], entry[1] = now, meta
+                continue
+            settled.append((entry[0], path))
+            del self.__pending[path]
+        return [path for t, path in sorted(settled)]
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the amount of bytes processed per second. Work larger than the bucket
+    is allowed, and paid for by waiting afterwards
+
+    Args:
+        rate(float): Bytes per second. If None, nothing is limited
+        burst(float, optional): Bucket size, in bytes. Defaults to one second of rate
+        clock(callable, optional): Time source. Defaults to time.monotonic
+        sleep(callable, optional): Waiting function. Defaults to time.sleep
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.__rate = rate
+        self.__burst = rate if burst is None else burst
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__tokens = self.__burst
+        self.__last = clock()
+
+    @classmethod
+    def fromDailyBudget(cls, bytesPerDay, **kwargs):
+        """ Builds a limiter that spreads a daily volume evenly along the day """
+        return cls(bytesPerDay/86400.0, **kwargs)
+
+    def acquire(self, amount):
+        """
+        Waits until an amount of bytes may be processed
+        @param amount: Number of bytes
+        @return: Time waited, in seconds
+        """
+        if self.__rate is None:
+            return 0
+        now = self.__clock()
+        self.__tokens = min(self.__burst, self.__tokens+(now-self.__last)*self.__rate)
+        self.__last = now
+        waited = 0
+        if self.__tokens<0: # still paying for previous work
+            waited = -self.__tokens/self.__rate
+            self.__sleep(waited)
+            self.__tokens = 0
+            self.__last = self.__clock()
+        self.__tokens -= amount
+        return waited
+
+
+class QuarantineWatcher:
+    """
+    Imports files placed on a watched directory as soon as they settle: files are indexed,
+    if not indexed yet, and imported into the media database
+
+    Args:
+        watchPath(str): Path to the watched directory
+        dstRootPath(str): Root of destination directory
+        organizeBy(str, optional): Files organizational method. See fdmgm.importFile()
+        mediaType(str, optional): Media type of files which are not indexed yet. Defaults to None
+        settleTime(float, optional): Quiet time before a file is imported, in seconds. Defaults to 10
+        rateLimiter(RateLimiter, optional): Throttles imports. Only bytes actually imported are charged. Defaults to None (no throttling)
+        watcher(optional): Source of changes. Defaults to getWatcher(watchPath)
+        storeRoot(str, optional): Directory where handled files are persisted, so that restarts do not import them again.
+            If None, they are kept only in memory. Default defined on preferences module
+        importOptions(optional): Further keyword arguments to fdmgm.importFile(). Files are copied unless copy=False (or a method) is given
+
+    Attributes:
+        private handled: Dict of path -> (size, mtime_ns) of files which were copied, or could not be imported. They are
+            only processed again when they change, and dropped when they leave the watched directory
+    """
+    def __init__(self, watchPath, dstRootPath, organizeBy=None, mediaType=None, settleTime=10, rateLimiter=None, watcher=None,
+                 storeRoot=WATCH_STATE_ROOT, **importOptions):
+        self.__watchPath = os.path.abspath(watchPath)
+        self.__dstRootPath = dstRootPath
+        self.__organizeBy = organizeBy
+        self.__mediaType = mediaType
+        self.__tracker = SettleTracker(settleTime)
+        self.__limiter = rateLimiter
+        self.__watcher = watcher if watcher is not None else getWatcher(watchPath)
+        self.__importOptions = dict(importOptions)
+        self.__storeRoot = storeRoot
+        self.__handled = {}
+        self.__logger = logging.getLogger(__name__)
+        self.__load()
+
+    def getStorePath(self):
+        """ Retrieves path of the file where handled files are persisted, or None if they are not persisted """
+        if self.__storeRoot is None:
+            return None
+        key = hashlib.sha1(os.path.normcase(self.__watchPath).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.__storeRoot, key+'.json')
+
+    def __load(self):
+        """ Loads persisted handled files which are still unchanged. Corrupt or foreign stores are ignored """
+        storePath = self.getStorePath()
+        if storePath is None:
+            return
+        try:
+            with open(storePath, 'r') as f:
+                data = json.load(f)
+            if data.get('root')!=self.__watchPath:
+                return
+            handled = data['handled']
+        except (OSError, ValueError, KeyError):
+            return
+        for path, stat in handled.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if list(stat)==[st.st_size, st.st_mtime_ns]:
+                self.__handled[path] = (st.st_size, st.st_mtime_ns)
+        if len(self.__handled)<len(handled): # files left or changed meanwhile
+            self.save()
+
+    def save(self):
+        """ Persists handled files """
+        storePath = self.getStorePath()
+        if storePath is None:
+            return
+        os.makedirs(self.__storeRoot, exist_ok=True)
+        tmpPath = storePath+'.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'root':self.__watchPath, 'handled':self.__handled}, f)
+        os.replace(tmpPath, storePath)
+
+    def __processFile(self, f):
+        """ Indexes and imports a settled file. Returns imported File """
+        try:
+            indx.parseIndex(f.getName())
+        except indx.ParserError: # file is not indexed yet
+            f.setIndex()
+        size = f.getSize()
+        if self.__limiter is not None:
+            self.__limiter.acquire(0) # pay for previous imports; this one is charged once written
+        newf = fdmgm.importFile(f, self.__dstRootPath, organizeBy=self.__organizeBy, **self.__importOptions)
+        if self.__limiter is not None:
+            self.__limiter.acquire(size)
+        return newf
+
+    def step(self, timeout=1):
+        """
+        Waits for changes once, and processes files that settled
+
+        Args:
+            timeout(float, optional): Maximum waiting time, in seconds. Defaults to 1
+
+        Returns:
+            List of (path, imported File or exception) tuples
+        """
+        changed = False
+        for path in self.__watcher.poll(timeout):
+            if path in self.__handled:
+                try:
+                    st = os.stat(path)
+                    if self.__handled[path]==(st.st_size, st.st_mtime_ns):
+                        continue
+                except FileNotFoundError:
+                    pass
+                del self.__handled[path]
+                changed = True
+            self.__tracker.touch(path)
+
+        results = []
+        for path in self.__tracker.popSettled():
+            f = None
+            try:
+                f = File(path, mediaType=self.__mediaType)
+                res = self.__processFile(f) # logged by importing routine
+            except FileNotFoundError: # file left before being imported
+                continue
+            except (FileImportingError, indx.FileIndexingError, ValueError, KeyError, OSError) as e:
+                res = e
+                self.__logger.error("Could not import file %s: %s"%(path, e))
+            try: # a copied file stays, and may have been renamed by indexing
+                if (os.path.dirname(f.getPath())+os.sep).startswith(self.__watchPath+os.sep): # moved files left
+                    st = os.stat(f.getPath())
+                    self.__handled[f.getPath()] = (st.st_size, st.st_mtime_ns)
+                    changed = True
+            except (FileNotFoundError, AttributeError, TypeError):
+                pass
+            results.append((path, res))
+        if changed:
+            self.save()
+        return results
+
+    def run(self, timeout=1, maxIdle=None):
+        """
+        Watches and imports files until interrupted
+
+        Args:
+            timeout(float, optional): Waiting time of each watching step, in seconds. Defaults to 1
+            maxIdle(float, optional): Stop after this many seconds with nothing pending. Defaults to None (run forever)
+
+        Yields:
+            (path, imported File or exception) tuples
+        """
+        idleSince = time.monotonic()
+        try:
+            while True:
+                for res in self.step(timeout):
+                    yield res
+                if len(self.__tracker):
+                    idleSince = time.monotonic()
+                elif maxIdle is not None and time.monotonic()-idleSince>=maxIdle:
+                    return
+        finally:
+            self.__watcher.close()